@@ -0,0 +1,256 @@
+"""
+Loading of the model assets exported by the lap-risk study.
+
+Two formats are supported:
+
+- the original pickle of the study export (production_assets.pkl), which
+  holds the fitted pygam and sklearn objects
+- a compact directory exported from it, holding only what inference needs:
+  a JSON manifest (term specs, link / distribution names, category
+  encodings) plus each coefficient vector, covariance matrix and quantile
+  transformer table as an uncompressed .npy file. Loading it skips
+  unpickling the pygam / sklearn object graph, and the arrays are
+  memory-mapped read-only so worker processes share their pages.
+
+Both formats identify the models by the SHA-256 of the source pickle.
+"""
+
+import hashlib
+import json
+import pickle
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+COMPACT_FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+DEFAULT_ASSET_PATH = Path(__file__).resolve().parent / "production_assets.pkl"
+
+MODEL_NAMES = ("mortality", "lactate", "albumin")
+TRANSFORMER_NAMES = ("lactate", "albumin")
+
+
+class CompactGAM:
+    """
+    Fitted GAM reconstructed from the compact asset format.
+
+    Has the attributes used by the inference pipeline (coef_, statistics_,
+    link, distribution) and describes its terms with term_specs rather than
+    pygam term objects, so its model matrix is always built by
+    app.prediction.design.ModelMatrix.
+    """
+
+    def __init__(
+        self,
+        coef: np.ndarray,
+        cov: np.ndarray,
+        m_features: int,
+        link: str,
+        distribution: Dict,
+        term_specs: list,
+    ):
+        from pygam.distributions import DISTRIBUTIONS
+        from pygam.links import LINKS
+
+        distribution = dict(distribution)
+        self.coef_ = coef
+        self.statistics_ = {"cov": cov, "m_features": m_features}
+        self.link = LINKS[link]()
+        self.distribution = DISTRIBUTIONS[distribution.pop("name")](**distribution)
+        self.term_specs = term_specs
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_pickle(path: Path) -> Tuple[Dict, Dict]:
+    """Loads the original pickled study export"""
+    with open(path, "rb") as f:
+        study_export = pickle.load(f)
+
+    info = {"path": str(path), "format": "pickle", "sha256": file_sha256(path)}
+    return study_export, info
+
+
+def load_compact(directory: Path, mmap: bool = True) -> Tuple[Dict, Dict]:
+    """
+    Loads assets exported by export_compact()
+
+    Args:
+        directory: Directory containing the manifest and arrays
+        mmap: Whether to memory-map the arrays read-only rather than read them
+            into memory
+
+    Returns:
+        study_export: Dictionary with the same layout as the original export,
+            for the entries used by the app
+        info: path, format and sha256 of the source pickle
+    """
+    directory = Path(directory)
+    with open(directory / MANIFEST) as f:
+        manifest = json.load(f)
+
+    if manifest["format_version"] != COMPACT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported compact asset format {manifest['format_version']}, "
+            f"expected {COMPACT_FORMAT_VERSION}"
+        )
+
+    def array(filename: str) -> np.ndarray:
+        return np.load(directory / filename, mmap_mode="r" if mmap else None)
+
+    study_export = {
+        "winsor_thresholds": manifest["winsor_thresholds"],
+        "label_encoding": {k: tuple(v) for k, v in manifest["label_encoding"].items()},
+    }
+    for name, model in manifest["models"].items():
+        study_export[name] = {
+            "model": CompactGAM(
+                coef=array(model["coef"]),
+                cov=array(model["cov"]),
+                m_features=model["m_features"],
+                link=model["link"],
+                distribution=model["distribution"],
+                term_specs=model["terms"],
+            )
+        }
+
+    from sklearn.preprocessing import QuantileTransformer
+
+    for name, table in manifest["transformers"].items():
+        transformer = QuantileTransformer(
+            n_quantiles=table["n_quantiles"],
+            output_distribution=table["output_distribution"],
+        )
+        transformer.n_quantiles_ = table["n_quantiles"]
+        transformer.n_features_in_ = 1
+        transformer.quantiles_ = array(table["quantiles"])
+        transformer.references_ = array(table["references"])
+        study_export[name]["transformer"] = transformer
+
+    study_export["mortality"]["input_data"] = {
+        "unique_categories": {
+            k: np.array(v) for k, v in manifest["unique_categories"].items()
+        }
+    }
+
+    info = {
+        "path": str(directory),
+        "format": "compact",
+        "sha256": manifest["source_sha256"],
+    }
+    return study_export, info
+
+
+def export_compact(source: Path, directory: Path):
+    """
+    Exports the pickled study export to the compact format
+
+    Args:
+        source: Path to the pickled study export
+        directory: Directory to write the manifest and arrays to, created if
+            it doesn't exist
+    """
+    from app.prediction.design import term_specs
+
+    study_export, info = load_pickle(Path(source))
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    def save(filename: str, array: np.ndarray) -> str:
+        np.save(directory / filename, np.ascontiguousarray(array, dtype=np.float64))
+        return filename
+
+    models = {}
+    for name in MODEL_NAMES:
+        gam = study_export[name]["model"]
+        distribution = {"name": gam.distribution._name}
+        if gam.distribution._name == "binomial":
+            distribution["levels"] = gam.distribution.levels
+        else:
+            distribution["scale"] = gam.distribution.scale
+        models[name] = {
+            "coef": save(f"{name}_coef.npy", gam.coef_),
+            "cov": save(f"{name}_cov.npy", gam.statistics_["cov"]),
+            "m_features": int(gam.statistics_["m_features"]),
+            "link": gam.link._name,
+            "distribution": distribution,
+            "terms": term_specs(gam),
+        }
+
+    transformers = {}
+    for name in TRANSFORMER_NAMES:
+        transformer = study_export[name]["transformer"]
+        transformers[name] = {
+            "n_quantiles": int(transformer.n_quantiles_),
+            "output_distribution": transformer.output_distribution,
+            "quantiles": save(f"{name}_quantiles.npy", transformer.quantiles_),
+            "references": save(f"{name}_references.npy", transformer.references_),
+        }
+
+    manifest = {
+        "format_version": COMPACT_FORMAT_VERSION,
+        "source_sha256": info["sha256"],
+        "models": models,
+        "transformers": transformers,
+        "unique_categories": {
+            k: np.asarray(v).tolist()
+            for k, v in study_export["mortality"]["input_data"][
+                "unique_categories"
+            ].items()
+        },
+        "winsor_thresholds": study_export["winsor_thresholds"],
+        "label_encoding": study_export["label_encoding"],
+    }
+    with open(directory / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def resolve_asset_path(path: Optional[str] = None) -> Path:
+    """
+    Asset file or directory to load
+
+    Args:
+        path: Asset file or directory. Relative paths are resolved against
+            the package rather than the working directory. Defaults to the
+            bundled production_assets.pkl
+    """
+    path = DEFAULT_ASSET_PATH if not path else Path(path)
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parents[2] / path
+    return path
+
+
+def load_assets(path: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """
+    Loads the model assets, from the compact format if path is a directory
+    and from the pickled study export otherwise
+
+    Args:
+        path: Asset file or directory, see resolve_asset_path()
+
+    Returns:
+        study_export: The study export dictionary
+        info: path, format and sha256 (of the source pickle) of the assets
+    """
+    path = resolve_asset_path(path)
+    if path.is_dir():
+        return load_compact(path)
+    return load_pickle(path)
+
+
+if __name__ == "__main__":
+    # python -m app.Fixtures.assets OUTPUT_DIRECTORY [SOURCE_PICKLE]
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: python -m app.Fixtures.assets OUTPUT_DIRECTORY [SOURCE]")
+    export_compact(
+        sys.argv[2] if len(sys.argv) == 3 else DEFAULT_ASSET_PATH, Path(sys.argv[1])
+    )
@@ -1,5 +1,34 @@
 RANDOM_SEED = 1067641072
 
+# number of mortality risks sampled when lactate and albumin are both present
+MORTALITY_DRAWS = 10000
+# number of lactate / albumin values imputed for each missing variable
+IMPUTATION_DRAWS = 10
+# number of mortality risks sampled for each row of imputed input
+IMPUTED_MORTALITY_DRAWS = 100
+# most mortality risks sampled for one patient, however the draws are set
+MAX_SAMPLES = 1000000
+# most coefficient vectors a request may draw from any one model, as each is
+# a row of the cached draw matrix
+MAX_DRAWS = 100000
+# blocks of draws sampled, checking for convergence after each, when
+# stopping early, and the fewest blocks sampled before stopping
+ADAPTIVE_BLOCKS = 10
+ADAPTIVE_MIN_BLOCKS = 4
+# how the coefficient draws can be generated, pseudo-random or quasi-random
+# (scrambled Sobol' points or a Latin hypercube), see sampling.py
+SAMPLERS = ("random", "sobol", "lhs")
+# float precisions the mortality risks can be sampled in, see predict.py
+PRECISIONS = ("float64", "float32")
+# maximum number of patients scored by a single /predict/batch request
+MAX_BATCH_SIZE = 1000
+# most values of a variable /predict/sweep predicts at
+MAX_SWEEP_POINTS = 100
+# records scored together by /predict/stream
+STREAM_CHUNK_SIZE = 256
+# longest /predict/stream record accepted, in bytes
+MAX_RECORD_BYTES = 64 * 1024
+
 WINSOR_THRESHOLDS = {
     "Age": [18.0, 96.0],
     "Creat": [20.0, 758.7750000000087],
@@ -63,3 +92,41 @@ MORTALITY_INPUT_VARIABLES = IMPUTATION_INPUT_VARIABLES + (
     "S03PreOpArterialBloodLactate",
     "S03PreOpArterialBloodLactate_missing",
 )
+
+# columns of the mortality model inputs holding lactate / albumin, which are
+# the only ones that differ between a patient's imputed rows
+LACTATE_COLUMN = MORTALITY_INPUT_VARIABLES.index("S03PreOpArterialBloodLactate")
+ALBUMIN_COLUMN = MORTALITY_INPUT_VARIABLES.index("S03PreOpLowestAlbumin")
+
+# columns of the mortality model inputs flagging imputed lactate / albumin
+LACTATE_MISSING_COLUMN = MORTALITY_INPUT_VARIABLES.index(
+    "S03PreOpArterialBloodLactate_missing"
+)
+ALBUMIN_MISSING_COLUMN = MORTALITY_INPUT_VARIABLES.index(
+    "S03PreOpLowestAlbumin_missing"
+)
+
+# Prediction fields holding each of MORTALITY_INPUT_VARIABLES, in order
+MORTALITY_INPUT_FIELDS = (
+    "CT_performed",
+    "Arrhythmia",
+    "Age",
+    "Creat",
+    "Na",
+    "K",
+    "Urea",
+    "WCC",
+    "HR",
+    "SBP",
+    "GCS",
+    "ASA",
+    "Cardio",
+    "Resp",
+    "Malignancy",
+    "Soiling",
+    "Indication",
+    "Albumin",
+    "Albumin_missing",
+    "Lactate",
+    "Lactate_missing",
+)
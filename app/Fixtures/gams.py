@@ -1,12 +1,88 @@
-import pickle
+"""
+The fitted models and category encodings, loaded from the model assets on
+first use rather than when this module is imported.
 
-study_export = pickle.load(open("app/Fixtures/production_assets.pkl", "rb"))
+The module attributes below are resolved by __getattr__, which loads the
+assets. Modules used by the API should therefore look them up when called
+(gams.MORTALTIY_GAM) rather than import the names, which would load the
+assets at import time.
+"""
 
-MORTALTIY_GAM = study_export["mortality"]["model"]
-LACTATE_GAM = study_export["lactate"]["model"]
-ALBUMIN_GAM = study_export["albumin"]["model"]
+import threading
 
-LACTATE_TRANSFORMER = study_export["lactate"]["transformer"]
-ALBUMIN_TRANSFORMER = study_export["albumin"]["transformer"]
+from app import metrics, settings, startup
+from app.Fixtures.assets import load_assets
 
-CATEGORY_ENCODING = study_export["mortality"]["input_data"]["unique_categories"]
+_ATTRIBUTES = (
+    "study_export",
+    "ASSET_INFO",
+    "MORTALTIY_GAM",
+    "LACTATE_GAM",
+    "ALBUMIN_GAM",
+    "LACTATE_TRANSFORMER",
+    "ALBUMIN_TRANSFORMER",
+    "CATEGORY_ENCODING",
+)
+
+_lock = threading.Lock()
+_loaded = False
+
+
+def read_assets() -> dict:
+    """Loads the model assets, returning the module attributes they give"""
+    with startup.stage("import model libraries"):
+        import pygam  # noqa: F401
+        import sklearn.preprocessing  # noqa: F401
+
+    with startup.stage("load assets"):
+        study_export, info = load_assets(settings.ASSET_PATH)
+
+    attributes = dict(
+        study_export=study_export,
+        ASSET_INFO=info,
+        MORTALTIY_GAM=study_export["mortality"]["model"],
+        LACTATE_GAM=study_export["lactate"]["model"],
+        ALBUMIN_GAM=study_export["albumin"]["model"],
+        LACTATE_TRANSFORMER=study_export["lactate"]["transformer"],
+        ALBUMIN_TRANSFORMER=study_export["albumin"]["transformer"],
+        CATEGORY_ENCODING=study_export["mortality"]["input_data"]["unique_categories"],
+    )
+    metrics.label_model(attributes["MORTALTIY_GAM"], "mortality")
+    metrics.label_model(attributes["LACTATE_GAM"], "lactate")
+    metrics.label_model(attributes["ALBUMIN_GAM"], "albumin")
+    return attributes
+
+
+def load():
+    """Loads the model assets, if they haven't been already"""
+    global _loaded
+
+    with _lock:
+        if _loaded:
+            return
+        globals().update(read_assets())
+        _loaded = True
+
+
+def reload():
+    """
+    Loads the model assets again, e.g. after the asset file has changed,
+    replacing those already loaded. The new assets are read in full before
+    any are replaced, so a failed reload leaves the old ones in place.
+    """
+    global _loaded
+
+    with _lock:
+        globals().update(read_assets())
+        _loaded = True
+
+
+def is_loaded() -> bool:
+    return _loaded
+
+
+def __getattr__(name: str):
+    if name in _ATTRIBUTES:
+        load()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,607 @@
+"""
+Benchmarks of the inference pipeline, on the real model assets and
+synthetic patients.
+
+    python -m app.benchmark [--output results.json] [--baseline baseline.json]
+
+Each benchmark is timed over --repeat calls after --warmup calls, so caches
+filled on first use (coefficient draws, compiled model matrix builders) are
+warm, as they are in a running server. Results are written as JSON holding,
+for each benchmark, the latency percentiles, throughput in patients (or
+draws) per second and the peak memory allocated during one call, as traced
+by tracemalloc, which sees NumPy's allocations.
+
+With --baseline the results are compared against an earlier run, any
+benchmark whose median latency or peak memory grew by more than
+--tolerance is reported, and the exit status is 1 if there were any. Save a
+baseline with --output before starting performance work, on the same
+machine as later runs.
+
+    python -m app.benchmark --convergence [--output convergence.json]
+
+instead measures accuracy rather than speed: how far the summary quantiles
+are from their true values for each sampler (see app/prediction/sampling.py)
+and number of draws, averaged over several seeds (see convergence()).
+
+Synthetic patients have continuous values drawn uniformly across the
+Winsorization range (and a little beyond, to exercise clipping) and
+categories drawn from the model's category encodings. They are generated
+for each pattern of missing lactate and albumin, which take different paths
+through the pipeline.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+
+from app.models import Prediction
+from app.prediction.preprocess import CATEGORY_SPECS
+from app.Fixtures import constants, gams
+
+# which of lactate and albumin are missing, for each pattern
+MISSING_PATTERNS = {
+    "none": (False, False),
+    "lactate": (True, False),
+    "albumin": (False, True),
+    "both": (True, True),
+}
+BATCH_SIZES = (1, 16, 256)
+DRAW_COUNTS = (1000, 10000)
+# stopping tolerance of predict_adaptive, with the server's draw counts
+ADAPTIVE_TOLERANCE = 0.002
+# values of each variable predicted at by predict_sweep
+SWEEP_POINTS = 50
+SWEEP_VARIABLES = ("Age", "Lactate")
+
+# mortality draws, and (imputation, imputed mortality) draws, whose summary
+# error convergence() measures, and the patients and seeds it's averaged over
+CONVERGENCE_DRAWS = (256, 1024, 4096, 16384)
+CONVERGENCE_IMPUTED_DRAWS = ((4, 25), (8, 50), (16, 100), (32, 200))
+CONVERGENCE_PATIENTS = 10
+CONVERGENCE_SEEDS = 5
+# (imputation, imputed mortality) draws of the pseudo-random reference
+# summaries of patients missing one variable or both
+REFERENCE_IMPUTED_DRAWS = {1: (1024, 1000), 2: (64, 1000)}
+
+# fraction of the Winsorization range that synthetic values may fall outside it
+OUT_OF_RANGE_MARGIN = 0.05
+
+PERCENTILES = (50, 90, 99)
+# growth in median latency or peak memory reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+
+class Benchmark(NamedTuple):
+    """A call to time, and how many patients (or draws) each call scores"""
+
+    name: str
+    params: Dict
+    fn: Callable[[], object]
+    items: int
+
+
+def synthetic_patients(
+    n: int, missing: str = "none", seed: int = 0
+) -> List[Prediction]:
+    """
+    Generates valid API inputs
+
+    Args:
+        n: Number of patients
+        missing: Key of MISSING_PATTERNS, which of lactate and albumin to
+            leave out
+        seed: Random seed
+
+    Returns:
+        Synthetic patients
+    """
+    lactate_missing, albumin_missing = MISSING_PATTERNS[missing]
+    rng = np.random.default_rng(seed)
+
+    columns = {}
+    for field, (low, high) in constants.WINSOR_THRESHOLDS.items():
+        margin = OUT_OF_RANGE_MARGIN * (high - low)
+        columns[field] = np.maximum(
+            rng.uniform(low - margin, high + margin, n), 0
+        ).round(1)
+    for spec in CATEGORY_SPECS:
+        columns[spec.field] = rng.choice(gams.CATEGORY_ENCODING[spec.variable], n)
+    for field in ("Arrhythmia", "CT_performed"):
+        columns[field] = rng.random(n) < 0.5
+    if lactate_missing:
+        columns.pop("Lactate")
+    if albumin_missing:
+        columns.pop("Albumin")
+
+    return [
+        Prediction(**{field: values[i].item() for field, values in columns.items()})
+        for i in range(n)
+    ]
+
+
+def benchmarks(
+    batch_sizes: Sequence[int] = BATCH_SIZES,
+    draw_counts: Sequence[int] = DRAW_COUNTS,
+) -> Iterator[Benchmark]:
+    """The benchmarks, from single model evaluations up to /predict"""
+    from app.prediction.budget import DEFAULT_BUDGET
+    from app.prediction.pipeline import predict_many, predict_single, predict_sweep
+    from app.prediction.predict import impute, predict_mortality, quick_sample
+    from app.prediction.preprocess import (
+        pre_process_batch,
+        pre_process_input,
+        sweep_features,
+    )
+
+    complete = pre_process_batch(synthetic_patients(1))
+
+    for draws in draw_counts:
+        yield Benchmark(
+            "quick_sample",
+            {"draws": draws},
+            lambda draws=draws: quick_sample(
+                gams.MORTALTIY_GAM, complete, "mu", draws, constants.RANDOM_SEED
+            ),
+            draws,
+        )
+        yield Benchmark(
+            "predict_mortality",
+            {"draws": draws},
+            lambda draws=draws: predict_mortality(
+                complete, draws, constants.RANDOM_SEED
+            ),
+            draws,
+        )
+
+    for model, gam, transformer in (
+        ("lactate", gams.LACTATE_GAM, gams.LACTATE_TRANSFORMER),
+        ("albumin", gams.ALBUMIN_GAM, gams.ALBUMIN_TRANSFORMER),
+    ):
+        yield Benchmark(
+            "impute",
+            {"model": model},
+            lambda gam=gam, transformer=transformer: impute(
+                complete[:, :17],
+                constants.IMPUTATION_DRAWS,
+                gam,
+                transformer,
+                constants.RANDOM_SEED,
+            ),
+            1,
+        )
+
+    adaptive = DEFAULT_BUDGET._replace(tolerance=ADAPTIVE_TOLERANCE)
+    for missing in MISSING_PATTERNS:
+        processed = pre_process_input(synthetic_patients(1, missing)[0])
+        yield Benchmark(
+            "predict_single",
+            {"missing": missing},
+            lambda processed=processed: predict_single(processed),
+            1,
+        )
+        yield Benchmark(
+            "predict_adaptive",
+            {"missing": missing, "tolerance": ADAPTIVE_TOLERANCE},
+            lambda processed=processed: predict_single(processed, adaptive),
+            1,
+        )
+
+    for missing in MISSING_PATTERNS:
+        for batch_size in batch_sizes:
+            features = pre_process_batch(synthetic_patients(batch_size, missing))
+            yield Benchmark(
+                "predict_many",
+                {"missing": missing, "batch": batch_size},
+                lambda features=features: predict_many(features),
+                batch_size,
+            )
+
+    for missing in MISSING_PATTERNS:
+        patient = synthetic_patients(1, missing)[0]
+        for variable in SWEEP_VARIABLES:
+            lower, upper = constants.WINSOR_THRESHOLDS[variable]
+            features = sweep_features(
+                patient, variable, np.linspace(lower, upper, SWEEP_POINTS)
+            )
+            column = constants.MORTALITY_INPUT_FIELDS.index(variable)
+            yield Benchmark(
+                "predict_sweep",
+                {"missing": missing, "variable": variable},
+                lambda features=features, column=column: predict_sweep(
+                    features, column
+                ),
+                SWEEP_POINTS,
+            )
+
+    yield from api_benchmarks()
+
+
+def api_benchmarks() -> Iterator[Benchmark]:
+    """/predict round trips, through the ASGI app without a network, with
+    the result cache cleared before each"""
+    from fastapi.testclient import TestClient
+
+    from app.main import api
+    from app.prediction.cache import RESULT_CACHE
+
+    client = TestClient(api)
+
+    def round_trip(body: Dict, response_format: str):
+        RESULT_CACHE.clear()
+        response = client.post(f"/predict?format={response_format}", json=body)
+        response.raise_for_status()
+
+    for missing in MISSING_PATTERNS:
+        body = synthetic_patients(1, missing)[0].dict(exclude_none=True)
+        for response_format in ("summary", "full"):
+            yield Benchmark(
+                "api_predict",
+                {"missing": missing, "format": response_format},
+                lambda body=body, response_format=response_format: round_trip(
+                    body, response_format
+                ),
+                1,
+            )
+
+
+def benchmark_name(benchmark: Benchmark) -> str:
+    params = ",".join(f"{key}={value}" for key, value in benchmark.params.items())
+    return f"{benchmark.name}[{params}]"
+
+
+def measure(benchmark: Benchmark, repeat: int, warmup: int) -> Dict:
+    """
+    Times a benchmark
+
+    Args:
+        benchmark: Benchmark to run
+        repeat: Number of timed calls
+        warmup: Number of untimed calls first
+
+    Returns:
+        Latency percentiles and mean in ms, throughput in items per second
+        and the peak memory allocated during one call in MB
+    """
+    for _ in range(warmup):
+        benchmark.fn()
+
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        benchmark.fn()
+        times[i] = time.perf_counter() - start
+
+    # traced separately, as tracing slows allocation down
+    tracemalloc.start()
+    try:
+        benchmark.fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "name": benchmark_name(benchmark),
+        "benchmark": benchmark.name,
+        "params": benchmark.params,
+        "repeat": repeat,
+    }
+    for q, value in zip(PERCENTILES, np.percentile(times, PERCENTILES)):
+        result[f"p{q}_ms"] = value * 1e3
+    result["mean_ms"] = times.mean() * 1e3
+    result["throughput"] = benchmark.items / times.mean()
+    result["peak_memory_mb"] = peak / 2**20
+    return result
+
+
+def run(
+    repeat: int = 20,
+    warmup: int = 3,
+    only: Optional[str] = None,
+    batch_sizes: Sequence[int] = BATCH_SIZES,
+    draw_counts: Sequence[int] = DRAW_COUNTS,
+    progress=None,
+) -> Dict:
+    """
+    Runs the benchmarks
+
+    Args:
+        repeat: Number of timed calls of each benchmark
+        warmup: Number of untimed calls of each benchmark first
+        only: Only run benchmarks whose name contains this
+        batch_sizes: Batch sizes for predict_many
+        draw_counts: Draw counts for quick_sample and predict_mortality
+        progress: Text stream to report each result on
+
+    Returns:
+        The environment the benchmarks ran in, and a result from measure()
+        for each benchmark
+    """
+    gams.load()
+    results = []
+    for benchmark in benchmarks(batch_sizes, draw_counts):
+        if only is not None and only not in benchmark_name(benchmark):
+            continue
+        result = measure(benchmark, repeat, warmup)
+        results.append(result)
+        if progress is not None:
+            print(
+                f"{result['name']:<48} p50 {result['p50_ms']:9.2f} ms "
+                f"{result['throughput']:12.0f}/s {result['peak_memory_mb']:8.1f} MB",
+                file=progress,
+            )
+
+    return {"environment": environment(), "results": results}
+
+
+def sampled_summaries(features: np.ndarray, budget, random_seed: int) -> np.ndarray:
+    """
+    Summary quantiles of patients who are all missing the same variables,
+    predicted as predict_many() predicts them but with any seed
+
+    Args:
+        features: Pre-processed patients from pre_process_batch()
+        budget: DrawBudget, without a tolerance
+        random_seed: Random seed
+
+    Returns:
+        SUMMARY_QUANTILES of shape (n_patients, len(SUMMARY_QUANTILES))
+    """
+    from app.prediction.impute import expand_imputed
+    from app.prediction.pipeline import impute_missing
+    from app.prediction.predict import predict_mortality_batch
+    from app.prediction.summary import SUMMARY_QUANTILES, summarise_ragged
+
+    lactate = features[0, constants.LACTATE_MISSING_COLUMN] == 1
+    albumin = features[0, constants.ALBUMIN_MISSING_COLUMN] == 1
+    if lactate or albumin:
+        lactates, albumins = impute_missing(
+            features[:, : len(constants.IMPUTATION_INPUT_VARIABLES)],
+            lactate,
+            albumin,
+            budget.imputation,
+            budget.sampler,
+            random_seed,
+        )
+        rows = expand_imputed(features, lactates, albumins)
+        n_draws = budget.imputed_mortality
+    else:
+        rows = list(features[:, np.newaxis])
+        n_draws = budget.mortality
+
+    results = predict_mortality_batch(rows, n_draws, random_seed, budget.sampler)
+    return np.stack(summarise_ragged(results, SUMMARY_QUANTILES))
+
+
+def convergence(
+    draw_counts: Sequence[int] = CONVERGENCE_DRAWS,
+    imputed_draws: Sequence[Tuple[int, int]] = CONVERGENCE_IMPUTED_DRAWS,
+    n_patients: int = CONVERGENCE_PATIENTS,
+    n_seeds: int = CONVERGENCE_SEEDS,
+    progress=None,
+) -> Dict:
+    """
+    Measures how the accuracy of the summary quantiles grows with the number
+    of draws, for each sampler
+
+    For patients with lactate and albumin the true quantiles are computed in
+    closed form (see mortality_quantiles()). For patients missing either
+    they are approximated by pseudo-random sampling with
+    REFERENCE_IMPUTED_DRAWS, one patient at a time, with a seed none of the
+    samplers use. Samplers the installed scipy lacks are left out.
+
+    Args:
+        draw_counts: Mortality draws for patients with lactate and albumin
+        imputed_draws: Imputation and imputed mortality draws for patients
+            missing either
+        n_patients: Number of synthetic patients per pattern of missing
+            variables
+        n_seeds: Number of seeds each error is averaged over
+        progress: Text stream to report each result on
+
+    Returns:
+        The environment, and for each pattern of missing variables, sampler
+            and draw count, the mortality risks sampled per patient and the
+            mean over patients and seeds of the largest error of any
+            summary quantile
+    """
+    from app.prediction.budget import DEFAULT_BUDGET, sampler_available
+    from app.prediction.pipeline import summarise_exact
+    from app.prediction.preprocess import pre_process_batch
+
+    gams.load()
+    budget = DEFAULT_BUDGET._replace(tolerance=0)
+    reference_seed = n_seeds
+
+    results = []
+    for missing, pattern in MISSING_PATTERNS.items():
+        features = pre_process_batch(synthetic_patients(n_patients, missing))
+        n_missing = sum(pattern)
+        if n_missing:
+            imputation, imputed_mortality = REFERENCE_IMPUTED_DRAWS[n_missing]
+            reference_budget = budget._replace(
+                imputation=imputation,
+                imputed_mortality=imputed_mortality,
+                sampler="random",
+            )
+            reference = np.concatenate(
+                [
+                    sampled_summaries(patient, reference_budget, reference_seed)
+                    for patient in features[:, np.newaxis]
+                ]
+            )
+            budgets = [
+                budget._replace(imputation=imputation, imputed_mortality=mortality)
+                for imputation, mortality in imputed_draws
+            ]
+        else:
+            reference = summarise_exact(features)
+            budgets = [budget._replace(mortality=n) for n in draw_counts]
+
+        for sampler in filter(sampler_available, constants.SAMPLERS):
+            for draws in budgets:
+                draws = draws._replace(sampler=sampler)
+                errors = [
+                    np.abs(sampled_summaries(features, draws, seed) - reference)
+                    .max(axis=1)
+                    .mean()
+                    for seed in range(n_seeds)
+                ]
+                if n_missing:
+                    counts = {
+                        "imputation": draws.imputation,
+                        "imputed_mortality": draws.imputed_mortality,
+                    }
+                    samples = draws.imputation**n_missing * draws.imputed_mortality
+                else:
+                    counts = {"mortality": draws.mortality}
+                    samples = draws.mortality
+                result = {
+                    "missing": missing,
+                    "sampler": sampler,
+                    "draws": counts,
+                    "samples": samples,
+                    "error": float(np.mean(errors)),
+                }
+                results.append(result)
+                if progress is not None:
+                    print(
+                        f"missing={missing:<8} {sampler:<7} samples {samples:7d} "
+                        f"error {result['error']:.5f}",
+                        file=progress,
+                    )
+
+    return {"environment": environment(), "convergence": results}
+
+
+def environment() -> Dict:
+    """Where the benchmarks ran, to judge whether two runs are comparable"""
+    import scipy
+    import sklearn
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "sklearn": sklearn.__version__,
+        "assets_sha256": gams.ASSET_INFO["sha256"],
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        # in MB, as Linux reports ru_maxrss in KB
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(
+    results: Dict, baseline: Dict, tolerance: float = REGRESSION_TOLERANCE
+) -> List[Dict]:
+    """
+    Finds regressions against a baseline
+
+    Args:
+        results: Output of run()
+        baseline: Output of an earlier run()
+        tolerance: Fractional growth in median latency or peak memory
+            allowed
+
+    Returns:
+        The benchmark, metric, baseline and current values and fractional
+        change of every regression
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+        for metric in ("p50_ms", "peak_memory_mb"):
+            if before[metric] <= 0:
+                continue
+            change = result[metric] / before[metric] - 1
+            if change > tolerance:
+                regressions.append(
+                    {
+                        "name": result["name"],
+                        "metric": metric,
+                        "baseline": before[metric],
+                        "current": result[metric],
+                        "change": change,
+                    }
+                )
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the inference pipeline")
+    parser.add_argument("--output", help="JSON file to write, stdout by default")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=REGRESSION_TOLERANCE,
+        help="fractional growth reported as a regression",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--draw-counts", type=int, nargs="+", default=list(DRAW_COUNTS))
+    parser.add_argument(
+        "--convergence",
+        action="store_true",
+        help="measure summary error against draws for each sampler instead",
+    )
+    args = parser.parse_args(argv)
+
+    if args.convergence:
+        results = convergence(progress=sys.stderr)
+    else:
+        results = run(
+            args.repeat,
+            args.warmup,
+            args.only,
+            args.batch_sizes,
+            args.draw_counts,
+            progress=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['name']} {regression['metric']}: "
+                f"{regression['baseline']:.2f} -> {regression['current']:.2f} "
+                f"({regression['change']:+.0%})",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
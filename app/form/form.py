@@ -1,15 +1,18 @@
 import fastapi
 import json
+import logging
 
 from starlette.templating import Jinja2Templates
 from starlette.requests import Request
 
-from app.models import Prediction
+from app.models import Prediction, ResponseFormat, EncodedDtype
 from app.prediction import predict_api
+from app.prediction.budget import DEFAULT_BUDGET
 
 
 templates = Jinja2Templates("templates")
 router = fastapi.APIRouter()
+logger = logging.getLogger(__name__)
 
 
 @router.get("/form", include_in_schema=False)
@@ -26,7 +29,7 @@ async def post_form(
     """form handling"""
     form_data = await request.form()
     form_dict = dict(form_data)
-    print(form_dict)
+    logger.debug("form submitted: %s", form_dict)
 
     # sliders mean bools not passed if false
     if "CT_performed" not in form_dict:
@@ -41,7 +44,15 @@ async def post_form(
         del form_dict["Albumin"]
 
     pred = Prediction(**form_dict)
-    results = await predict_api.predict(pred)
+    results = await predict_api.predict(
+        pred,
+        response_format=ResponseFormat.full,
+        dtype=EncodedDtype.float32,
+        bins=50,
+        accept=None,
+        budget=DEFAULT_BUDGET,
+        exact=False,
+    )
 
     data = {
         "request": request,
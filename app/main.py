@@ -1,13 +1,24 @@
+from app import startup
+
+import asyncio
 import fastapi
+import logging
+import time
 import uvicorn
 
-from app.prediction import predict_api
+from app import metrics, settings
+from app.Fixtures import gams
+from app.prediction import predict_api, executor
 from app.form import form
 
 from starlette.templating import Jinja2Templates
 from starlette.staticfiles import StaticFiles
 from starlette.requests import Request
 
+startup.record("import app.main", startup.elapsed())
+
+logger = logging.getLogger(__name__)
+
 templates = Jinja2Templates("templates")
 api = fastapi.FastAPI(
     title="RUNE Calculator",
@@ -29,6 +40,111 @@ def configure_routing():
     api.include_router(form.router)
 
 
+def warm_up():
+    """loads the models, starts the inference workers and pre-computes model
+    draws so the first request doesn't pay for them"""
+    with startup.stage("load models"):
+        gams.load()
+    with startup.stage("start pool"):
+        executor.start_pool()
+    startup.mark_ready()
+
+
+def warm_up_done(future: asyncio.Future):
+    """logs a failed warm-up, which would otherwise leave /ready at 503 with
+    no sign of why"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("Warm-up failed", exc_info=error)
+        startup.mark_failed(error)
+
+
+@api.on_event("startup")
+async def on_startup():
+    """warms up in the background, so the server can answer /ready while the
+    models load. With RUNE_WARM_UP=0 they load on the first prediction"""
+    if settings.WARM_UP:
+        future = asyncio.get_running_loop().run_in_executor(None, warm_up)
+        future.add_done_callback(warm_up_done)
+    else:
+        startup.mark_ready()
+
+
+@api.on_event("shutdown")
+async def on_shutdown():
+    executor.shutdown_pool()
+
+
+@api.get("/ready", include_in_schema=False)
+def ready():
+    """readiness check, 503 until the warm-up has finished. Also reports
+    whether the models are loaded, which assets they came from, how long
+    each startup stage took and the error if the warm-up failed"""
+    loaded = gams.is_loaded()
+    content = {
+        "Ready": startup.is_ready(),
+        "ModelsLoaded": loaded,
+        "Assets": gams.ASSET_INFO if loaded else None,
+        "Startup": startup.report(),
+        "Error": startup.failure(),
+    }
+    return fastapi.responses.JSONResponse(
+        content, status_code=200 if content["Ready"] else 503
+    )
+
+
+class RequestTimer:
+    """ASGI middleware timing each request until the last of its response
+    has been sent, labelled by its route rather than the URL so that the
+    number of label values stays bounded. Unlike an @api.middleware("http")
+    function it passes the request and response messages straight through,
+    so streamed and template responses work unchanged"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = None
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                route = scope.get("route")
+                metrics.REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    path=getattr(route, "path", "other"),
+                    status=status,
+                )
+
+        await self.app(scope, receive, timed_send)
+
+
+api.add_middleware(RequestTimer)
+
+
+@api.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    """per-stage latency histograms, request counts and cache hit rates in
+    the Prometheus text format. Not found with RUNE_METRICS=0"""
+    if not settings.METRICS:
+        raise fastapi.HTTPException(status_code=404)
+    return fastapi.responses.PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @api.get("/", include_in_schema=False)
 async def index(request: Request):
     """index page"""
@@ -0,0 +1,268 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Pipeline stages are timed with
+
+    with metrics.timed("model_matrix", model="mortality"):
+        ...
+
+which records into the rune_stage_seconds histogram. A timer costs around a
+microsecond, against milliseconds for the stages it times. With
+RUNE_METRICS=0 timed() returns a shared no-op context manager and /metrics
+is not served.
+
+Process pool workers don't share this process's metrics, so calls made in
+them are wrapped with run_recorded(), which returns the stage timings
+recorded during the call for record_stages() to add here.
+
+Nor do the server processes forked by app.serve, each of which answers
+whichever scrapes it accepts. Each labels its metrics with its own worker
+(see set_worker()), so that every series is one process's monotonic count,
+to be summed over workers in queries, e.g.
+sum without (worker) (rate(rune_patients_total[5m])).
+"""
+
+import bisect
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app import settings
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+# labels added to every metric, the serving worker's if there are several
+_constant_labels: Dict[str, str] = {}
+
+
+def set_worker(worker: str):
+    """Labels every metric rendered by this process with worker=worker"""
+    _constant_labels["worker"] = str(worker)
+
+
+def worker() -> Optional[str]:
+    """This process's worker label, None unless set by set_worker()"""
+    return _constant_labels.get("worker")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], **extra) -> str:
+    pairs = (
+        list(_constant_labels.items()) + list(zip(names, values)) + list(extra.items())
+    )
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic count for each combination of label values"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values for each combination of label values,
+    in cumulative buckets"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (plus +Inf), sum]
+        self.values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = format_labels(self.labels, key, le=bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Value read when the metrics are rendered, e.g. from a cache's own
+    counts"""
+
+    def __init__(self, name: str, help: str, kind: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name}{format_labels((), ())} {self.read()}",
+        ]
+
+
+STAGE_SECONDS = Histogram(
+    "rune_stage_seconds",
+    "Time spent in each stage of the inference pipeline",
+    ("stage", "model"),
+)
+REQUEST_SECONDS = Histogram(
+    "rune_request_seconds", "Time to respond to each endpoint", ("path", "status")
+)
+PATIENTS = Counter(
+    "rune_patients_total",
+    "Patients scored, by endpoint and which inputs were imputed",
+    ("path", "missing"),
+)
+
+_registry: list = [STAGE_SECONDS, REQUEST_SECONDS, PATIENTS]
+_model_labels: "weakref.WeakKeyDictionary[object, str]" = weakref.WeakKeyDictionary()
+_recording: Optional[List[Tuple[str, str, float]]] = None
+
+
+def register(metric):
+    """Adds a metric to those rendered at /metrics"""
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def label_model(model, name: str):
+    """Names a model in stage timings"""
+    _model_labels[model] = name
+
+
+def model_label(*models) -> str:
+    return "+".join(_model_labels.get(model, "other") for model in models)
+
+
+def missing_label(lactate_missing: bool, albumin_missing: bool) -> str:
+    """Which of lactate and albumin are missing, for PATIENTS"""
+    missing = [
+        name
+        for name, is_missing in (
+            ("lactate", lactate_missing),
+            ("albumin", albumin_missing),
+        )
+        if is_missing
+    ]
+    return "+".join(missing) or "none"
+
+
+def observe_stage(stage: str, model: str, seconds: float):
+    if _recording is not None:
+        _recording.append((stage, model, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, stage=stage, model=model)
+
+
+class _Timer:
+    __slots__ = ("stage", "model", "start")
+
+    def __init__(self, stage: str, model: str):
+        self.stage = stage
+        self.model = model
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.stage, self.model, time.perf_counter() - self.start)
+
+
+_disabled = nullcontext()
+
+
+def timed(stage: str, model: str = ""):
+    """Context manager timing a pipeline stage, a no-op if metrics are off"""
+    if not settings.METRICS:
+        return _disabled
+    return _Timer(stage, model)
+
+
+def run_recorded(fn: Callable, *args):
+    """
+    Runs fn(*args) in a worker process, keeping the stage timings it records
+
+    Returns:
+        result: fn(*args)
+        stages: (stage, model, seconds) of each stage timed during the call
+    """
+    global _recording
+
+    _recording = []
+    try:
+        return fn(*args), _recording
+    finally:
+        _recording = None
+
+
+def record_stages(stages: Sequence[Tuple[str, str, float]]):
+    """Adds stage timings returned by run_recorded()"""
+    for stage, model, seconds in stages:
+        STAGE_SECONDS.observe(seconds, stage=stage, model=model)
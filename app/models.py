@@ -1,6 +1,13 @@
-from pydantic import BaseModel
+from enum import Enum
+from pydantic import BaseModel, conint, conlist
 from typing import Optional, List
 
+from app.Fixtures.constants import (
+    MORTALITY_INPUT_FIELDS,
+    WINSOR_THRESHOLDS,
+    MAX_SWEEP_POINTS,
+)
+
 
 class Prediction(BaseModel):
     """model to define inputs for prediction"""
@@ -57,43 +64,109 @@ class ProcessedPrediction(Prediction):
 
     def convert_to_list(self):
         """converts object to list in correct order"""
-        input_list = [
-            self.CT_performed,
-            self.Arrhythmia,
-            self.Age,
-            self.Creat,
-            self.Na,
-            self.K,
-            self.Urea,
-            self.WCC,
-            self.HR,
-            self.SBP,
-            self.GCS,
-            self.ASA,
-            self.Cardio,
-            self.Resp,
-            self.Malignancy,
-            self.Soiling,
-            self.Indication,
-            self.Albumin,
-            self.Albumin_missing,
-            self.Lactate,
-            self.Lactate_missing,
-        ]
-        return input_list
+        return [getattr(self, field) for field in MORTALITY_INPUT_FIELDS]
 
 
 class SummaryStats(BaseModel):
     Median: float
     LowerPercentile: float
-    UpperPercentie: float
+    UpperPercentile: float
+
+
+class ResponseFormat(str, Enum):
+    """how much of the predicted distribution to return"""
+
+    full = "full"
+    summary = "summary"
+    histogram = "histogram"
+    quantiles = "quantiles"
+    base64 = "base64"
+    binary = "binary"
+
+
+class EncodedDtype(str, Enum):
+    float16 = "float16"
+    float32 = "float32"
+    float64 = "float64"
+
+
+class RiskHistogram(BaseModel):
+    Counts: List[int]
+    Edges: List[float]
+
 
+class QuantileSketch(BaseModel):
+    Probabilities: List[float]
+    Values: List[float]
+
+
+class EncodedRisks(BaseModel):
+    Encoding: str
+    Dtype: EncodedDtype
+    Length: int
+    Data: str
+
+
+class PatientSummary(BaseModel):
+    """the summary of a patient's predicted risks, and the risks themselves
+    in whichever one of Result, Histogram, Quantiles or EncodedResult the
+    format asks for, or none of them for summary and exact predictions"""
 
-class PredictionResult(BaseModel):
     ID: str
     Seed: int
-    Result: List[float]
+    Result: Optional[List[float]] = None
+    Histogram: Optional[RiskHistogram] = None
+    Quantiles: Optional[QuantileSketch] = None
+    EncodedResult: Optional[EncodedRisks] = None
     Summary: SummaryStats
+    Draws: int
+    Exact: bool = False
+
+
+class PredictionResult(PatientSummary):
+    Inputs: Prediction
+
+
+class BatchPredictionResult(BaseModel):
+    Results: List[PatientSummary]
+
+
+# continuous inputs which /predict/sweep can vary
+SweepVariable = Enum(
+    "SweepVariable", {name: name for name in WINSOR_THRESHOLDS}, type=str
+)
+
+
+class SweepRequest(BaseModel):
+    """a patient and the values of one of their inputs to predict at, given
+    explicitly or as a number of evenly spaced points over its range"""
+
+    Patient: Prediction
+    Variable: SweepVariable
+    Values: Optional[conlist(float, min_items=1, max_items=MAX_SWEEP_POINTS)] = None
+    Points: conint(ge=2, le=MAX_SWEEP_POINTS) = 20
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "Patient": Prediction.Config.schema_extra["example"],
+                "Variable": "Lactate",
+                "Values": [1, 2, 4, 6, 8],
+            }
+        }
+
+
+class SweepPoint(BaseModel):
+    Value: float
+    Summary: SummaryStats
+    Draws: int
+
+
+class SweepResult(BaseModel):
+    ID: str
+    Seed: int
+    Variable: SweepVariable
+    Points: List[SweepPoint]
 
 
 class ValidationError(Exception):
@@ -0,0 +1,220 @@
+"""
+How many Monte Carlo draws a prediction uses.
+
+A patient with lactate and albumin gets `mortality` sampled risks. One
+missing either gets `imputation` imputed values of each missing variable,
+and `imputed_mortality` sampled risks for each combination of them.
+
+With a positive `tolerance` the mortality risks are sampled in
+ADAPTIVE_BLOCKS blocks of draws, stopping once the standard error of each
+summary quantile, estimated from the spread of its value across blocks, is
+within the tolerance (see predict_mortality_adaptive()). The risks returned
+are then the first of those that would be returned without stopping, so
+stopping early makes the summary noisier by about the tolerance, but not
+systematically wider or narrower.
+
+`sampler` is how the coefficient draws (and imputation noise) are generated,
+pseudo-randomly by default, or from scrambled Sobol' points or a Latin
+hypercube (see app/prediction/sampling.py). Sobol' points need about 30%
+fewer draws for the same accuracy with complete data. For imputed patients
+both quasi-random samplers spread the few imputed values over the tails of
+their distribution, and cut the error of the summary by 2-4 times at the
+same draws (see python -m app.benchmark --convergence).
+
+`precision` is the float dtype the mortality risks are sampled in. float32
+halves the memory and time of the draws, linear predictors and risks, and
+moves the summary quantiles by around 1e-7 (see mortality_draws()).
+request_memory() estimates the memory a batch of patients needs, the
+coefficient draws included, for batches to be split into chunks of at most
+RUNE_BATCH_MEMORY_MB.
+
+Server-wide defaults come from the RUNE_*_DRAWS, RUNE_DRAW_TOLERANCE,
+RUNE_SAMPLER and RUNE_PRECISION environment variables (see app/settings.py).
+"""
+
+import importlib.util
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app import settings
+from app.Fixtures.constants import MAX_DRAWS, MAX_SAMPLES, PRECISIONS, SAMPLERS
+
+# arrays of one float per sampled risk alive at once while predicting: the
+# linear predictor, the risks, and their transposed and per patient copies
+ARRAYS_PER_SAMPLE = 4
+# float64 arrays of n_draws x n_coefficients alive at once while drawing
+# coefficients: the standard normals and the draws made from them
+ARRAYS_PER_DRAW = 2
+# models whose coefficients are drawn for patients missing lactate or albumin
+IMPUTATION_MODELS = 2
+
+
+class DrawBudget(NamedTuple):
+    mortality: int
+    imputation: int
+    imputed_mortality: int
+    tolerance: float = 0.0
+    sampler: str = "random"
+    precision: str = "float64"
+
+
+if settings.PRECISION not in PRECISIONS:
+    raise ValueError(
+        f"RUNE_PRECISION must be one of {', '.join(PRECISIONS)}, "
+        f"not {settings.PRECISION}"
+    )
+
+DEFAULT_BUDGET = DrawBudget(
+    mortality=settings.MORTALITY_DRAWS,
+    imputation=settings.IMPUTATION_DRAWS,
+    imputed_mortality=settings.IMPUTED_MORTALITY_DRAWS,
+    tolerance=settings.DRAW_TOLERANCE,
+    sampler=settings.SAMPLER,
+    precision=settings.PRECISION,
+)
+
+
+def request_budget(
+    mortality: Optional[int] = None,
+    imputation: Optional[int] = None,
+    imputed_mortality: Optional[int] = None,
+    tolerance: Optional[float] = None,
+    sampler: Optional[str] = None,
+) -> DrawBudget:
+    """
+    DEFAULT_BUDGET with any of its draw counts, tolerance or sampler
+    replaced
+
+    Raises:
+        ValueError: if a draw count is over MAX_DRAWS, a patient could get
+            more than MAX_SAMPLES risks, or the sampler isn't one of SAMPLERS
+            or isn't available
+    """
+    overrides = {
+        "mortality": mortality,
+        "imputation": imputation,
+        "imputed_mortality": imputed_mortality,
+        "tolerance": tolerance,
+        "sampler": sampler,
+    }
+    overrides = {name: value for name, value in overrides.items() if value is not None}
+    budget = DEFAULT_BUDGET._replace(**overrides)
+
+    # every distinct draw count caches its own n_draws x n_coefficients draws
+    for name in ("mortality", "imputation", "imputed_mortality"):
+        if overrides.get(name, 0) > MAX_DRAWS:
+            raise ValueError(
+                f"At most {MAX_DRAWS} draws may be requested, not {overrides[name]}"
+            )
+
+    # with both variables missing every pair of imputed values is scored
+    most_samples = max(samples_per_patient(budget, n) for n in (0, 2))
+    if most_samples > MAX_SAMPLES:
+        raise ValueError(
+            f"Draws would sample up to {most_samples} risks per patient, "
+            f"more than the maximum of {MAX_SAMPLES}"
+        )
+    if budget.sampler not in SAMPLERS:
+        raise ValueError(
+            f"Unknown sampler {budget.sampler}, expected one of {', '.join(SAMPLERS)}"
+        )
+    if not sampler_available(budget.sampler):
+        raise ValueError("The sobol sampler needs scipy 1.7 or later")
+    return budget
+
+
+def sampler_available(sampler: str) -> bool:
+    """Whether one of SAMPLERS can be used with the installed scipy, which
+    has Sobol' points from 1.7"""
+    return sampler != "sobol" or importlib.util.find_spec("scipy.stats.qmc") is not None
+
+
+def samples_per_patient(budget: DrawBudget, n_missing: int) -> int:
+    """Mortality risks sampled for a patient missing n_missing of lactate
+    and albumin"""
+    if n_missing:
+        return budget.imputation**n_missing * budget.imputed_mortality
+    return budget.mortality
+
+
+def request_memory(
+    budget: DrawBudget, n_missing: Sequence[int], n_coefficients: int
+) -> int:
+    """
+    Estimated peak memory of predicting several patients together, including
+    their model matrices and drawing each model's coefficients, as if none
+    of the draws were cached
+
+    Args:
+        budget: Draw counts and precision
+        n_missing: Number of lactate and albumin missing, for each patient
+        n_coefficients: Most coefficients of any of the models
+
+    Returns:
+        Estimated bytes
+    """
+    n_missing = [int(n) for n in n_missing]
+    patients = sum(_patient_memory(budget, n, n_coefficients) for n in n_missing)
+    return patients + _draw_memory(
+        budget, 0 in n_missing, any(n_missing), n_coefficients
+    )
+
+
+def memory_chunks(
+    budget: DrawBudget,
+    n_missing: Sequence[int],
+    n_coefficients: int,
+    limit: int = settings.BATCH_MEMORY_MB * 2**20,
+) -> List[slice]:
+    """
+    Splits a batch of patients into consecutive chunks which are each
+    estimated to need at most limit bytes, or a single patient
+
+    Args:
+        budget: Draw counts and precision
+        n_missing: Number of lactate and albumin missing, for each patient
+        n_coefficients: Most coefficients of any of the models
+        limit: Most bytes of request_memory() per chunk
+
+    Returns:
+        Slices of the patients in each chunk
+    """
+    chunks = []
+    start, used, complete, incomplete = 0, 0, False, False
+    for i, n in enumerate(map(int, n_missing)):
+        patient = _patient_memory(budget, n, n_coefficients)
+        draws = _draw_memory(
+            budget, complete or n == 0, incomplete or n > 0, n_coefficients
+        )
+        if i > start and used + patient + draws > limit:
+            chunks.append(slice(start, i))
+            start, used, complete, incomplete = i, 0, False, False
+        used += patient
+        complete, incomplete = complete or n == 0, incomplete or n > 0
+    if start < len(n_missing):
+        chunks.append(slice(start, len(n_missing)))
+    return chunks
+
+
+def _patient_memory(budget: DrawBudget, n_missing: int, n_coefficients: int) -> int:
+    # the sampled risks, and a model matrix row per combination of imputed
+    # values
+    rows = budget.imputation**n_missing
+    return (
+        ARRAYS_PER_SAMPLE
+        * np.dtype(budget.precision).itemsize
+        * samples_per_patient(budget, n_missing)
+        + np.dtype(np.float64).itemsize * n_coefficients * rows
+    )
+
+
+def _draw_memory(
+    budget: DrawBudget, complete: bool, incomplete: bool, n_coefficients: int
+) -> int:
+    # every draw count is drawn once for the whole batch, however many
+    # patients use it
+    draws = budget.mortality if complete else 0
+    if incomplete:
+        draws += budget.imputed_mortality + IMPUTATION_MODELS * budget.imputation
+    return ARRAYS_PER_DRAW * np.dtype(np.float64).itemsize * n_coefficients * draws
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from app import metrics, settings
+from app.models import ProcessedPrediction
+
+
+def result_key(processed: Union[ProcessedPrediction, np.ndarray], *params) -> str:
+    """
+    Canonical key for the inference result of a pre-processed patient
+
+    Args:
+        processed: Pre-processed (validated and Winsorized) patient, or their
+            row of the feature matrix from pre_process_batch(), which gives
+            the same key
+        params: Anything else the result depends on, e.g. seed and draw counts
+
+    Returns:
+        Hex digest of the feature vector and params
+    """
+    if isinstance(processed, ProcessedPrediction):
+        processed = processed.convert_to_list()
+    features = np.asarray(processed, dtype=np.float64)
+    digest = hashlib.blake2b(features.tobytes(), digest_size=16)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of inference results with optional expiry
+
+    Entries are evicted least recently used first once there are more than
+    max_entries or their arrays total more than max_bytes, and are treated
+    as missing once older than ttl seconds (if ttl is positive). Cached
+    arrays are made read-only as they are shared between requests.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0:
+                if time.monotonic() - entry[1] > self.ttl:
+                    self._remove(key)
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, result: np.ndarray):
+        if self.max_entries <= 0 or result.nbytes > self.max_bytes:
+            return
+        result.setflags(write=False)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, time.monotonic())
+            self.nbytes += result.nbytes
+
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        result, _ = self._entries.pop(key)
+        self.nbytes -= result.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "Entries": len(self._entries),
+                "Bytes": self.nbytes,
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "HitRate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+RESULT_CACHE = ResultCache(
+    max_entries=settings.RESULT_CACHE_ENTRIES,
+    max_bytes=settings.RESULT_CACHE_MB * 1024 * 1024,
+    ttl=settings.RESULT_CACHE_TTL,
+)
+
+metrics.register(
+    metrics.Callback(
+        "rune_result_cache_hits_total",
+        "Result cache lookups which found a result",
+        "counter",
+        lambda: RESULT_CACHE.hits,
+    )
+)
+metrics.register(
+    metrics.Callback(
+        "rune_result_cache_misses_total",
+        "Result cache lookups which found nothing",
+        "counter",
+        lambda: RESULT_CACHE.misses,
+    )
+)
+metrics.register(
+    metrics.Callback(
+        "rune_result_cache_hit_ratio",
+        "Fraction of result cache lookups which found a result",
+        "gauge",
+        lambda: RESULT_CACHE.stats()["HitRate"],
+    )
+)
+metrics.register(
+    metrics.Callback(
+        "rune_result_cache_entries",
+        "Results held in the cache",
+        "gauge",
+        lambda: RESULT_CACHE.stats()["Entries"],
+    )
+)
+metrics.register(
+    metrics.Callback(
+        "rune_result_cache_bytes",
+        "Size of the cached result arrays",
+        "gauge",
+        lambda: RESULT_CACHE.nbytes,
+    )
+)
@@ -0,0 +1,450 @@
+import threading
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pygam import GAM
+from pygam.terms import (
+    Intercept,
+    LinearTerm,
+    SplineTerm,
+    FactorTerm,
+    TensorTerm,
+)
+
+_model_matrix_cache: (
+    "weakref.WeakKeyDictionary[GAM, Dict[tuple, Optional[ModelMatrix]]]"
+) = weakref.WeakKeyDictionary()
+_model_matrix_cache_lock = threading.Lock()
+
+
+class SplineBasis:
+    """B-spline basis for a single feature, precompiled from a fitted
+    SplineTerm.
+
+    Evaluates exactly the same vectorised De Boor recursion as pygam's
+    b_spline_basis() (non-periodic 'ps' basis only), but on a dense array
+    and with the knot vector, recursion denominators and the linear
+    extrapolation gradients computed once at compile time.
+    """
+
+    def __init__(self, feature: int, edge_knots, n_splines: int, spline_order: int):
+        self.feature = feature
+        self.n_splines = n_splines
+        self.spline_order = spline_order
+
+        edge_knots = np.sort(np.asarray(edge_knots, dtype=float))
+        self.offset = edge_knots[0]
+        self.scale = edge_knots[-1] - edge_knots[0]
+        if self.scale == 0:
+            self.scale = 1
+
+        boundary_knots = np.linspace(0, 1, 1 + n_splines - spline_order)
+        diff = np.diff(boundary_knots[:2])[0]
+        aug = np.arange(1, spline_order + 1) * diff
+        aug_knots = np.r_[-aug[::-1], boundary_knots, 1 + aug]
+        aug_knots[-1] += 1e-9  # want last knot inclusive
+        self.aug_knots = aug_knots
+
+        # bases at 0 and 1, and the gradients used to extrapolate beyond them
+        self.edge_bases, self.grads = None, None
+        edges = self._recurse(np.array([[0.0], [1.0]]), symmetric=True)
+        if spline_order > 0:
+            bases, prev_bases = edges
+            denom = aug_knots[spline_order:-1] - aug_knots[: -spline_order - 1]
+            left = prev_bases[:, :-1] / denom
+            denom = aug_knots[spline_order + 1 :] - aug_knots[1:-spline_order]
+            right = prev_bases[:, 1:] / denom
+            self.edge_bases = bases
+            self.grads = spline_order * (left - right)
+
+    def _recurse(
+        self, x: np.ndarray, symmetric: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """runs the Haar basis recursion for x of shape (n, 1), rescaled to
+        [0, 1]"""
+        aug_knots = self.aug_knots
+        bases = (x >= aug_knots[:-1]) * (x < aug_knots[1:]).astype(float)
+        if symmetric:
+            bases[-1] = bases[-2][::-1]  # force symmetric bases at 0 and 1
+
+        prev_bases = bases
+        maxi = len(aug_knots) - 1
+        for m in range(2, self.spline_order + 2):
+            maxi -= 1
+
+            num = x - aug_knots[:maxi]
+            num *= bases[:, :maxi]
+            left = num / (aug_knots[m - 1 : maxi + m - 1] - aug_knots[:maxi])
+
+            num = (aug_knots[m : maxi + m] - x) * bases[:, 1 : maxi + 1]
+            right = num / (aug_knots[m : maxi + m] - aug_knots[1 : maxi + 1])
+
+            prev_bases = bases
+            bases = left + right
+
+        return bases, prev_bases
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            X: Dense input of shape (n_rows, m_features)
+
+        Returns:
+            Basis of shape (n_rows, n_splines)
+        """
+        x = ((X[:, self.feature] - self.offset) / self.scale)[:, np.newaxis]
+        bases, _ = self._recurse(x)
+
+        if self.spline_order > 0:
+            extrapolate_l = x[:, 0] < 0
+            extrapolate_r = x[:, 0] > 1
+            if extrapolate_l.any():
+                bases[extrapolate_l] = (
+                    self.grads[0] * x[extrapolate_l] + self.edge_bases[0]
+                )
+            if extrapolate_r.any():
+                bases[extrapolate_r] = (
+                    self.grads[1] * (x[extrapolate_r] - 1) + self.edge_bases[1]
+                )
+
+        return bases
+
+
+def spline_spec(term: SplineTerm) -> Dict:
+    """plain description of a fitted single feature spline term"""
+    if term.basis != "ps" or term.by is not None:
+        raise NotImplementedError(f"unsupported term {term}")
+    return {
+        "feature": int(term.feature),
+        "edge_knots": [float(k) for k in term.edge_knots_],
+        "n_splines": int(term.n_splines),
+        "spline_order": int(term.spline_order),
+    }
+
+
+def term_specs(gam: GAM) -> List[Dict]:
+    """
+    Describes a fitted GAM's terms as plain dictionaries (JSON serialisable),
+    which is everything needed to compile its model matrix.
+
+    Models which aren't pygam GAMs can provide their specs directly as a
+    term_specs attribute.
+
+    Raises:
+        NotImplementedError: if the GAM has terms ModelMatrix can't compile
+    """
+    if hasattr(gam, "term_specs"):
+        return gam.term_specs
+
+    specs = []
+    for term in gam.terms:
+        if isinstance(term, Intercept):
+            specs.append({"kind": "intercept"})
+        elif isinstance(term, TensorTerm):
+            if term.by is not None:
+                raise NotImplementedError(f"unsupported term {term}")
+            specs.append(
+                {"kind": "tensor", "marginals": [spline_spec(t) for t in term._terms]}
+            )
+        elif isinstance(term, FactorTerm):
+            specs.append({"kind": "factor", "coding": term.coding, **spline_spec(term)})
+        elif isinstance(term, SplineTerm):
+            specs.append({"kind": "spline", **spline_spec(term)})
+        elif isinstance(term, LinearTerm):
+            specs.append({"kind": "linear", "feature": int(term.feature)})
+        else:
+            raise NotImplementedError(f"unsupported term {term}")
+    return specs
+
+
+class ModelMatrix:
+    """Dense model matrix builder compiled once from a fitted GAM.
+
+    Calling the builder on a batch of rows gives the same values as
+    gam._modelmat(X).toarray(), without pygam's input validation, term
+    dispatch or sparse matrix construction. Inputs are assumed to have
+    already been validated, so categorical features must be within the
+    range seen in training.
+
+    Marginal bases which appear in several terms (e.g. the same feature in
+    a spline term and in a tensor term) are evaluated once per call.
+
+    Several GAMs fitted to the same input features can be compiled into one
+    builder, whose output is their model matrices side by side (the columns
+    of each given by blocks), so that bases they share are evaluated once.
+    """
+
+    def __init__(self, *gams: GAM):
+        self.bases: List[SplineBasis] = []
+        self.terms: List[Tuple[str, tuple]] = []
+        self.slices: List[slice] = []
+        self.features: List[Tuple[int, ...]] = []
+        # indices into bases used by each term
+        self.term_bases: List[Tuple[int, ...]] = []
+        self.blocks: List[slice] = []
+        basis_index: Dict[tuple, int] = {}
+
+        def compile_basis(spec: Dict) -> int:
+            key = (
+                spec["feature"],
+                tuple(spec["edge_knots"]),
+                spec["n_splines"],
+                spec["spline_order"],
+            )
+            if key not in basis_index:
+                basis_index[key] = len(self.bases)
+                self.bases.append(SplineBasis(*key))
+            return basis_index[key]
+
+        start = 0
+        for gam in gams:
+            for spec in term_specs(gam):
+                kind = spec["kind"]
+                if kind == "intercept":
+                    args, features, n_coefs = (), (), 1
+                    term_bases = ()
+                elif kind == "tensor":
+                    args = tuple(compile_basis(m) for m in spec["marginals"])
+                    features = tuple(m["feature"] for m in spec["marginals"])
+                    n_coefs = int(np.prod([m["n_splines"] for m in spec["marginals"]]))
+                    term_bases = args
+                elif kind == "factor":
+                    drop = 1 if spec["coding"] == "dummy" else 0
+                    args = (compile_basis(spec), drop)
+                    features = (spec["feature"],)
+                    n_coefs = spec["n_splines"] - drop
+                    term_bases = args[:1]
+                elif kind == "spline":
+                    args, features = (compile_basis(spec),), (spec["feature"],)
+                    n_coefs = spec["n_splines"]
+                    term_bases = args
+                elif kind == "linear":
+                    args, features, n_coefs = (spec["feature"],), (spec["feature"],), 1
+                    term_bases = ()
+                else:
+                    raise NotImplementedError(f"unsupported term {spec}")
+
+                self.terms.append((kind, args))
+                self.term_bases.append(term_bases)
+                self.features.append(features)
+                self.slices.append(slice(start, start + n_coefs))
+                start += n_coefs
+
+            block = slice(self.blocks[-1].stop if self.blocks else 0, start)
+            if block.stop - block.start != len(gam.coef_):
+                raise ValueError("term specs don't match the number of coefficients")
+            self.blocks.append(block)
+
+        self.n_coefs = start
+        # split_terms() and term_columns() results, which are reused for
+        # every call with the same features / terms
+        self._splits: Dict[tuple, Tuple[List[int], List[int]]] = {}
+        self._columns: Dict[tuple, np.ndarray] = {}
+
+    def split_terms(self, features: Sequence[int]) -> Tuple[List[int], List[int]]:
+        """
+        Returns:
+            fixed: Indices of the terms which don't depend on any of features
+            varying: Indices of the terms which do
+        """
+        features = tuple(features)
+        if features not in self._splits:
+            varying = [
+                i
+                for i, term_features in enumerate(self.features)
+                if set(term_features) & set(features)
+            ]
+            fixed = [i for i in range(len(self.terms)) if i not in varying]
+            self._splits[features] = fixed, varying
+        return self._splits[features]
+
+    def term_columns(self, terms: Sequence[int]) -> np.ndarray:
+        """Model matrix columns of terms, in order"""
+        terms = tuple(terms)
+        if terms not in self._columns:
+            self._columns[terms] = np.concatenate(
+                [np.arange(self.slices[i].start, self.slices[i].stop) for i in terms]
+                + [np.empty(0, dtype=int)]
+            )
+        return self._columns[terms]
+
+    def __call__(self, X, terms: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Args:
+            X: Input data of shape (n_rows, m_features), in the feature order
+                the GAM was fitted with
+            terms: Indices of the terms to evaluate, all of them by default
+
+        Returns:
+            Dense model matrix of shape (n_rows, n_coefs), or with only the
+                columns of terms
+        """
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+
+        if terms is None:
+            terms = range(len(self.terms))
+            bases = [basis(X) for basis in self.bases]
+            modelmat = np.empty((X.shape[0], self.n_coefs))
+        else:
+            used = {i for term in terms for i in self.term_bases[term]}
+            bases = {i: basis(X) for i, basis in enumerate(self.bases) if i in used}
+            modelmat = np.empty((X.shape[0], len(self.term_columns(terms))))
+
+        start = 0
+        for term in terms:
+            kind, args = self.terms[term]
+            width = self.slices[term].stop - self.slices[term].start
+            columns = slice(start, start + width)
+            start += width
+            if kind == "intercept":
+                modelmat[:, columns] = 1.0
+            elif kind == "spline":
+                modelmat[:, columns] = bases[args[0]]
+            elif kind == "factor":
+                modelmat[:, columns] = bases[args[0]][:, args[1] :]
+            elif kind == "linear":
+                modelmat[:, columns] = X[:, args[0]][:, np.newaxis]
+            else:
+                tensor = bases[args[0]]
+                for marginal in args[1:]:
+                    tensor = (
+                        tensor[:, :, np.newaxis] * bases[marginal][:, np.newaxis, :]
+                    ).reshape(X.shape[0], -1)
+                modelmat[:, columns] = tensor
+
+        return modelmat
+
+
+def model_matrix(gam: GAM, *others: GAM) -> Optional[ModelMatrix]:
+    """Returns the compiled model matrix builder for one or more fitted GAMs,
+    compiling it on first use. Returns None if the GAMs use terms the builder
+    does not support, in which case callers should fall back to
+    gam._modelmat().
+    """
+    with _model_matrix_cache_lock:
+        builders = _model_matrix_cache.setdefault(gam, {})
+        if others in builders:
+            return builders[others]
+
+    try:
+        builder = ModelMatrix(gam, *others)
+    except NotImplementedError:
+        builder = None
+
+    with _model_matrix_cache_lock:
+        builders[others] = builder
+    return builder
+
+
+class SharedModelMatrix:
+    """Model matrix of groups of rows which are the same except in a few
+    features, e.g. each of a patient's rows with a different imputed lactate
+    and albumin.
+
+    Terms which don't use those features are evaluated once per group, and
+    only the terms which do are evaluated for every row. dot() gives the
+    linear predictor of every row, as the full model matrix's dot() would
+    (up to floating point rounding), at the cost of one full row per group
+    plus a few columns per row.
+
+    Where every group is a single row, the rows of a group differ in other
+    features too (e.g. several patients passed as one group), or the GAM's
+    model matrix can't be compiled, the full model matrix is built instead.
+    """
+
+    def __init__(self, gam: GAM, groups: Sequence[np.ndarray], features: Sequence[int]):
+        """
+        Args:
+            gam: Fitted GAM
+            groups: Input rows of each group, of shape (n_rows, m_features)
+            features: Features which may differ between the rows of a group
+        """
+        X = np.concatenate([np.asarray(rows, dtype=float) for rows in groups])
+        self.n_rows = np.array([len(rows) for rows in groups])
+        self.first_rows = np.cumsum(np.r_[0, self.n_rows])
+
+        builder = model_matrix(gam)
+        self.shared = (
+            builder is not None
+            and len(X) > len(groups)
+            and self._groups_share(X, features)
+        )
+        if not self.shared:
+            self.fixed = gam._modelmat(X).toarray() if builder is None else builder(X)
+            self.fixed_columns = slice(None)
+            return
+
+        fixed_terms, varying_terms = builder.split_terms(features)
+        self.fixed = builder(X[self.first_rows[:-1]], terms=fixed_terms)
+        self.fixed_columns = builder.term_columns(fixed_terms)
+
+        # single feature terms are evaluated once per distinct value of their
+        # feature, e.g. once per imputed lactate rather than once per
+        # combination of imputed lactate and albumin
+        self.varying = []
+        for term in varying_terms:
+            if len(builder.features[term]) == 1:
+                _, first, inverse = np.unique(
+                    X[:, builder.features[term][0]],
+                    return_index=True,
+                    return_inverse=True,
+                )
+            else:
+                first = inverse = np.arange(len(X))
+            self.varying.append(
+                (
+                    builder.term_columns([term]),
+                    builder(X[first], terms=[term]),
+                    inverse,
+                )
+            )
+
+    def _groups_share(self, X: np.ndarray, features: Sequence[int]) -> bool:
+        """Whether every row is the same as the first row of its group,
+        except in features"""
+        others = np.setdiff1d(np.arange(X.shape[1]), features)
+        first = np.repeat(X[self.first_rows[:-1]], self.n_rows, axis=0)
+        return np.array_equal(X[:, others], first[:, others], equal_nan=True)
+
+    def rows(self, groups: Sequence[int]) -> np.ndarray:
+        """Indices of the rows of groups"""
+        return np.concatenate(
+            [np.arange(self.first_rows[i], self.first_rows[i + 1]) for i in groups]
+        )
+
+    def dot(self, coefs: np.ndarray, groups: Optional[Sequence[int]] = None):
+        """
+        Args:
+            coefs: Coefficients of shape (n_coefs, n_draws), or (n_coefs,).
+                The product is computed in their dtype, e.g. float32
+            groups: Indices of the groups to evaluate, all of them by default
+
+        Returns:
+            Linear predictor of shape (n_rows, n_draws) for the rows of groups
+        """
+        dtype = coefs.dtype
+        if not self.shared:
+            fixed = self.fixed if groups is None else self.fixed[self.rows(groups)]
+            return fixed.astype(dtype, copy=False).dot(coefs[self.fixed_columns])
+
+        if groups is None:
+            fixed, n_rows, rows = self.fixed, self.n_rows, slice(None)
+        else:
+            fixed, n_rows, rows = (
+                self.fixed[groups],
+                self.n_rows[groups],
+                self.rows(groups),
+            )
+        linear_predictor = np.repeat(
+            fixed.astype(dtype, copy=False).dot(coefs[self.fixed_columns]),
+            n_rows,
+            axis=0,
+        )
+        for columns, values, inverse in self.varying:
+            linear_predictor += values.astype(dtype, copy=False).dot(coefs[columns])[
+                inverse[rows]
+            ]
+        return linear_predictor
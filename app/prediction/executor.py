@@ -0,0 +1,141 @@
+"""
+Worker pool for the CPU-bound inference pipeline, so that NumPy / pygam
+work doesn't block the event loop serving other requests.
+
+Configured with the RUNE_WORKER_TYPE ("thread" or "process"), RUNE_WORKERS
+and RUNE_MAX_PENDING environment variables (see app/settings.py). Process
+workers are pre-warmed with the models and their coefficient draws as they
+start. At most max_pending calls may be queued or running at once; beyond
+that run_in_pool() raises PoolBusyError rather than queueing without bound.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app import metrics, settings
+
+
+class PoolBusyError(Exception):
+    """raised when the worker pool already has max_pending calls queued"""
+
+
+_executor: Optional[Executor] = None
+_slots = threading.BoundedSemaphore(settings.MAX_PENDING)
+_config = {
+    "worker_type": settings.WORKER_TYPE,
+    "workers": settings.WORKERS,
+    "max_pending": settings.MAX_PENDING,
+}
+_lock = threading.Lock()
+
+
+def warm_up():
+    """Loads the models and fills the coefficient draw cache"""
+    # imported here rather than at module level so that importing the API
+    # doesn't load the models
+    from app.prediction import pipeline
+
+    pipeline.warm_up()
+
+
+def configure_pool(worker_type: str, workers: int, max_pending: int):
+    """
+    Replaces the pool settings taken from the environment. The pool is
+    created with the new settings on next use.
+
+    Args:
+        worker_type: "thread" or "process"
+        workers: Number of worker threads / processes
+        max_pending: Maximum number of calls queued or running at once
+    """
+    global _executor, _slots
+
+    if worker_type not in ("thread", "process"):
+        raise ValueError(
+            f"worker_type must be 'thread' or 'process'; got {worker_type}"
+        )
+
+    shutdown_pool()
+    with _lock:
+        _config.update(
+            worker_type=worker_type, workers=workers, max_pending=max_pending
+        )
+        _slots = threading.BoundedSemaphore(max_pending)
+
+
+def get_pool() -> Executor:
+    """Returns the worker pool, creating it on first use"""
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            if _config["worker_type"] == "process":
+                _executor = ProcessPoolExecutor(
+                    max_workers=_config["workers"], initializer=warm_up
+                )
+            else:
+                _executor = ThreadPoolExecutor(
+                    max_workers=_config["workers"], thread_name_prefix="inference"
+                )
+        return _executor
+
+
+def start_pool():
+    """
+    Creates and pre-warms the pool. Thread workers share this process's
+    draw cache, so it is filled here; process workers fill their own as they
+    start, and submitting a call makes the executor start them.
+    """
+    pool = get_pool()
+    if isinstance(pool, ProcessPoolExecutor):
+        pool.submit(int).result()
+    else:
+        warm_up()
+
+
+def shutdown_pool():
+    """Shuts the pool down, waiting for running calls to finish"""
+    global _executor
+
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+async def run_in_pool(fn: Callable, *args):
+    """
+    Runs fn(*args) in the worker pool and awaits its result.
+
+    fn and args must be picklable if the pool uses processes.
+
+    Raises:
+        PoolBusyError: if max_pending calls are already queued or running
+    """
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise PoolBusyError("Too many predictions in progress, please retry")
+
+    try:
+        pool = get_pool()
+        # stage timings recorded in a worker process are returned with the
+        # result, to be added to this process's metrics
+        recorded = settings.METRICS and isinstance(pool, ProcessPoolExecutor)
+        if recorded:
+            future = pool.submit(metrics.run_recorded, fn, *args)
+        else:
+            future = pool.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+
+    # hold the slot until the work itself finishes, even if the awaiting
+    # request is cancelled
+    future.add_done_callback(lambda _: slots.release())
+    result = await asyncio.wrap_future(future)
+    if recorded:
+        result, stages = result
+        metrics.record_stages(stages)
+    return result
@@ -1,12 +1,9 @@
+import numpy as np
+
 from app.prediction.predict import impute
-from app.Fixtures.gams import (
-    LACTATE_GAM,
-    ALBUMIN_GAM,
-    LACTATE_TRANSFORMER,
-    ALBUMIN_TRANSFORMER,
-)
-from typing import List
-from app.models import ProcessedPrediction
+from app.Fixtures.constants import LACTATE_COLUMN, ALBUMIN_COLUMN
+from app.Fixtures import gams
+from typing import List, Optional
 
 
 async def impute_lactate(missing_vars: List, n_samples: int, seed: int) -> List[List]:
@@ -16,8 +13,8 @@ async def impute_lactate(missing_vars: List, n_samples: int, seed: int) -> List[
     imputed_values = impute(
         features=[missing_vars],
         n_samples=n_samples,
-        model=LACTATE_GAM,
-        transformer=LACTATE_TRANSFORMER,
+        model=gams.LACTATE_GAM,
+        transformer=gams.LACTATE_TRANSFORMER,
         random_seed=seed,
     )
 
@@ -31,37 +28,46 @@ async def impute_albumin(missing_vars: List, n_samples: int, seed: int) -> List[
     imputed_values = impute(
         features=[missing_vars],
         n_samples=n_samples,
-        model=ALBUMIN_GAM,
-        transformer=ALBUMIN_TRANSFORMER,
+        model=gams.ALBUMIN_GAM,
+        transformer=gams.ALBUMIN_TRANSFORMER,
         random_seed=seed,
     )
 
     return imputed_values
 
 
-def complete_input(
-    imputed: List, impute_list: List[ProcessedPrediction], Lactate: bool = True
-) -> List[ProcessedPrediction]:
+def expand_imputed(
+    rows: np.ndarray,
+    lactates: Optional[np.ndarray] = None,
+    albumins: Optional[np.ndarray] = None,
+) -> np.ndarray:
     """
-    Takes imputed variables and adds them to inputs
+    Fills in missing lactate and / or albumin with every combination of their
+    imputed values
+
+    Rows are ordered as the imputed values are nested, with albumin varying
+    slowest: row a * n_lactates + l holds the a-th albumin and l-th lactate.
 
     Args:
-        imputed: list of imputed variables
-        impute_list: Prediction object or list of objects with missing variable to be filled in
-        Lactate: if true variable to be filled in is lactate, else albumin will be populated
+        rows: Mortality model inputs of shape (n_patients, 21), in the order
+            of MORTALITY_INPUT_VARIABLES
+        lactates: imputed lactates of shape (n_patients, n_lactates), or None
+            if lactate isn't missing
+        albumins: imputed albumins of shape (n_patients, n_albumins), or None
+            if albumin isn't missing
 
     Returns:
-        List of prediction inputs with missing lactate or albumin filled in
-
+        Mortality model inputs of shape
+            (n_patients, n_lactates * n_albumins, 21)
     """
+    rows = np.asarray(rows, dtype=float)
+    n_lactates = 1 if lactates is None else lactates.shape[1]
+    n_albumins = 1 if albumins is None else albumins.shape[1]
 
-    completed = []
-    for i in imputed:
-        for j in impute_list:
-            if Lactate is True:
-                j.Lactate = i
-            else:
-                j.Albumin = i
-            completed.append(j.copy())
+    expanded = np.repeat(rows[:, np.newaxis, :], n_lactates * n_albumins, axis=1)
+    if lactates is not None:
+        expanded[:, :, LACTATE_COLUMN] = np.tile(lactates, (1, n_albumins))
+    if albumins is not None:
+        expanded[:, :, ALBUMIN_COLUMN] = np.repeat(albumins, n_lactates, axis=1)
 
-    return completed
+    return expanded
@@ -0,0 +1,301 @@
+"""
+Synchronous inference pipeline from pre-processed inputs to mortality risk
+samples. Everything here is CPU-bound, so the API runs it in the worker pool
+(see executor.py) rather than on the event loop.
+"""
+
+import numpy as np
+
+from app import metrics
+from app.models import ProcessedPrediction
+from app.prediction.budget import DrawBudget, DEFAULT_BUDGET, memory_chunks
+from app.prediction.predict import (
+    impute_joint,
+    mortality_draws,
+    mortality_quantiles,
+    predict_mortality_adaptive,
+    predict_mortality_batch,
+    predict_mortality_sweep,
+)
+from app.prediction.design import model_matrix
+from app.prediction.impute import expand_imputed
+from app.prediction.sampling import RANDOM, posterior_draws
+from app.prediction.summary import SUMMARY_QUANTILES
+from app.prediction.transform import inverse_transform
+from app.Fixtures.constants import (
+    RANDOM_SEED,
+    IMPUTATION_INPUT_VARIABLES,
+    LACTATE_MISSING_COLUMN,
+    ALBUMIN_MISSING_COLUMN,
+)
+from app.Fixtures import gams
+
+from typing import List, Optional, Tuple
+
+
+def warm_up(budget: DrawBudget = DEFAULT_BUDGET):
+    """Fills the coefficient draw cache for every model used by /predict,
+    and compiles their model matrix builders and inverse transforms"""
+    model_matrix(gams.MORTALTIY_GAM)
+    model_matrix(gams.LACTATE_GAM, gams.ALBUMIN_GAM)
+    model_matrix(gams.LACTATE_GAM)
+    model_matrix(gams.ALBUMIN_GAM)
+    inverse_transform(gams.LACTATE_TRANSFORMER)
+    inverse_transform(gams.ALBUMIN_TRANSFORMER)
+
+    for n_draws in (budget.mortality, budget.imputed_mortality):
+        mortality_draws(n_draws, RANDOM_SEED, budget.sampler, budget.precision)
+    for gam in (gams.LACTATE_GAM, gams.ALBUMIN_GAM):
+        posterior_draws(gam, budget.imputation, RANDOM_SEED, budget.sampler)
+
+
+def impute_missing(
+    missing_vars: np.ndarray,
+    lactate: bool,
+    albumin: bool,
+    n_samples: int = DEFAULT_BUDGET.imputation,
+    sampler: str = RANDOM,
+    random_seed: int = RANDOM_SEED,
+) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Imputes only the variables which are missing, evaluating both imputation
+    models in one pass if both are
+
+    Args:
+        missing_vars: The first 17 input variables, one row per patient
+        lactate: whether lactate is missing
+        albumin: whether albumin is missing
+        n_samples: Number of values to impute per patient and variable
+        sampler: How coefficients and noise are drawn, one of SAMPLERS
+        random_seed: Random seed
+
+    Returns:
+        Imputed lactates and albumins of shape (n_patients, n_samples), or
+        None where that variable isn't missing
+    """
+    models, transformers = [], []
+    if lactate:
+        models.append(gams.LACTATE_GAM)
+        transformers.append(gams.LACTATE_TRANSFORMER)
+    if albumin:
+        models.append(gams.ALBUMIN_GAM)
+        transformers.append(gams.ALBUMIN_TRANSFORMER)
+
+    with metrics.timed("imputation", metrics.model_label(*models)):
+        imputed = impute_joint(
+            missing_vars, n_samples, models, transformers, random_seed, sampler
+        )
+
+    lactates = imputed.pop(0) if lactate else None
+    albumins = imputed.pop(0) if albumin else None
+    return lactates, albumins
+
+
+def sample_mortality(
+    features: List[np.ndarray], n_draws: int, budget: DrawBudget
+) -> List[np.ndarray]:
+    """Mortality risks for each patient's rows of features, stopping early
+    if the budget's tolerance is positive (see app/prediction/budget.py)"""
+    if budget.tolerance > 0:
+        return predict_mortality_adaptive(
+            features,
+            n_draws,
+            RANDOM_SEED,
+            budget.tolerance,
+            sampler=budget.sampler,
+            precision=budget.precision,
+        )
+    return predict_mortality_batch(
+        features, n_draws, RANDOM_SEED, budget.sampler, budget.precision
+    )
+
+
+def predict_single(
+    processed: ProcessedPrediction, budget: DrawBudget = DEFAULT_BUDGET
+) -> np.ndarray:
+    """
+    Predicts the distribution of mortality risk for one patient, imputing
+    lactate and / or albumin if they are missing
+
+    Args:
+        processed: Pre-processed patient
+        budget: Draw counts, and when to stop early
+
+    Returns:
+        Predicted mortality risks
+    """
+    row = [processed.convert_to_list()]
+    lactate = processed.Lactate_missing == 1
+    albumin = processed.Albumin_missing == 1
+
+    if lactate or albumin:
+        lactates, albumins = impute_missing(
+            [row[0][:17]], lactate, albumin, budget.imputation, budget.sampler
+        )
+        rows = expand_imputed(row, lactates, albumins)[0]
+        n_draws = budget.imputed_mortality
+    else:
+        # go straight to mortality prediction
+        rows = row
+        n_draws = budget.mortality
+
+    return sample_mortality([np.asarray(rows, dtype=float)], n_draws, budget)[0]
+
+
+def predict_many(
+    features: np.ndarray, budget: DrawBudget = DEFAULT_BUDGET
+) -> List[np.ndarray]:
+    """
+    Predicts the distribution of mortality risk for several patients
+
+    Patients are grouped by which of lactate and albumin they are missing,
+    and each model is evaluated once over the stacked rows of every patient
+    that needs it, using the same coefficient draws for all of them, so each
+    patient's result matches predict_single(). Batches estimated to need
+    more than RUNE_BATCH_MEMORY_MB are predicted in chunks (see
+    memory_chunks()), which gives the same results.
+
+    Args:
+        features: Pre-processed patients from pre_process_batch(), of shape
+            (n_patients, 21) with NaN for missing lactate / albumin
+        budget: Draw counts, and when to stop early
+
+    Returns:
+        Predicted mortality risks, one array per patient
+    """
+    features = np.asarray(features, dtype=float)
+    missing = features[:, [LACTATE_MISSING_COLUMN, ALBUMIN_MISSING_COLUMN]]
+
+    n_coefficients = max(
+        len(gam.coef_)
+        for gam in (gams.MORTALTIY_GAM, gams.LACTATE_GAM, gams.ALBUMIN_GAM)
+    )
+    chunks = memory_chunks(budget, missing.sum(axis=1), n_coefficients)
+    if len(chunks) > 1:
+        return [
+            result
+            for chunk in chunks
+            for result in predict_many(features[chunk], budget)
+        ]
+
+    patterns = {}
+    for i, pattern in enumerate(map(tuple, missing.astype(int))):
+        patterns.setdefault(pattern, []).append(i)
+
+    results: List[np.ndarray] = [None] * len(features)
+
+    complete = patterns.pop((0, 0), [])
+    if complete:
+        mortality = sample_mortality(
+            [features[i : i + 1] for i in complete], budget.mortality, budget
+        )
+        for i, result in zip(complete, mortality):
+            results[i] = result
+
+    incomplete, filled = [], []
+    for (lactate_missing, albumin_missing), patients in patterns.items():
+        rows = features[patients]
+        lactates, albumins = impute_missing(
+            rows[:, :17],
+            lactate=lactate_missing == 1,
+            albumin=albumin_missing == 1,
+            n_samples=budget.imputation,
+            sampler=budget.sampler,
+        )
+        incomplete.extend(patients)
+        filled.extend(expand_imputed(rows, lactates, albumins))
+
+    if incomplete:
+        mortality = sample_mortality(filled, budget.imputed_mortality, budget)
+        for i, result in zip(incomplete, mortality):
+            results[i] = result
+
+    return results
+
+
+def summarise_exact(features: np.ndarray) -> np.ndarray:
+    """
+    Exact summary quantiles of the mortality risk of patients with both
+    lactate and albumin, in place of summarising sampled risks (see
+    mortality_quantiles())
+
+    Args:
+        features: Pre-processed patients of shape (n_patients, 21), none of
+            them missing lactate or albumin
+
+    Returns:
+        SUMMARY_QUANTILES of shape (n_patients, len(SUMMARY_QUANTILES))
+    """
+    features = np.asarray(features, dtype=float)
+    missing = features[:, [LACTATE_MISSING_COLUMN, ALBUMIN_MISSING_COLUMN]]
+    if missing.any():
+        raise ValueError("Exact summaries need both lactate and albumin")
+    return mortality_quantiles(features, SUMMARY_QUANTILES).T
+
+
+def predict_sweep(
+    features: np.ndarray, column: int, budget: DrawBudget = DEFAULT_BUDGET
+) -> List[np.ndarray]:
+    """
+    Predicts the distribution of mortality risk for variations of one
+    patient which differ only in one input, e.g. over a grid of lactates
+
+    The variations are evaluated together as one patient, so the mortality
+    model's terms which don't use the varied input are evaluated once in
+    all, and lactate / albumin are imputed once if the varied input isn't
+    one the imputation models use. Each result matches predict_single() for
+    that variation, up to floating point rounding. With a tolerance the
+    variations are predicted as separate patients by predict_many() instead.
+
+    Args:
+        features: Pre-processed variations from pre_process_batch(), of shape
+            (n_variations, 21), which differ only in column
+        column: Index of the varied input in MORTALITY_INPUT_VARIABLES
+        budget: Draw counts, and when to stop early
+
+    Returns:
+        Predicted mortality risks, one array per variation
+    """
+    features = np.asarray(features, dtype=float)
+    if budget.tolerance > 0:
+        return predict_many(features, budget)
+
+    lactate = features[0, LACTATE_MISSING_COLUMN] == 1
+    albumin = features[0, ALBUMIN_MISSING_COLUMN] == 1
+    if not (lactate or albumin):
+        rows = list(features[:, np.newaxis])
+        return predict_mortality_sweep(
+            rows,
+            column,
+            budget.mortality,
+            RANDOM_SEED,
+            budget.sampler,
+            budget.precision,
+        )
+
+    n_inputs = len(IMPUTATION_INPUT_VARIABLES)
+    if column < n_inputs:
+        lactates, albumins = impute_missing(
+            features[:, :n_inputs], lactate, albumin, budget.imputation, budget.sampler
+        )
+    else:
+        # the imputed values are the same for every variation
+        lactates, albumins = (
+            None if imputed is None else np.repeat(imputed, len(features), axis=0)
+            for imputed in impute_missing(
+                features[:1, :n_inputs],
+                lactate,
+                albumin,
+                budget.imputation,
+                budget.sampler,
+            )
+        )
+    rows = list(expand_imputed(features, lactates, albumins))
+    return predict_mortality_sweep(
+        rows,
+        column,
+        budget.imputed_mortality,
+        RANDOM_SEED,
+        budget.sampler,
+        budget.precision,
+    )
@@ -1,14 +1,38 @@
 import numpy as np
 import pandas as pd
-from numpy.random import RandomState
 from sklearn.preprocessing import QuantileTransformer
 from pygam import GAM, LinearGAM
 from pygam.distributions import NormalDist
-from app.Fixtures.gams import MORTALTIY_GAM
+from scipy.special import ndtri
+from typing import List, Optional, Sequence, Tuple
+from app import metrics
+from app.Fixtures import gams
+from app.Fixtures.constants import (
+    ADAPTIVE_BLOCKS,
+    ADAPTIVE_MIN_BLOCKS,
+    ALBUMIN_COLUMN,
+    LACTATE_COLUMN,
+)
+from app.prediction.design import SharedModelMatrix, model_matrix
+from app.prediction.sampling import (
+    RANDOM,
+    centred_draws,
+    coefficient_draws,
+    covariance_factor,
+    posterior_draws,
+    sample_coefficients,
+)
+from app.prediction.summary import SUMMARY_QUANTILES, row_quantiles
+from app.prediction.transform import inverse_transform
 
 
 def quick_sample(
-    gam: GAM, sample_at_X: np.ndarray, quantity: str, n_draws: int, random_seed: int
+    gam: GAM,
+    sample_at_X: np.ndarray,
+    quantity: str,
+    n_draws: int,
+    random_seed: int,
+    legacy_rng: bool = True,
 ) -> np.ndarray:
     """
     Sample from the multivariate normal distribution over the GAM's
@@ -28,6 +52,13 @@ def quick_sample(
     the model distribution inside this function, but we have only implemented
     this for a Gaussian model distribution.
 
+    By default coefficient draws are cached per (gam, random_seed, n_draws),
+    so repeated calls with the same arguments skip the covariance
+    decomposition but return exactly the same samples as RandomState. With
+    legacy_rng=False draws are instead made fresh on each call with
+    np.random.default_rng, from a cached factorisation of the covariance
+    matrix, which is the cheaper option when seeds vary between calls.
+
     Parameters
     -----------
     gam: fitted GAM object
@@ -36,7 +67,8 @@ def quick_sample(
         Input data at which to draw new samples.
         Only applies for `quantity` equal to `'y'` or to `'mu`'.
 
-    random_seed: For input to np.random.RandomState
+    random_seed: For input to np.random.RandomState, or
+        np.random.default_rng if legacy_rng is False
 
     quantity : {'y', 'coef', 'mu'}, default: 'y'
         What quantity to return pseudorandom samples of.
@@ -45,6 +77,9 @@ def quick_sample(
         The number of samples to draw from distribution over the model
             coefficients
 
+    legacy_rng : bool, default: True
+        Whether to reproduce the legacy RandomState sampling stream
+
     Returns
     -------
     draws : 2D array of length n_draws
@@ -63,16 +98,23 @@ def quick_sample(
             "`quantity` must be one of 'mu', 'coef', 'y';" f" got {quantity}"
         )
 
-    rnd = RandomState(random_seed)
-    coef_draws = rnd.multivariate_normal(
-        gam.coef_, gam.statistics_["cov"], size=n_draws
-    )
+    model = metrics.model_label(gam)
+    with metrics.timed("coefficient_sampling", model):
+        if legacy_rng:
+            coef_draws, rnd = coefficient_draws(gam, n_draws, random_seed)
+        else:
+            coef_draws, rnd = sample_coefficients(gam, n_draws, random_seed)
 
     if quantity == "coef":
         return coef_draws
 
-    linear_predictor = gam._modelmat(sample_at_X).dot(coef_draws.T)
-    mu_shape_n_draws_by_n_samples = gam.link.mu(linear_predictor, gam.distribution).T
+    with metrics.timed("model_matrix", model):
+        modelmat = build_model_matrix(gam, sample_at_X)
+    with metrics.timed("link", model):
+        linear_predictor = modelmat.dot(coef_draws.T)
+        mu_shape_n_draws_by_n_samples = gam.link.mu(
+            linear_predictor, gam.distribution
+        ).T
     if quantity == "mu":
         return mu_shape_n_draws_by_n_samples
     else:
@@ -86,6 +128,23 @@ def quick_sample(
             raise NotImplementedError
 
 
+def build_model_matrix(gam: GAM, X: np.ndarray) -> np.ndarray:
+    """Builds the model matrix for X, using the GAM's compiled dense builder
+    where its terms are supported and pygam's gam._modelmat() otherwise.
+
+    Args:
+        gam: Fitted GAM
+        X: Input data of shape (n_samples, m_features)
+
+    Returns:
+        Model matrix of shape (n_samples, len(gam.coef_))
+    """
+    builder = model_matrix(gam)
+    if builder is None:
+        return gam._modelmat(X)
+    return builder(X)
+
+
 def impute(
     features: pd.DataFrame,
     n_samples: int,
@@ -117,34 +176,407 @@ def impute(
         n_draws=n_samples,
         random_seed=random_seed,
     ).flatten()
-    return transformer.inverse_transform(y_pred.reshape(-1, 1)).flatten()
+    return inverse_transform(transformer)(y_pred)
+
+
+def impute_batch(
+    features: np.ndarray,
+    n_samples: int,
+    model: LinearGAM,
+    transformer: QuantileTransformer,
+    random_seed: int,
+) -> np.ndarray:
+    """Impute distributions of missing lactate or albumin values for several
+        patients at once.
+
+    The coefficient draws and observation noise are shared across patients,
+    so each row of the output is exactly what impute() returns for that
+    patient alone, but the model matrix and linear predictor are evaluated
+    once for the whole batch.
+
+    Args:
+        features: Input data with one row per patient. Columns should follow
+            the order specified in IMPUTATION_INPUT_VARIABLES. Categorical
+            variables should be encoded as integers. Continuous variables
+            should be Winsorized.
+        n_samples: Number of lactate / albumin values to impute per patient
+        model: Pre-fitted lactate / albumin imputation GAM
+        transformer: Pre-fitted tranformer to transform Gaussian GAM output
+            back to lactate / albumin space
+        random_seed: Random seed
+
+    Returns:
+        Predicted lactate / albumin values of shape (n_patients, n_samples)
+    """
+    return impute_joint(features, n_samples, [model], [transformer], random_seed)[0]
+
+
+def impute_joint(
+    features: np.ndarray,
+    n_samples: int,
+    models: Sequence[LinearGAM],
+    transformers: Sequence[QuantileTransformer],
+    random_seed: int,
+    sampler: str = RANDOM,
+) -> List[np.ndarray]:
+    """Impute distributions of several missing variables (e.g. both lactate
+        and albumin) for the same patients in one pass.
+
+    The imputation models share their input variables, so their model
+    matrices are built together from one evaluation of the shared spline
+    bases. Each model's values are the same as impute_batch() gives for that
+    model alone.
+
+    Args:
+        features: Input data with one row per patient, as for impute_batch()
+        n_samples: Number of values to impute per patient and variable
+        models: Pre-fitted imputation GAMs
+        transformers: Pre-fitted tranformers, one for each model
+        random_seed: Random seed
+        sampler: How coefficients and noise are drawn, one of SAMPLERS
+
+    Returns:
+        Predicted values of shape (n_patients, n_samples), one array per
+            model
+    """
+    with metrics.timed("model_matrix", metrics.model_label(*models)):
+        builder = model_matrix(*models)
+        if builder is None:
+            modelmats = [model._modelmat(features) for model in models]
+        else:
+            modelmat = builder(features)
+            modelmats = [modelmat[:, columns] for columns in builder.blocks]
+
+    imputed = []
+    for model, transformer, modelmat in zip(models, transformers, modelmats):
+        if not isinstance(model.distribution, NormalDist):
+            raise NotImplementedError
+
+        label = metrics.model_label(model)
+        with metrics.timed("coefficient_sampling", label):
+            coef_draws, noise = posterior_draws(
+                model, n_samples, random_seed, sampler, noise=True
+            )
+        with metrics.timed("link", label):
+            mu = model.link.mu(modelmat.dot(coef_draws.T), model.distribution)
+            scale = model.distribution.scale
+            standard_deviation = scale**0.5 if scale else 1.0
+            y_pred = mu + standard_deviation * noise
+
+        with metrics.timed("inverse_transform", label):
+            imputed.append(inverse_transform(transformer)(y_pred))
+
+    return imputed
+
+
+def mortality_model_matrix(
+    groups: List[np.ndarray], varying: Sequence[int] = ()
+) -> SharedModelMatrix:
+    """Mortality model matrix of groups of rows, evaluating the terms which
+    don't use lactate, albumin or varying once per group"""
+    with metrics.timed("model_matrix", "mortality"):
+        return SharedModelMatrix(
+            gams.MORTALTIY_GAM,
+            groups,
+            (LACTATE_COLUMN, ALBUMIN_COLUMN) + tuple(varying),
+        )
+
+
+def mortality_draws(
+    n_draws: int, random_seed: int, sampler: str = RANDOM, precision: str = "float64"
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Mortality model coefficient draws in the given precision
+
+    In float32 the draws are stored centred on the mean coefficients (see
+    centred_draws()), which are returned to be added back in float64 by
+    mortality_linear_predictor().
+
+    Returns:
+        draws: Array of shape (n_draws, n_coefs) of dtype precision
+        mean: The mean coefficients the draws are centred on, or None
+    """
+    gam = gams.MORTALTIY_GAM
+    with metrics.timed("coefficient_sampling", "mortality"):
+        if precision == "float64":
+            return posterior_draws(gam, n_draws, random_seed, sampler)[0], None
+        draws = centred_draws(gam, n_draws, random_seed, sampler, np.dtype(precision))
+        return draws, gam.coef_
+
+
+def mortality_linear_predictor(
+    modelmat: SharedModelMatrix,
+    coef_draws: np.ndarray,
+    mean: Optional[np.ndarray] = None,
+    groups: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    """modelmat.dot() of the draws from mortality_draws(), of shape
+    (n_rows, n_draws) in their dtype, adding the mean linear predictor if
+    they're centred"""
+    linear_predictor = modelmat.dot(coef_draws.T, groups)
+    if mean is not None:
+        centre = modelmat.dot(mean, groups)
+        linear_predictor += centre.astype(linear_predictor.dtype)[:, np.newaxis]
+    return linear_predictor
+
+
+def mortality_samples(
+    modelmat: SharedModelMatrix,
+    n_rows: List[int],
+    n_samples_per_row: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    precision: str = "float64",
+) -> List[np.ndarray]:
+    """Mortality risks for every row of modelmat, split into patients of
+    n_rows rows each and ordered as predict_mortality() orders them"""
+    gam = gams.MORTALTIY_GAM
+    coef_draws, mean = mortality_draws(
+        n_samples_per_row, random_seed, sampler, precision
+    )
+    with metrics.timed("link", "mortality"):
+        linear_predictor = mortality_linear_predictor(modelmat, coef_draws, mean)
+        mu = gam.link.mu(linear_predictor, gam.distribution).T
+    return [
+        patient.flatten() for patient in np.split(mu, np.cumsum(n_rows)[:-1], axis=1)
+    ]
 
 
 def predict_mortality(
-    features: np.array, n_samples_per_row: int, random_seed: int
+    features: np.array,
+    n_samples_per_row: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    precision: str = "float64",
 ) -> np.ndarray:
     """Predict distribution of mortality risks for single patient.
 
     Args:
         features: Input data. Will have single row if both lactate and albumin
             are non-missing. Otherwise, will have multiple rows where variables
-            apart from imputed lactate / albumin are the same. Columns should
+            apart from imputed lactate / albumin are the same; rows which
+            differ otherwise are still predicted correctly, but without
+            sharing the terms that don't use lactate or albumin. Columns should
             follow the order specified in MORTALITY_INPUT_VARIABLES
             Categorical variables should be encoded as integers. Continuous
             variables should be Winsorized.
         n_samples_per_row: Number of mortality risks to predict for each row of
             features
-        model: Pre-fitted mortality GAM
         random_seed: Random seed
+        sampler: How coefficients are drawn, one of SAMPLERS
+        precision: Float dtype the risks are computed in, one of PRECISIONS.
+            float32 halves the memory of the draws and risks
 
     Returns:
         Predicted mortality risks of shape
             (features.shape[0] * n_samples_per_row,)
     """
-    return quick_sample(
-        gam=MORTALTIY_GAM,
-        sample_at_X=features,
-        quantity="mu",
-        n_draws=n_samples_per_row,
-        random_seed=random_seed,
-    ).flatten()
+    return predict_mortality_batch(
+        [np.asarray(features, dtype=float)],
+        n_samples_per_row,
+        random_seed,
+        sampler,
+        precision,
+    )[0]
+
+
+def predict_mortality_batch(
+    features: List[np.ndarray],
+    n_samples_per_row: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    precision: str = "float64",
+) -> List[np.ndarray]:
+    """Predict distributions of mortality risks for several patients with a
+    single model matrix evaluation.
+
+    The terms which don't use lactate or albumin are evaluated once per
+    patient rather than once per imputed row (see SharedModelMatrix).
+
+    Args:
+        features: One array of input rows per patient, each as described in
+            predict_mortality()
+        n_samples_per_row: Number of mortality risks to predict for each row of
+            features
+        random_seed: Random seed
+        sampler: How coefficients are drawn, one of SAMPLERS
+        precision: Float dtype the risks are computed in, one of PRECISIONS
+
+    Returns:
+        One array of predicted mortality risks per patient, ordered as
+            predict_mortality() would order them
+    """
+    return mortality_samples(
+        mortality_model_matrix(features),
+        [len(rows) for rows in features],
+        n_samples_per_row,
+        random_seed,
+        sampler,
+        precision,
+    )
+
+
+def predict_mortality_sweep(
+    features: List[np.ndarray],
+    column: int,
+    n_samples_per_row: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    precision: str = "float64",
+) -> List[np.ndarray]:
+    """Predict distributions of mortality risks for variations of one
+    patient which differ only in one input column (and imputed lactate /
+    albumin), e.g. a grid of ages.
+
+    The terms which don't use column, lactate or albumin are evaluated once
+    for every variation.
+
+    Args:
+        features: One array of input rows per variation, each as described in
+            predict_mortality()
+        column: Index of the column which differs between variations
+        n_samples_per_row: Number of mortality risks to predict for each row of
+            features
+        random_seed: Random seed
+        sampler: How coefficients are drawn, one of SAMPLERS
+        precision: Float dtype the risks are computed in, one of PRECISIONS
+
+    Returns:
+        One array of predicted mortality risks per variation, as
+            predict_mortality_batch() returns them
+    """
+    return mortality_samples(
+        mortality_model_matrix([np.concatenate(features)], (column,)),
+        [len(rows) for rows in features],
+        n_samples_per_row,
+        random_seed,
+        sampler,
+        precision,
+    )
+
+
+def predict_mortality_adaptive(
+    features: List[np.ndarray],
+    max_draws_per_row: int,
+    random_seed: int,
+    tolerance: float,
+    n_blocks: int = ADAPTIVE_BLOCKS,
+    min_blocks: int = ADAPTIVE_MIN_BLOCKS,
+    sampler: str = RANDOM,
+    precision: str = "float64",
+) -> List[np.ndarray]:
+    """Predict distributions of mortality risks for several patients,
+    stopping early for each patient once their summary quantiles are
+    estimated precisely enough.
+
+    The coefficient draws are used in n_blocks equal blocks. Blocks are
+    independent, so the standard error of each of a patient's
+    SUMMARY_QUANTILES is estimated by batch means, as the standard deviation
+    of the quantiles of each block over the square root of the number of
+    blocks. No more are sampled for a patient once, after at least
+    min_blocks blocks, none of these standard errors exceeds tolerance.
+
+    Args:
+        features: One array of input rows per patient, each as described in
+            predict_mortality()
+        max_draws_per_row: Number of mortality risks to predict for each
+            row of features if the quantiles don't converge sooner
+        random_seed: Random seed
+        tolerance: Largest standard error of any summary quantile at which
+            to stop
+        n_blocks: Number of blocks the draws are split into
+        min_blocks: Number of blocks sampled before stopping
+        sampler: How coefficients are drawn, one of SAMPLERS
+        precision: Float dtype the risks are computed in, one of PRECISIONS
+
+    Returns:
+        One array of predicted mortality risks per patient, the first of
+            those predict_mortality_batch() would return for max_draws_per_row
+    """
+    gam = gams.MORTALTIY_GAM
+    n_rows = [len(rows) for rows in features]
+
+    modelmat = mortality_model_matrix(features)
+    coef_draws, mean = mortality_draws(
+        max_draws_per_row, random_seed, sampler, precision
+    )
+
+    # the first min_blocks are sampled together, then one block at a time.
+    # Any remainder of draws is left to a shorter final block, after which
+    # there is nothing left to decide
+    block_size = max(max_draws_per_row // n_blocks, 1)
+    first_step = min(min_blocks * block_size, max_draws_per_row)
+    steps = list(range(first_step, max_draws_per_row, block_size))
+    steps = list(zip([0] + steps, steps + [max_draws_per_row]))
+
+    samples: List[List[np.ndarray]] = [[] for _ in features]
+    block_quantiles: List[List[np.ndarray]] = [[] for _ in features]
+    active = list(range(len(features)))
+
+    for start, stop in steps:
+        groups = None if len(active) == len(features) else active
+        with metrics.timed("link", "mortality"):
+            mu = gam.link.mu(
+                mortality_linear_predictor(
+                    modelmat, coef_draws[start:stop], mean, groups
+                ),
+                gam.distribution,
+            )
+        final = stop == max_draws_per_row
+
+        still_active = []
+        offset = 0
+        for i in active:
+            # draws by rows, flattened in the order quick_sample() gives
+            step_samples = mu[offset : offset + n_rows[i]].T
+            offset += n_rows[i]
+            samples[i].append(step_samples.flatten())
+            if final:
+                continue
+
+            blocks = step_samples.reshape((stop - start) // block_size, -1)
+            block_quantiles[i].extend(row_quantiles(blocks, SUMMARY_QUANTILES))
+            n_sampled = len(block_quantiles[i])
+            standard_errors = np.std(block_quantiles[i], axis=0, ddof=1) / np.sqrt(
+                n_sampled
+            )
+            if standard_errors.max() > tolerance:
+                still_active.append(i)
+        active = still_active
+        if not active:
+            break
+
+    return [np.concatenate(patient) for patient in samples]
+
+
+def mortality_quantiles(
+    features: np.ndarray, quantiles: Sequence[float] = SUMMARY_QUANTILES
+) -> np.ndarray:
+    """Exact quantiles of the mortality risks of patients with complete data,
+    without sampling.
+
+    The sampled coefficients are multivariate normal, so a patient's linear
+    predictor x·β is normal with mean x·coef_ and variance xΣxᵀ. The link is
+    monotonic, so each quantile of risk is the link applied to the same
+    quantile of the linear predictor. These are the values the quantiles of
+    predict_mortality() converge to as the number of draws grows.
+
+    Args:
+        features: Input data with one row per patient, both lactate and
+            albumin present, as described in predict_mortality()
+        quantiles: Probabilities in (0, 1) of the quantiles to compute
+
+    Returns:
+        Quantiles of shape (len(quantiles), n_patients), as
+            summarise_samples() gives them for sampled risks
+    """
+    gam = gams.MORTALTIY_GAM
+    with metrics.timed("model_matrix", "mortality"):
+        modelmat = build_model_matrix(gam, np.atleast_2d(features))
+    with metrics.timed("link", "mortality"):
+        mean = modelmat.dot(gam.coef_)
+        # Σ = FᵀF for the factor the coefficient draws are made with
+        factor = covariance_factor(gam, legacy=True)
+        sd = np.sqrt(np.square(modelmat.dot(factor.T)).sum(axis=1))
+        z = ndtri(np.asarray(quantiles, dtype=float))[:, np.newaxis]
+        return gam.link.mu(mean + z * sd, gam.distribution)
@@ -1,92 +1,526 @@
+import asyncio
 import fastapi
 import uuid
 import numpy as np
+from starlette.requests import ClientDisconnect
+
+from app import metrics
 
 from app.models import (
     Prediction,
     ProcessedPrediction,
     PredictionResult,
+    BatchPredictionResult,
     ValidationError,
+    ResponseFormat,
+    EncodedDtype,
+    SweepRequest,
+    SweepResult,
+)
+from app.prediction.budget import DrawBudget, request_budget
+from app.prediction.preprocess import (
+    pre_process_input,
+    pre_process_batch,
+    sweep_features,
+)
+from app.prediction.executor import run_in_pool, PoolBusyError
+from app.prediction.cache import RESULT_CACHE, result_key
+from app.prediction.serialize import format_result, to_bytes
+from app.prediction.stream import chunk_stream, score_records
+from app.prediction.summary import (
+    SUMMARY_QUANTILES,
+    summarise_samples,
+    summarise_ragged,
+    format_summary,
+)
+from app.Fixtures.constants import (
+    RANDOM_SEED,
+    MAX_BATCH_SIZE,
+    STREAM_CHUNK_SIZE,
+    LACTATE_MISSING_COLUMN,
+    ALBUMIN_MISSING_COLUMN,
+    MORTALITY_INPUT_FIELDS,
+    WINSOR_THRESHOLDS,
 )
-from app.prediction.preprocess import pre_process_input
-from app.prediction.predict import predict_mortality
-from app.prediction.impute import impute_lactate, impute_albumin, complete_input
-from app.Fixtures.constants import RANDOM_SEED
 
-from typing import List
+from typing import Dict, List, Optional, Union
 
 router = fastapi.APIRouter()
 
+# wait between attempts to submit a /predict/stream chunk to a full pool
+STREAM_RETRY_SECONDS = 0.05
+# /predict/stream chunks read ahead of the one being scored
+STREAM_READ_AHEAD = 1
+
+
+def summarise(result: np.ndarray) -> Dict:
+    """Summary statistics of a distribution of predicted mortality risks"""
+    quantiles = summarise_samples(result, SUMMARY_QUANTILES)["Quantiles"]
+    return format_summary(quantiles)
+
+
+def cache_key(
+    processed: Union[ProcessedPrediction, np.ndarray], budget: DrawBudget
+) -> str:
+    """Result cache key, covering everything the pipeline output depends on"""
+    return result_key(processed, RANDOM_SEED, *budget)
+
+
+def draw_budget(
+    draws: Optional[int] = fastapi.Query(
+        None, ge=1, description="Mortality risks sampled with complete data"
+    ),
+    imputation_draws: Optional[int] = fastapi.Query(
+        None, ge=1, description="Values imputed for each missing variable"
+    ),
+    imputed_draws: Optional[int] = fastapi.Query(
+        None, ge=1, description="Mortality risks sampled per imputed value"
+    ),
+    tolerance: Optional[float] = fastapi.Query(
+        None,
+        ge=0,
+        description="Stop sampling once the standard error of each summary "
+        "quantile, estimated from blocks of draws, is below this, 0 to use "
+        "every draw",
+    ),
+    sampler: Optional[str] = fastapi.Query(
+        None,
+        description="How the draws are generated: random, or quasi-random sobol "
+        "or lhs, which need fewer draws for the same accuracy",
+    ),
+) -> DrawBudget:
+    """The server's draw budget with any overridden by query parameters"""
+    try:
+        return request_budget(
+            draws, imputation_draws, imputed_draws, tolerance, sampler
+        )
+    except ValueError as ve:
+        raise fastapi.HTTPException(status_code=400, detail=str(ve))
+
+
+EXACT_DESCRIPTION = (
+    "Summarise patients with both lactate and albumin in closed form, "
+    "without sampling"
+)
+
+
+def check_exact_format(response_format: ResponseFormat):
+    """Exact summaries have no samples to return in other formats"""
+    if response_format != ResponseFormat.summary:
+        raise fastapi.HTTPException(
+            status_code=400, detail="Exact predictions are only available as summaries"
+        )
+
+
+async def run_inference(fn, *args):
+    """Runs part of the inference pipeline in the worker pool, turning a
+    full pool into a 503 response"""
+    try:
+        return await run_in_pool(fn, *args)
+    except PoolBusyError as pbe:
+        raise fastapi.HTTPException(
+            status_code=503, detail=str(pbe), headers={"Retry-After": "1"}
+        )
+
 
 @router.post("/predict", response_model=PredictionResult)
-async def predict(prediction: Prediction):
-    """Stuff to do with prediction goes here"""
+async def predict(
+    prediction: Prediction,
+    response_format: Optional[ResponseFormat] = fastapi.Query(
+        None, alias="format", description="full by default, summary when exact"
+    ),
+    dtype: EncodedDtype = fastapi.Query(EncodedDtype.float32),
+    bins: int = fastapi.Query(50, ge=1, le=1000),
+    accept: Optional[str] = fastapi.Header(None),
+    budget: DrawBudget = fastapi.Depends(draw_budget),
+    exact: bool = fastapi.Query(False, description=EXACT_DESCRIPTION),
+):
+    """Stuff to do with prediction goes here
+
+    The full set of predicted risks is returned by default. Smaller responses
+    are available with the format query parameter:
+
+    - summary: only the summary statistics
+    - histogram: a histogram of the risks with the given number of bins
+    - quantiles: the risks at 101 evenly spaced quantiles
+    - base64: the risks as base64 encoded little-endian floats of dtype
+    - binary: the raw little-endian floats of dtype as
+      application/octet-stream, with the ID, seed and summary in X- headers.
+      Also selected by an Accept: application/octet-stream header
+
+    Draw counts default to the server's, and may be set with the draws,
+    imputation_draws and imputed_draws query parameters. With a positive
+    tolerance sampling stops early once the summary has converged. Draws in
+    the response (X-Draws for binary) gives the number of risks sampled.
+
+    With exact=true the summary of a patient with both lactate and albumin
+    is computed in closed form rather than from samples, with Draws 0 and
+    Exact true. Only format=summary is available, as there are no samples.
+    Patients missing either fall back to sampling, with Exact false.
+    """
 
     predict_ID = str(uuid.uuid4())
     # seed = abs(hash(predict_ID)) & 0xFFFFFFFF
 
+    if accept and "application/octet-stream" in accept:
+        response_format = ResponseFormat.binary
+    elif response_format is None:
+        response_format = ResponseFormat.summary if exact else ResponseFormat.full
+    if exact:
+        check_exact_format(response_format)
+
     try:
         processed = pre_process_input(prediction)
     except ValidationError as ve:
         raise fastapi.HTTPException(status_code=ve.status_code, detail=ve.error_msg)
 
-    if processed.Lactate_missing == 0 and processed.Albumin_missing == 0:
-        # go straight to mortality prediction
-        result = predict_mortality([processed.convert_to_list()], 10000, RANDOM_SEED)
-    else:
-        lactates = await impute_lactate(
-            processed.convert_to_list()[:17], 10, RANDOM_SEED
+    lactate = processed.Lactate_missing == 1
+    albumin = processed.Albumin_missing == 1
+    missing = metrics.missing_label(lactate, albumin)
+
+    if exact and not (lactate or albumin):
+        from app.prediction.pipeline import summarise_exact
+
+        features = np.array([processed.convert_to_list()], dtype=float)
+        quantiles = await run_inference(summarise_exact, features)
+        metrics.PATIENTS.inc(path="/predict", missing=missing)
+        with metrics.timed("serialization"):
+            prediction_result = {
+                "ID": predict_ID,
+                "Seed": RANDOM_SEED,
+                "Summary": format_summary(quantiles[0]),
+                "Draws": 0,
+                "Exact": True,
+                "Inputs": prediction.__dict__,
+            }
+            return fastapi.responses.JSONResponse(
+                content=prediction_result, status_code=200
+            )
+
+    key = cache_key(processed, budget)
+    result = RESULT_CACHE.get(key)
+    if result is None:
+        # imported on first use so that importing the API doesn't load the
+        # models
+        from app.prediction.pipeline import predict_single
+
+        result = await run_inference(predict_single, processed, budget)
+        RESULT_CACHE.put(key, result)
+
+    metrics.PATIENTS.inc(path="/predict", missing=missing)
+
+    with metrics.timed("summary"):
+        summary = summarise(result)
+
+    # logging goes here if allowed
+
+    if response_format == ResponseFormat.binary:
+        headers = {
+            "X-Prediction-ID": predict_ID,
+            "X-Seed": str(RANDOM_SEED),
+            "X-Dtype": dtype.value,
+            "X-Length": str(len(result)),
+            "X-Draws": str(len(result)),
+        }
+        headers.update({f"X-Summary-{k}": v for k, v in summary.items()})
+        with metrics.timed("serialization"):
+            return fastapi.responses.Response(
+                content=to_bytes(result, dtype),
+                media_type="application/octet-stream",
+                headers=headers,
+            )
+
+    with metrics.timed("serialization"):
+        prediction_result = {
+            "ID": predict_ID,
+            "Seed": RANDOM_SEED,
+            **format_result(result, response_format, dtype, bins),
+            "Summary": summary,
+            "Draws": len(result),
+            "Exact": False,
+            "Inputs": prediction.__dict__,
+        }
+        return fastapi.responses.JSONResponse(
+            content=prediction_result, status_code=200
         )
-        albumins = await impute_albumin(
-            processed.convert_to_list()[:17], 10, RANDOM_SEED
+
+
+@router.post("/predict/batch", response_model=BatchPredictionResult)
+async def predict_batch(
+    predictions: List[Prediction],
+    response_format: ResponseFormat = fastapi.Query(
+        ResponseFormat.summary, alias="format"
+    ),
+    dtype: EncodedDtype = fastapi.Query(EncodedDtype.float32),
+    bins: int = fastapi.Query(50, ge=1, le=1000),
+    budget: DrawBudget = fastapi.Depends(draw_budget),
+    exact: bool = fastapi.Query(False, description=EXACT_DESCRIPTION),
+):
+    """Scores many patients in one request
+
+    All patients are pre-processed together, then each model is evaluated
+    once over the stacked rows of every patient that needs it, using the
+    same coefficient draws for all of them. Each patient's summary is the
+    same as /predict would return for them alone.
+
+    Only summaries are returned by default; the format query parameter
+    takes any of the JSON formats accepted by /predict, and the draws and
+    exact as for /predict.
+    """
+    if response_format == ResponseFormat.binary:
+        raise fastapi.HTTPException(
+            status_code=400, detail="Binary format is only available from /predict"
+        )
+    if exact:
+        check_exact_format(response_format)
+
+    if len(predictions) > MAX_BATCH_SIZE:
+        raise fastapi.HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(predictions)} exceeds the maximum of {MAX_BATCH_SIZE}",
         )
 
-        filled_in: List[ProcessedPrediction] = []
+    try:
+        features = pre_process_batch(predictions)
+    except ValidationError as ve:
+        raise fastapi.HTTPException(status_code=ve.status_code, detail=ve.error_msg)
+
+    missing = features[:, [LACTATE_MISSING_COLUMN, ALBUMIN_MISSING_COLUMN]] == 1
+    # patients summarised in closed form, the rest are sampled
+    closed = np.flatnonzero(~missing.any(axis=1)) if exact else np.array([], int)
+    exact_summaries: Dict[int, np.ndarray] = {}
+    if len(closed):
+        from app.prediction.pipeline import summarise_exact
 
-        if processed.Lactate_missing == 1:
-            filled_in = complete_input(
-                imputed=lactates, impute_list=[processed], Lactate=True
+        computed = await run_inference(summarise_exact, features[closed])
+        exact_summaries = dict(zip(closed.tolist(), computed))
+
+    keys = [cache_key(row, budget) for row in features]
+    results = [
+        None if i in exact_summaries else RESULT_CACHE.get(key)
+        for i, key in enumerate(keys)
+    ]
+
+    misses = [
+        i
+        for i, result in enumerate(results)
+        if result is None and i not in exact_summaries
+    ]
+    if misses:
+        from app.prediction.pipeline import predict_many
+
+        computed = await run_inference(predict_many, features[misses], budget)
+        for i, result in zip(misses, computed):
+            RESULT_CACHE.put(keys[i], result)
+            results[i] = result
+
+    for pattern, count in zip(*np.unique(missing, axis=0, return_counts=True)):
+        metrics.PATIENTS.inc(
+            int(count), path="/predict/batch", missing=metrics.missing_label(*pattern)
+        )
+
+    sampled = [i for i in range(len(results)) if i not in exact_summaries]
+    with metrics.timed("summary"):
+        summaries = dict(
+            zip(
+                sampled,
+                summarise_ragged([results[i] for i in sampled], SUMMARY_QUANTILES),
             )
+        )
 
-            if processed.Albumin_missing == 1:
-                filled_in = complete_input(
-                    imputed=albumins, impute_list=filled_in, Lactate=False
+    with metrics.timed("serialization"):
+        batch_result = {
+            "Results": [
+                (
+                    {
+                        "ID": str(uuid.uuid4()),
+                        "Seed": RANDOM_SEED,
+                        "Summary": format_summary(exact_summaries[i]),
+                        "Draws": 0,
+                        "Exact": True,
+                    }
+                    if i in exact_summaries
+                    else {
+                        "ID": str(uuid.uuid4()),
+                        "Seed": RANDOM_SEED,
+                        **format_result(result, response_format, dtype, bins),
+                        "Summary": format_summary(summaries[i]),
+                        "Draws": len(result),
+                        "Exact": False,
+                    }
                 )
+                for i, result in enumerate(results)
+            ]
+        }
+        return fastapi.responses.JSONResponse(content=batch_result, status_code=200)
+
 
-        elif processed.Albumin_missing == 1:
-            filled_in = complete_input(
-                imputed=albumins, impute_list=[processed], Lactate=False
+@router.post("/predict/sweep", response_model=SweepResult)
+async def predict_sweep(
+    sweep: SweepRequest, budget: DrawBudget = fastapi.Depends(draw_budget)
+):
+    """Predicts how a patient's risk changes with one continuous input, e.g.
+    "what if lactate comes back at 6?"
+
+    Returns the risk summary with Variable set to each of Values, or by
+    default to Points evenly spaced values over its range (the range inputs
+    are Winsorized to). Every value is predicted in one batched evaluation
+    sharing the parts of the model which don't depend on Variable, and each
+    summary is the same as /predict would return for the patient with that
+    value. Value in each point is the input as the model sees it, e.g.
+    truncated to an integer for Age. Draws are set as for /predict.
+    """
+    variable = sweep.Variable.value
+    lower, upper = WINSOR_THRESHOLDS[variable]
+    if sweep.Values is None:
+        values = np.linspace(lower, upper, sweep.Points)
+    else:
+        values = np.asarray(sweep.Values, dtype=float)
+        if values.min() < lower or values.max() > upper:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail=f"Values of {variable} must be between {lower} and {upper}",
             )
 
-            if processed.Lactate_missing == 1:
-                filled_in = complete_input(
-                    imputed=lactates, impute_list=filled_in, Lactate=True
+    try:
+        features = sweep_features(sweep.Patient, variable, values)
+    except ValidationError as ve:
+        raise fastapi.HTTPException(status_code=ve.status_code, detail=ve.error_msg)
+
+    keys = [cache_key(row, budget) for row in features]
+    results = [RESULT_CACHE.get(key) for key in keys]
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        from app.prediction.pipeline import predict_sweep as sweep_pipeline
+
+        column = MORTALITY_INPUT_FIELDS.index(variable)
+        computed = await run_inference(sweep_pipeline, features[misses], column, budget)
+        for i, result in zip(misses, computed):
+            RESULT_CACHE.put(keys[i], result)
+            results[i] = result
+
+    metrics.PATIENTS.inc(
+        len(features),
+        path="/predict/sweep",
+        missing=metrics.missing_label(
+            *(features[0, [LACTATE_MISSING_COLUMN, ALBUMIN_MISSING_COLUMN]] == 1)
+        ),
+    )
+
+    with metrics.timed("summary"):
+        summaries = summarise_ragged(results, SUMMARY_QUANTILES)
+
+    with metrics.timed("serialization"):
+        sweep_result = {
+            "ID": str(uuid.uuid4()),
+            "Seed": RANDOM_SEED,
+            "Variable": variable,
+            "Points": [
+                {
+                    "Value": float(value),
+                    "Summary": format_summary(quantiles),
+                    "Draws": len(result),
+                }
+                for value, result, quantiles in zip(
+                    features[:, MORTALITY_INPUT_FIELDS.index(variable)],
+                    results,
+                    summaries,
                 )
+            ],
+        }
+        return fastapi.responses.JSONResponse(content=sweep_result, status_code=200)
+
 
-        filled_lists = []
-        for i in filled_in:
-            filled_lists.append(i.convert_to_list())
+class DuplexStreamingResponse(fastapi.responses.StreamingResponse):
+    """StreamingResponse for content generated while the request body is
+    still being read.
 
-        result = predict_mortality(
-            features=filled_lists, n_samples_per_row=100, random_seed=RANDOM_SEED
+    StreamingResponse watches for the client disconnecting by reading
+    request messages, which would swallow the body chunks the content is
+    generated from. Here a disconnect is seen by request.stream() instead,
+    which raises ClientDisconnect.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def read_records(request: fastapi.Request, queue: asyncio.Queue):
+    """Reads a /predict/stream body into the queue a chunk of records at a
+    time, followed by None at its end, or the error reading it raised"""
+    try:
+        async for chunk in chunk_stream(request.stream(), STREAM_CHUNK_SIZE):
+            await queue.put(chunk)
+    except ClientDisconnect:
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+    else:
+        await queue.put(None)
+
+
+@router.post("/predict/stream")
+async def predict_stream(
+    request: fastapi.Request,
+    response_format: ResponseFormat = fastapi.Query(
+        ResponseFormat.summary, alias="format"
+    ),
+    dtype: EncodedDtype = fastapi.Query(EncodedDtype.float32),
+    bins: int = fastapi.Query(50, ge=1, le=1000),
+    budget: DrawBudget = fastapi.Depends(draw_budget),
+):
+    """Scores a cohort of any size sent as newline-delimited JSON Prediction
+    records, streaming back one NDJSON result per record
+
+    Records are read and scored in chunks of STREAM_CHUNK_SIZE. The body is
+    read by a separate task, at most STREAM_READ_AHEAD chunks ahead of the
+    one being scored, so memory use doesn't grow with the size of the
+    cohort. Invalid records give an error line rather than failing the
+    request (see app/prediction/stream.py). Results aren't cached, so that a
+    large cohort doesn't evict interactive requests.
+    """
+    if response_format == ResponseFormat.binary:
+        raise fastapi.HTTPException(
+            status_code=400, detail="Binary format is only available from /predict"
         )
 
-    median = np.median(result)
-    lower_percentile = np.percentile(result, 2.5)
-    upper_percentile = np.percentile(result, 97.5)
-
-    prediction_result = {
-        "ID": predict_ID,
-        "Seed": RANDOM_SEED,
-        "Result": result.tolist(),
-        "Summary": {
-            "Median": f"{median:4f}",
-            "LowerPercentile": f"{lower_percentile:4f}",
-            "UpperPercentile": f"{upper_percentile:4f}",
-        },
-        "Inputs": prediction.__dict__,
-    }
+    async def results():
+        queue = asyncio.Queue(maxsize=STREAM_READ_AHEAD)
+        reader = asyncio.ensure_future(read_records(request, queue))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                while True:
+                    try:
+                        yield await run_in_pool(
+                            score_records,
+                            chunk,
+                            response_format,
+                            dtype,
+                            bins,
+                            budget,
+                        )
+                        break
+                    except PoolBusyError:
+                        # the response has started, so wait for a slot
+                        # rather than returning 503
+                        await asyncio.sleep(STREAM_RETRY_SECONDS)
+        finally:
+            reader.cancel()
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
 
-    # logging goes here if allowed
 
-    return fastapi.responses.JSONResponse(content=prediction_result, status_code=200)
+@router.get("/predict/cache")
+async def cache_stats():
+    """Result cache size and hit / miss counts. Under app.serve each worker
+    has its own cache, so these are the counts of whichever worker answers,
+    named by Worker"""
+    return {**RESULT_CACHE.stats(), "Worker": metrics.worker()}
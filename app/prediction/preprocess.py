@@ -1,7 +1,43 @@
-from app.Fixtures.gams import CATEGORY_ENCODING
-from app.Fixtures import constants
+import numpy as np
+
+from app import metrics
+from app.Fixtures import constants, gams
 from app.models import Prediction, ValidationError, ProcessedPrediction
-from typing import Dict, Tuple
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Tuple
+
+
+class CategorySpec(NamedTuple):
+    """a categorical input, the model variable whose encoding it must follow
+    and how invalid values are reported"""
+
+    field: str
+    variable: str
+    label: str
+    status_code: int = 400
+
+
+CATEGORY_SPECS = (
+    CategorySpec("ASA", "S03ASAScore", "ASA"),
+    CategorySpec("Cardio", "S03CardiacSigns", "Cardiac Status"),
+    CategorySpec("Resp", "S03RespiratorySigns", "Respiratory Status"),
+    CategorySpec("Malignancy", "S03DiagnosedMalignancy", "Malignancy"),
+    CategorySpec("Soiling", "S03Pred_Peritsoil", "Peritoneal Soiling", 422),
+    CategorySpec("GCS", "S03GlasgowComaScore", "GCS"),
+    CategorySpec("Indication", "Indication", "indication"),
+)
+
+# optional inputs, and the indicator which is 1 when they are missing
+MISSING_INDICATORS = {"Lactate": "Lactate_missing", "Albumin": "Albumin_missing"}
+
+# inputs which pydantic truncates to integers, including after winsorizing
+INTEGER_FIELDS = tuple(
+    name for name, field in ProcessedPrediction.__fields__.items() if field.type_ is int
+)
+
+# inputs which pydantic parses as booleans, 1 / 0 in tabular inputs
+BOOLEAN_FIELDS = tuple(
+    name for name, field in Prediction.__fields__.items() if field.type_ is bool
+)
 
 
 def pre_process_input(pred_input: Prediction) -> ProcessedPrediction:
@@ -18,21 +54,26 @@ def pre_process_input(pred_input: Prediction) -> ProcessedPrediction:
         ProcessedPrediction
     """
     # validate categories are correctly encoded
-    validate_categories(pred_input)
+    with metrics.timed("validation"):
+        validate_categories(pred_input)
 
     processed = dict(pred_input)
 
     # add missing indicators
-    if pred_input.Lactate:
-        processed["Lactate_missing"] = 0
-
-    if pred_input.Albumin:
-        processed["Albumin_missing"] = 0
+    for variable, indicator in MISSING_INDICATORS.items():
+        if processed[variable] is not None:
+            processed[indicator] = 0
 
     # windsorize continous variables
-    winzored = winsorize(processed, constants.WINSOR_THRESHOLDS)
+    with metrics.timed("winsorize"):
+        winzored = winsorize(processed, constants.WINSOR_THRESHOLDS)
+        return ProcessedPrediction(**winzored)
 
-    return ProcessedPrediction(**winzored)
+
+def category_error(spec: CategorySpec, value) -> str:
+    """message for an invalid categorical value"""
+    encoding = gams.CATEGORY_ENCODING[spec.variable]
+    return f"Invalid {spec.label} : {value}. Must be one of {encoding}"
 
 
 def validate_categories(input: Prediction):
@@ -43,36 +84,19 @@ def validate_categories(input: Prediction):
         Prediction model
 
     Returns:
-        Validation error if present
+        Validation error listing every invalid category, if any, with the
+        status code of the first
     """
-
-    if input.ASA not in CATEGORY_ENCODING["S03ASAScore"]:
-        error = f"Invalid ASA : {input.ASA}. Must be one of {CATEGORY_ENCODING['S03ASAScore']}"
-        raise ValidationError(error_msg=error, status_code=400)
-
-    if input.Cardio not in CATEGORY_ENCODING["S03CardiacSigns"]:
-        error = f"Invalid Cardiac Status : {input.Cardio}. Must be one of {CATEGORY_ENCODING['S03CardiacSigns']}"
-        raise ValidationError(error_msg=error, status_code=400)
-
-    if input.Resp not in CATEGORY_ENCODING["S03RespiratorySigns"]:
-        error = f"Invalid Respiratory Status : {input.Resp}. Must be one of {CATEGORY_ENCODING['S03RespiratorySigns']}"
-        raise ValidationError(error_msg=error, status_code=400)
-
-    if input.Malignancy not in CATEGORY_ENCODING["S03DiagnosedMalignancy"]:
-        error = f"Invalid Malignancy : {input.Malignancy}. Must be one of {CATEGORY_ENCODING['S03DiagnosedMalignancy']}"
-        raise ValidationError(error_msg=error, status_code=400)
-
-    if input.Soiling not in CATEGORY_ENCODING["S03Pred_Peritsoil"]:
-        error = f"Invalid Peritoneal Soiling : {input.Soiling }. Must be one of {CATEGORY_ENCODING['S03Pred_Peritsoil']}"
-        raise ValidationError(error_msg=error, status_code=422)
-
-    if input.GCS not in CATEGORY_ENCODING["S03GlasgowComaScore"]:
-        error = f"Invalid GCS : {input.GCS }. Must be one of {CATEGORY_ENCODING['S03GlasgowComaScore']}"
-        raise ValidationError(error_msg=error, status_code=400)
-
-    if input.Indication not in CATEGORY_ENCODING["Indication"]:
-        error = f"Invalid indication : {input.Indication }. Must be one of {CATEGORY_ENCODING['Indication']}"
-        raise ValidationError(error_msg=error, status_code=400)
+    invalid = [
+        spec
+        for spec in CATEGORY_SPECS
+        if getattr(input, spec.field) not in gams.CATEGORY_ENCODING[spec.variable]
+    ]
+    if invalid:
+        error = "; ".join(
+            category_error(spec, getattr(input, spec.field)) for spec in invalid
+        )
+        raise ValidationError(error_msg=error, status_code=invalid[0].status_code)
 
 
 def winsorize(df: Dict, winsor_thresholds: Dict[str, Tuple[float, float]]) -> Dict:
@@ -87,9 +111,184 @@ def winsorize(df: Dict, winsor_thresholds: Dict[str, Tuple[float, float]]) -> Di
         df: Same as input df, except with Winsorized continuous variables
     """
     for v, threshold in winsor_thresholds.items():
-        if df[v]:
+        if df[v] is not None:
             if df[v] < threshold[0]:
                 df[v] = threshold[0]
             elif df[v] > threshold[1]:
                 df[v] = threshold[1]
     return df
+
+
+def category_errors(columns: Mapping[str, np.ndarray]) -> List[Tuple[int, str, int]]:
+    """
+    Validates the categorical inputs of a batch of patients
+
+    Args:
+        columns: One array per Prediction field, with a value per patient
+
+    Returns:
+        (row, message, status_code) for every invalid value, ordered by row
+    """
+    invalid = np.column_stack(
+        [
+            ~np.isin(columns[spec.field], gams.CATEGORY_ENCODING[spec.variable])
+            for spec in CATEGORY_SPECS
+        ]
+    )
+    errors = []
+    for row, i in zip(*np.nonzero(invalid)):
+        spec = CATEGORY_SPECS[i]
+        value = columns[spec.field][row]
+        if spec.field in INTEGER_FIELDS and float(value).is_integer():
+            value = int(value)
+        errors.append((int(row), category_error(spec, value), spec.status_code))
+    return errors
+
+
+def missing_errors(columns: Mapping[str, np.ndarray]) -> List[Tuple[int, str, int]]:
+    """
+    Checks a batch of patients for missing inputs, which pydantic rules out
+    for API requests but tabular inputs may have
+
+    Args:
+        columns: One array per Prediction field, with NaN for missing values
+
+    Returns:
+        (row, message, status_code) for every missing required input,
+            ordered by row
+    """
+    required = [
+        name for name in Prediction.__fields__ if name not in MISSING_INDICATORS
+    ]
+    missing = np.column_stack(
+        [np.isnan(np.asarray(columns[name], dtype=float)) for name in required]
+    )
+    return [
+        (int(row), f"Missing {required[i]}", 422)
+        for row, i in zip(*np.nonzero(missing))
+    ]
+
+
+def boolean_errors(columns: Mapping[str, np.ndarray]) -> List[Tuple[int, str, int]]:
+    """
+    Checks that the boolean inputs of a batch of patients are 1 or 0, which
+    pydantic ensures for API requests but tabular inputs may not
+
+    Args:
+        columns: One array per Prediction field, with NaN for missing values
+
+    Returns:
+        (row, message, status_code) for every boolean input which is present
+            but neither 1 nor 0, ordered by row
+    """
+    invalid = np.column_stack(
+        [
+            ~np.isin(columns[name], (0, 1)) & ~np.isnan(columns[name])
+            for name in BOOLEAN_FIELDS
+        ]
+    )
+    return [
+        (
+            int(row),
+            f"Invalid {BOOLEAN_FIELDS[i]} : {columns[BOOLEAN_FIELDS[i]][row]:g}. "
+            "Must be true or false (1 or 0)",
+            422,
+        )
+        for row, i in zip(*np.nonzero(invalid))
+    ]
+
+
+def feature_matrix(columns: Mapping[str, np.ndarray]) -> np.ndarray:
+    """
+    Winsorizes a batch of patients and adds missingness indicators, giving
+    exactly the values pre_process_input() would for each patient
+
+    Args:
+        columns: One array per Prediction field, with a value per patient.
+            Missing lactate / albumin should be NaN
+
+    Returns:
+        Mortality model inputs of shape (n_patients, 21), in the order of
+            MORTALITY_INPUT_VARIABLES, with NaN for missing lactate / albumin
+    """
+    processed = {
+        name: np.asarray(columns[name], dtype=float) for name in Prediction.__fields__
+    }
+    for name in INTEGER_FIELDS:
+        if name in processed:
+            processed[name] = np.trunc(processed[name])
+
+    for name, (lower, upper) in constants.WINSOR_THRESHOLDS.items():
+        processed[name] = np.clip(processed[name], lower, upper)
+        if name in INTEGER_FIELDS:
+            processed[name] = np.trunc(processed[name])
+
+    for variable, indicator in MISSING_INDICATORS.items():
+        processed[indicator] = np.isnan(processed[variable]).astype(float)
+
+    return np.column_stack(
+        [processed[name] for name in constants.MORTALITY_INPUT_FIELDS]
+    )
+
+
+def prediction_columns(predictions: Sequence[Prediction]) -> Dict[str, np.ndarray]:
+    """One float array per Prediction field, with None as NaN"""
+    return {
+        name: np.array([getattr(p, name) for p in predictions], dtype=float)
+        for name in Prediction.__fields__
+    }
+
+
+def pre_process_batch(predictions: Sequence[Prediction]) -> np.ndarray:
+    """
+    Validates and pre-processes a batch of patients, as pre_process_input()
+    does for each one, as arrays
+
+    Args:
+        predictions: API inputs, one per patient
+
+    Returns:
+        Mortality model inputs of shape (n_patients, 21), as feature_matrix()
+
+    Raises:
+        ValidationError: listing every invalid value of every patient, with
+            the status code of the first
+    """
+    with metrics.timed("validation"):
+        columns = prediction_columns(predictions)
+        errors = category_errors(columns)
+    if errors:
+        raise ValidationError(
+            error_msg="; ".join(f"Patient {row}: {msg}" for row, msg, _ in errors),
+            status_code=errors[0][2],
+        )
+
+    with metrics.timed("winsorize"):
+        return feature_matrix(columns)
+
+
+def sweep_features(
+    prediction: Prediction, variable: str, values: Sequence[float]
+) -> np.ndarray:
+    """
+    Pre-processes variations of one patient with a continuous input set to
+    each of values
+
+    Args:
+        prediction: API input of the patient
+        variable: Prediction field to vary, one of WINSOR_THRESHOLDS
+        values: Values of variable
+
+    Returns:
+        Mortality model inputs of shape (len(values), 21), as feature_matrix()
+
+    Raises:
+        ValidationError: if the patient's categorical inputs are invalid
+    """
+    with metrics.timed("validation"):
+        validate_categories(prediction)
+
+    columns = prediction_columns([prediction] * len(values))
+    columns[variable] = np.asarray(values, dtype=float)
+    with metrics.timed("winsorize"):
+        return feature_matrix(columns)
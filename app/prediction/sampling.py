@@ -0,0 +1,334 @@
+import threading
+import warnings
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Union
+
+import numpy as np
+from numpy.random import Generator, RandomState
+from pygam import GAM
+from scipy.special import ndtri
+
+from app.Fixtures.constants import SAMPLERS
+
+# number of (random_seed, n_draws, sampler) combinations retained per model
+DRAW_CACHE_SIZE = 8
+
+# how the standard normals behind the coefficient draws are generated:
+# pseudo-random (RandomState, reproducing multivariate_normal), scrambled
+# Sobol' points or a Latin hypercube, see standard_normal_points()
+RANDOM, SOBOL, LATIN_HYPERCUBE = SAMPLERS
+
+_draw_cache: "weakref.WeakKeyDictionary[GAM, OrderedDict]" = weakref.WeakKeyDictionary()
+_draw_cache_lock = threading.Lock()
+
+_factor_cache: "weakref.WeakKeyDictionary[GAM, dict]" = weakref.WeakKeyDictionary()
+_factor_cache_lock = threading.Lock()
+
+
+def covariance_factor(gam: GAM, legacy: bool = False) -> np.ndarray:
+    """Factorise the covariance matrix of the GAM's coefficients, once per
+    model.
+
+    Returns the transposed factor L.T, such that draws are given by
+    mean + Z @ L.T for a matrix Z of independent standard normals.
+
+    By default L is the Cholesky factor of the covariance matrix. Fitted
+    GAM covariance matrices are often only positive semi-definite (the
+    production models all have eigenvalues of order -1e-18), in which case
+    Cholesky fails and we fall back to an eigendecomposition with negative
+    eigenvalues clipped to zero.
+
+    With legacy=True the factor is instead the one computed internally by
+    RandomState.multivariate_normal, sqrt(s)[:, None] * v from the SVD of
+    the covariance matrix, so that draws reproduce that method exactly.
+
+    Args:
+        gam: Fitted GAM
+        legacy: If true return the factor used by RandomState
+
+    Returns:
+        Read-only array of shape (len(gam.coef_), len(gam.coef_))
+    """
+    with _factor_cache_lock:
+        model_factors = _factor_cache.setdefault(gam, {})
+        factor = model_factors.get(legacy)
+
+    if factor is None:
+        cov = np.asarray(gam.statistics_["cov"], dtype=np.double)
+        if legacy:
+            _, s, v = np.linalg.svd(cov)
+            factor = np.sqrt(s)[:, None] * v
+        else:
+            try:
+                factor = np.linalg.cholesky(cov).T
+            except np.linalg.LinAlgError:
+                eigenvalues, eigenvectors = np.linalg.eigh(cov)
+                factor = (eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))).T
+        factor.setflags(write=False)
+
+        with _factor_cache_lock:
+            model_factors[legacy] = factor
+
+    return factor
+
+
+def sample_coefficients(
+    gam: GAM, n_draws: int, random_seed: int, legacy: bool = False
+) -> Tuple[np.ndarray, Union[Generator, RandomState]]:
+    """Draw from the multivariate normal distribution over the GAM's
+    coefficients using a cached factorisation of their covariance matrix.
+
+    Only the standard normal draws and one matrix product are computed per
+    call, so sampling cost scales with n_draws alone.
+
+    By default draws come from np.random.default_rng(random_seed). In
+    compatibility mode (legacy=True) they come from RandomState(random_seed)
+    and are bit-identical to
+    RandomState(random_seed).multivariate_normal(gam.coef_, cov, n_draws).
+
+    Args:
+        gam: Fitted GAM
+        n_draws: Number of coefficient vectors to draw
+        random_seed: Seed for the random number generator
+        legacy: If true use the RandomState compatibility mode
+
+    Returns:
+        draws: Array of shape (n_draws, len(gam.coef_))
+        rng: The Generator (or RandomState, if legacy) used, positioned
+            immediately after the coefficient draws
+    """
+    mean = np.asarray(gam.coef_, dtype=np.double)
+    factor = covariance_factor(gam, legacy=legacy)
+
+    rng = RandomState(random_seed) if legacy else np.random.default_rng(random_seed)
+    draws = np.dot(rng.standard_normal((n_draws, mean.shape[0])), factor)
+    draws += mean
+    return draws, rng
+
+
+def standard_normal_points(
+    n_draws: int, dimension: int, random_seed: int, sampler: str
+) -> np.ndarray:
+    """Quasi-random standard normals, the inverse normal CDF of points spread
+    more evenly over the unit hypercube than independent uniforms.
+
+    SOBOL gives the first n_draws points of a scrambled Sobol' sequence,
+    whose prefixes are all evenly spread, so it suits adaptive stopping too.
+    Its balance is best with n_draws a power of 2. LATIN_HYPERCUBE puts one
+    point in each of n_draws equal slices of every dimension.
+
+    Args:
+        n_draws: Number of points
+        dimension: Number of standard normals per point
+        random_seed: Seed for the scrambling or stratification
+        sampler: SOBOL or LATIN_HYPERCUBE
+
+    Returns:
+        Array of shape (n_draws, dimension)
+    """
+    if sampler == SOBOL:
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ValueError("The sobol sampler needs scipy 1.7 or later")
+        with warnings.catch_warnings():
+            # warns that n_draws isn't a power of 2
+            warnings.simplefilter("ignore", UserWarning)
+            points = qmc.Sobol(dimension, scramble=True, seed=random_seed).random(
+                n_draws
+            )
+        # the points are multiples of 2^-30, move them to the centre of their
+        # cells so that none is 0
+        points += 2.0**-31
+    elif sampler == LATIN_HYPERCUBE:
+        rng = np.random.default_rng(random_seed)
+        slices = rng.permuted(np.tile(np.arange(n_draws), (dimension, 1)), axis=1).T
+        points = (slices + 1 - rng.random((n_draws, dimension))) / n_draws
+        np.clip(points, None, 1 - np.finfo(float).epsneg, out=points)
+    else:
+        raise ValueError(f"Unknown quasi-random sampler {sampler}")
+    return ndtri(points)
+
+
+def coefficient_draws(
+    gam: GAM, n_draws: int, random_seed: int
+) -> Tuple[np.ndarray, RandomState]:
+    """Draw from the multivariate normal distribution over the GAM's
+    coefficients, reusing previous draws for the same model, seed and number
+    of draws.
+
+    The draws are exactly those returned by
+    RandomState(random_seed).multivariate_normal(gam.coef_, cov, n_draws), so
+    cached and uncached results are bit-identical. The cache is keyed on the
+    model object itself, so a model which is refitted after sampling should
+    be followed by a call to clear_draw_cache().
+
+    Args:
+        gam: Fitted GAM
+        n_draws: Number of coefficient vectors to draw
+        random_seed: For input to np.random.RandomState
+
+    Returns:
+        draws: Read-only array of shape (n_draws, len(gam.coef_))
+        rnd: RandomState positioned immediately after the coefficient draws,
+            for drawing any further quantities (e.g. observation noise)
+    """
+    key = (random_seed, n_draws, RANDOM)
+    cached = _cached_draws(gam, key)
+
+    if cached is None:
+        draws, rnd = sample_coefficients(gam, n_draws, random_seed, legacy=True)
+        draws.setflags(write=False)
+        cached = _cache_draws(gam, key, (draws, rnd.get_state()))
+
+    draws, state = cached
+    rnd = RandomState()
+    rnd.set_state(state)
+    return draws, rnd
+
+
+def quasi_random_draws(
+    gam: GAM, n_draws: int, random_seed: int, sampler: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draw from the multivariate normal distribution over the GAM's
+    coefficients with quasi-random standard normals (see
+    standard_normal_points()), cached as coefficient_draws() caches them.
+
+    The first dimension of each point is kept for observation noise, which
+    dominates the spread of imputed values, and the rest are multiplied by
+    the covariance factor from its eigendecomposition (the legacy factor),
+    so that the dimensions of the point set spread most evenly go to the
+    directions of most variance.
+
+    Args:
+        gam: Fitted GAM
+        n_draws: Number of coefficient vectors to draw
+        random_seed: Seed for the scrambling or stratification
+        sampler: SOBOL or LATIN_HYPERCUBE
+
+    Returns:
+        draws: Read-only array of shape (n_draws, len(gam.coef_))
+        noise: Read-only standard normals of shape (n_draws,), one paired
+            with each coefficient vector
+    """
+    key = (random_seed, n_draws, sampler)
+    cached = _cached_draws(gam, key)
+
+    if cached is None:
+        draws, noise = _quasi_random_draws(gam, n_draws, random_seed, sampler)
+        draws.setflags(write=False)
+        noise.setflags(write=False)
+        cached = _cache_draws(gam, key, (draws, noise))
+
+    return cached
+
+
+def _quasi_random_draws(
+    gam: GAM, n_draws: int, random_seed: int, sampler: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    mean = np.asarray(gam.coef_, dtype=np.double)
+    normals = standard_normal_points(n_draws, mean.shape[0] + 1, random_seed, sampler)
+    draws = np.dot(normals[:, 1:], covariance_factor(gam, legacy=True))
+    draws += mean
+    return draws, normals[:, 0].copy()
+
+
+def posterior_draws(
+    gam: GAM,
+    n_draws: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    noise: bool = False,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Coefficient draws from any of the SAMPLERS, and optionally standard
+    normals for observation noise paired with them.
+
+    With RANDOM these are coefficient_draws(), with the noise drawn from the
+    RandomState after them as quick_sample() draws it for one row, so
+    results are unchanged from sampling without a sampler.
+
+    Args:
+        gam: Fitted GAM
+        n_draws: Number of coefficient vectors to draw
+        random_seed: Random seed
+        sampler: One of SAMPLERS
+        noise: Whether to return the noise
+
+    Returns:
+        draws: Read-only array of shape (n_draws, len(gam.coef_))
+        noise: Standard normals of shape (n_draws,), or None if not noise
+    """
+    if sampler == RANDOM:
+        draws, rnd = coefficient_draws(gam, n_draws, random_seed)
+        return draws, rnd.standard_normal(n_draws) if noise else None
+    draws, normals = quasi_random_draws(gam, n_draws, random_seed, sampler)
+    return draws, normals if noise else None
+
+
+def centred_draws(
+    gam: GAM,
+    n_draws: int,
+    random_seed: int,
+    sampler: str = RANDOM,
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
+    """posterior_draws() less the mean coefficients, stored in a narrower
+    dtype and cached as the draws are.
+
+    The deviations are much smaller than the coefficients themselves, so
+    rounding them to float32 loses far less than rounding the draws would.
+    Add X·coef_, computed in float64, to X·deviations to recover the
+    linear predictor.
+
+    Args:
+        gam: Fitted GAM
+        n_draws: Number of coefficient vectors to draw
+        random_seed: Random seed
+        sampler: One of SAMPLERS
+        dtype: Float dtype to store the deviations in
+
+    Returns:
+        Read-only array of shape (n_draws, len(gam.coef_))
+    """
+    key = (random_seed, n_draws, sampler, np.dtype(dtype).name)
+    cached = _cached_draws(gam, key)
+
+    if cached is None:
+        # the float64 draws aren't cached, only their deviations
+        if sampler == RANDOM:
+            draws, _ = sample_coefficients(gam, n_draws, random_seed, legacy=True)
+        else:
+            draws, _ = _quasi_random_draws(gam, n_draws, random_seed, sampler)
+        draws -= gam.coef_
+        deviations = draws.astype(dtype)
+        deviations.setflags(write=False)
+        cached = _cache_draws(gam, key, deviations)
+
+    return cached
+
+
+def _cached_draws(gam: GAM, key: Tuple) -> Optional[Any]:
+    with _draw_cache_lock:
+        model_cache = _draw_cache.setdefault(gam, OrderedDict())
+        cached = model_cache.get(key)
+        if cached is not None:
+            model_cache.move_to_end(key)
+    return cached
+
+
+def _cache_draws(gam: GAM, key: Tuple, cached: Any) -> Any:
+    with _draw_cache_lock:
+        model_cache = _draw_cache.setdefault(gam, OrderedDict())
+        model_cache[key] = cached
+        if len(model_cache) > DRAW_CACHE_SIZE:
+            model_cache.popitem(last=False)
+    return cached
+
+
+def clear_draw_cache():
+    """Discards all cached coefficient draws and covariance factors"""
+    with _draw_cache_lock:
+        _draw_cache.clear()
+    with _factor_cache_lock:
+        _factor_cache.clear()
@@ -0,0 +1,67 @@
+import base64
+from typing import Dict
+
+import numpy as np
+
+from app.models import ResponseFormat, EncodedDtype
+
+# number of evenly spaced quantiles in the quantile sketch, 0% to 100%
+SKETCH_QUANTILES = 101
+
+
+def histogram(result: np.ndarray, bins: int) -> Dict:
+    """Fixed size histogram of predicted risks, over their observed range"""
+    counts, edges = np.histogram(result, bins=bins)
+    return {"Counts": counts.tolist(), "Edges": edges.tolist()}
+
+
+def quantile_sketch(result: np.ndarray) -> Dict:
+    """Predicted risks at SKETCH_QUANTILES evenly spaced probabilities"""
+    probabilities = np.linspace(0, 1, SKETCH_QUANTILES)
+    return {
+        "Probabilities": probabilities.tolist(),
+        "Values": np.quantile(result, probabilities).tolist(),
+    }
+
+
+def to_bytes(result: np.ndarray, dtype: EncodedDtype) -> bytes:
+    """Raw little-endian samples"""
+    return result.astype(np.dtype(dtype.value).newbyteorder("<")).tobytes()
+
+
+def encode(result: np.ndarray, dtype: EncodedDtype) -> Dict:
+    """Samples as base64 encoded little-endian floats"""
+    return {
+        "Encoding": "base64",
+        "Dtype": dtype.value,
+        "Length": len(result),
+        "Data": base64.b64encode(to_bytes(result, dtype)).decode("ascii"),
+    }
+
+
+def format_result(
+    result: np.ndarray, response_format: ResponseFormat, dtype: EncodedDtype, bins: int
+) -> Dict:
+    """
+    The representation of the predicted risks to add to a JSON response
+
+    Args:
+        result: Predicted mortality risks
+        response_format: Any format but binary, which isn't JSON
+        dtype: Float precision for base64 encoded samples
+        bins: Number of histogram bins
+
+    Returns:
+        Dictionary to merge into the response, empty for summary only
+    """
+    if response_format == ResponseFormat.full:
+        return {"Result": result.tolist()}
+    if response_format == ResponseFormat.histogram:
+        return {"Histogram": histogram(result, bins)}
+    if response_format == ResponseFormat.quantiles:
+        return {"Quantiles": quantile_sketch(result)}
+    if response_format == ResponseFormat.base64:
+        return {"EncodedResult": encode(result, dtype)}
+    if response_format == ResponseFormat.summary:
+        return {}
+    raise ValueError(f"{response_format} is not a JSON response format")
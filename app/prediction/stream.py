@@ -0,0 +1,189 @@
+"""
+Bulk scoring of newline-delimited JSON (NDJSON) Prediction records, for
+cohorts too large to hold in one request.
+
+Records are read, scored and written in chunks of STREAM_CHUNK_SIZE, each
+through the vectorised batch pipeline, so memory use is bounded by the chunk
+size rather than the size of the cohort. Each input line gives one output
+line, in order, holding either its summary or its validation error:
+
+    {"Line": 1, "ID": "...", "Seed": 1067641072, "Summary": {...}, "Draws": 10000}
+    {"Line": 2, "Error": "Invalid ASA : 10. ...", "Status": 400}
+
+Blank lines are skipped, but counted in the line numbers.
+
+Used by /predict/stream, and from the command line with
+
+    python -m app.prediction.stream [INPUT] [OUTPUT] [--chunk-size N]
+
+reading stdin and writing stdout by default.
+"""
+
+import argparse
+import json
+import uuid
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple
+
+import pydantic
+
+from app.models import Prediction, ResponseFormat, EncodedDtype
+from app.prediction.budget import DrawBudget, DEFAULT_BUDGET
+from app.prediction.preprocess import (
+    prediction_columns,
+    category_errors,
+    feature_matrix,
+)
+from app.prediction.serialize import format_result
+from app.prediction.summary import (
+    SUMMARY_QUANTILES,
+    summarise_ragged,
+    format_summary,
+)
+from app.Fixtures.constants import RANDOM_SEED, STREAM_CHUNK_SIZE, MAX_RECORD_BYTES
+
+# (line number, line) of each record in a chunk
+Chunk = List[Tuple[int, str]]
+
+
+def score_records(
+    records: Chunk,
+    response_format: ResponseFormat = ResponseFormat.summary,
+    dtype: EncodedDtype = EncodedDtype.float32,
+    bins: int = 50,
+    budget: DrawBudget = DEFAULT_BUDGET,
+) -> str:
+    """
+    Scores a chunk of NDJSON records
+
+    Args:
+        records: (line number, JSON Prediction) for each record
+        response_format: Any JSON format accepted by /predict
+        dtype: Float precision for base64 encoded samples
+        bins: Number of histogram bins
+        budget: Draw counts, and when to stop early
+
+    Returns:
+        One NDJSON output line per record, in the same order
+    """
+    # imported here so that importing the API doesn't load the models
+    from app.prediction.pipeline import predict_many
+
+    outputs = {}
+    predictions, lines = [], []
+    for line, record in records:
+        try:
+            predictions.append(Prediction.parse_raw(record))
+            lines.append(line)
+        except pydantic.ValidationError as e:
+            outputs[line] = {"Line": line, "Error": str(e), "Status": 422}
+
+    columns = prediction_columns(predictions)
+    invalid = set()
+    for row, message, status_code in category_errors(columns):
+        output = outputs.setdefault(lines[row], {"Line": lines[row], "Error": ""})
+        output["Error"] = "; ".join(filter(None, [output["Error"], message]))
+        output.setdefault("Status", status_code)
+        invalid.add(row)
+
+    valid = [row for row in range(len(predictions)) if row not in invalid]
+    if valid:
+        results = predict_many(feature_matrix(columns)[valid], budget)
+        summaries = summarise_ragged(results, SUMMARY_QUANTILES)
+        for row, result, quantiles in zip(valid, results, summaries):
+            outputs[lines[row]] = {
+                "Line": lines[row],
+                "ID": str(uuid.uuid4()),
+                "Seed": RANDOM_SEED,
+                **format_result(result, response_format, dtype, bins),
+                "Summary": format_summary(quantiles),
+                "Draws": len(result),
+            }
+
+    return "".join(json.dumps(outputs[line]) + "\n" for line, _ in records)
+
+
+def chunk_lines(lines: Iterable[str], chunk_size: int) -> Iterator[Chunk]:
+    """Groups the non-blank lines of a text stream into chunks of records"""
+    chunk: Chunk = []
+    for number, line in enumerate(lines, start=1):
+        if line.strip():
+            chunk.append((number, line.rstrip("\r\n")))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+async def chunk_stream(
+    stream: AsyncIterator[bytes],
+    chunk_size: int,
+    max_record_bytes: int = MAX_RECORD_BYTES,
+) -> AsyncIterator[Chunk]:
+    """
+    Groups the non-blank lines of a streamed request body into chunks of
+    records, holding at most one chunk and one partial line in memory
+
+    A line longer than max_record_bytes is passed on truncated, so that it
+    is reported as invalid, and the rest of it is discarded.
+    """
+    chunk: Chunk = []
+    buffer = b""
+    number = 0
+    discarding = False
+
+    def add(line: bytes):
+        nonlocal number
+        number += 1
+        if line.strip():
+            chunk.append((number, line.rstrip(b"\r").decode("utf-8", errors="replace")))
+
+    async for data in stream:
+        lines = (buffer + data).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if discarding:
+                discarding = False  # the rest of an over-long line
+            else:
+                add(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if len(buffer) > max_record_bytes:
+            if not discarding:
+                add(buffer[:max_record_bytes])
+                discarding = True
+            buffer = b""
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+    if buffer and not discarding:
+        add(buffer)
+    if chunk:
+        yield chunk
+
+
+def score_file(input, output, chunk_size: int = STREAM_CHUNK_SIZE, **kwargs):
+    """Scores every record of an NDJSON text stream, writing NDJSON results"""
+    for chunk in chunk_lines(input, chunk_size):
+        output.write(score_records(chunk, **kwargs))
+        output.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scores newline-delimited JSON Prediction records"
+    )
+    parser.add_argument("input", nargs="?", type=argparse.FileType("r"), default="-")
+    parser.add_argument("output", nargs="?", type=argparse.FileType("w"), default="-")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    parser.add_argument(
+        "--format",
+        type=ResponseFormat,
+        default=ResponseFormat.summary,
+        choices=[f for f in ResponseFormat if f != ResponseFormat.binary],
+    )
+    args = parser.parse_args()
+    score_file(args.input, args.output, args.chunk_size, response_format=args.format)
@@ -0,0 +1,111 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# quantiles reported in the API summary: 95% interval and median
+SUMMARY_QUANTILES = (0.025, 0.5, 0.975)
+
+
+def summarise_samples(
+    samples: np.ndarray,
+    quantiles: Sequence[float] = SUMMARY_QUANTILES,
+    thresholds: Sequence[float] = (),
+    axis: int = -1,
+) -> Dict[str, np.ndarray]:
+    """
+    Summarises predicted risks along an axis, so one call covers a whole
+    batch of patients with the same number of samples.
+
+    All quantiles come from a single np.quantile call, which partitions the
+    samples once around every required order statistic instead of once per
+    quantile.
+
+    Args:
+        samples: Predicted risks, e.g. of shape (n_samples,) for one patient
+            or (n_patients, n_samples) for a batch
+        quantiles: Probabilities in [0, 1] of the quantiles to compute
+        thresholds: Risks for which to compute the probability of exceeding
+        axis: Axis of samples to summarise over
+
+    Returns:
+        Quantiles: shape (len(quantiles),) + the shape of the other axes
+        Mean: mean risk
+        SD: standard deviation of risk
+        Exceedance: shape (len(thresholds),) + the shape of the other axes,
+            probability of risk above each threshold
+    """
+    samples = np.asarray(samples)
+    summary = {
+        "Quantiles": np.quantile(samples, quantiles, axis=axis),
+        "Mean": samples.mean(axis=axis),
+        "SD": samples.std(axis=axis),
+    }
+    if len(thresholds):
+        summary["Exceedance"] = np.stack(
+            [(samples > t).mean(axis=axis) for t in thresholds]
+        )
+    return summary
+
+
+def summarise_ragged(
+    results: List[np.ndarray], quantiles: Sequence[float] = SUMMARY_QUANTILES
+) -> List[np.ndarray]:
+    """
+    Quantiles of each of several patients' predicted risks, which may have
+    different numbers of samples. Patients with the same number of samples
+    are summarised together in one vectorised call.
+
+    Args:
+        results: Predicted risks, one 1D array per patient
+        quantiles: Probabilities in [0, 1] of the quantiles to compute
+
+    Returns:
+        Quantiles of shape (len(quantiles),), one array per patient
+    """
+    by_length: Dict[int, List[int]] = {}
+    for i, result in enumerate(results):
+        by_length.setdefault(len(result), []).append(i)
+
+    summaries: List[np.ndarray] = [None] * len(results)
+    for patients in by_length.values():
+        stacked = np.stack([results[i] for i in patients])
+        patient_quantiles = summarise_samples(stacked, quantiles)["Quantiles"]
+        for j, i in enumerate(patients):
+            summaries[i] = patient_quantiles[:, j]
+
+    return summaries
+
+
+def row_quantiles(
+    samples: np.ndarray, quantiles: Sequence[float] = SUMMARY_QUANTILES
+) -> np.ndarray:
+    """
+    Quantiles of each row of samples, interpolated as np.quantile's default
+    does, for small arrays where np.quantile's own overhead would dominate
+
+    Args:
+        samples: shape (n_rows, n_samples)
+        quantiles: Probabilities in [0, 1] of the quantiles to compute
+
+    Returns:
+        shape (n_rows, len(quantiles))
+    """
+    n_samples = samples.shape[1]
+    positions = np.asarray(quantiles) * (n_samples - 1)
+    lower = positions.astype(int)
+    upper = np.minimum(lower + 1, n_samples - 1)
+    ordered = np.partition(samples, np.union1d(lower, upper), axis=1)
+    return ordered[:, lower] + (ordered[:, upper] - ordered[:, lower]) * (
+        positions - lower
+    )
+
+
+def format_summary(quantiles: np.ndarray) -> Dict:
+    """Formats the SUMMARY_QUANTILES of predicted mortality risks"""
+    lower_percentile, median, upper_percentile = quantiles
+
+    return {
+        "Median": f"{median:4f}",
+        "LowerPercentile": f"{lower_percentile:4f}",
+        "UpperPercentile": f"{upper_percentile:4f}",
+    }
@@ -0,0 +1,131 @@
+import threading
+import weakref
+
+import numpy as np
+from scipy.special import ndtr
+from sklearn.preprocessing import QuantileTransformer
+
+# as sklearn.preprocessing._data.BOUNDS_THRESHOLD
+BOUNDS_THRESHOLD = 1e-7
+
+# below this many values np.interp's binary search is faster than the grid
+# lookup's extra array operations
+GRID_LOOKUP_MIN_SIZE = 256
+
+_inverse_cache: (
+    "weakref.WeakKeyDictionary[QuantileTransformer, InverseQuantileTransform]"
+) = weakref.WeakKeyDictionary()
+_inverse_cache_lock = threading.Lock()
+
+
+class InverseQuantileTransform:
+    """Inverse transform of a fitted single feature QuantileTransformer,
+    compiled to a lookup table.
+
+    Gives the same values as transformer.inverse_transform(y.reshape(-1, 1))
+    for any shape of y: the normal CDF (for output_distribution="normal")
+    followed by interpolation over the whole batch from the references to
+    the quantiles, with values within BOUNDS_THRESHOLD of 0 or 1 set to the
+    first or last quantile. sklearn's input validation, copies and
+    per-column loop are skipped, so inputs are assumed to be finite floats.
+
+    sklearn's references are evenly spaced over [0, 1], in which case each
+    value's interval is found directly from its position on the grid rather
+    than by np.interp's binary search (for batches of GRID_LOOKUP_MIN_SIZE
+    or more), using the same per-interval formula so that the results are
+    identical.
+    """
+
+    def __init__(
+        self,
+        quantiles: np.ndarray,
+        references: np.ndarray,
+        output_distribution: str = "normal",
+    ):
+        if output_distribution not in ("normal", "uniform"):
+            raise ValueError(
+                f"output_distribution must be 'normal' or 'uniform'; "
+                f"got {output_distribution}"
+            )
+        self.quantiles = np.ascontiguousarray(quantiles, dtype=float).ravel()
+        self.references = np.ascontiguousarray(references, dtype=float).ravel()
+        if self.quantiles.shape != self.references.shape:
+            raise ValueError("quantiles and references must be the same length")
+        self.output_distribution = output_distribution
+
+        n = len(self.references)
+        self.uniform_grid = n > 1 and np.array_equal(
+            self.references, np.linspace(0, 1, n)
+        )
+        if self.uniform_grid:
+            self.slopes = np.diff(self.quantiles) / np.diff(self.references)
+
+    @classmethod
+    def from_transformer(
+        cls, transformer: QuantileTransformer
+    ) -> "InverseQuantileTransform":
+        if transformer.quantiles_.shape[1] != 1:
+            raise NotImplementedError("only single feature transformers are supported")
+        return cls(
+            transformer.quantiles_[:, 0],
+            transformer.references_,
+            transformer.output_distribution,
+        )
+
+    def __call__(self, y: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            y: Values in the transformer's output space, of any shape
+
+        Returns:
+            Values in the original feature space, of the same shape as y
+        """
+        y = np.asarray(y, dtype=float)
+        if self.output_distribution == "normal":
+            u = ndtr(y)
+            lower = u - BOUNDS_THRESHOLD < 0
+            upper = u + BOUNDS_THRESHOLD > 1
+        else:
+            u = y
+            lower = u == 0
+            upper = u == 1
+
+        x = self._interp(u)
+        x[upper] = self.quantiles[-1]
+        x[lower] = self.quantiles[0]
+        return x
+
+    def _interp(self, u: np.ndarray) -> np.ndarray:
+        """np.interp(u, self.references, self.quantiles)"""
+        if not self.uniform_grid or u.size < GRID_LOOKUP_MIN_SIZE:
+            return np.interp(u, self.references, self.quantiles)
+
+        references, quantiles = self.references, self.quantiles
+        last = len(references) - 2
+
+        # interval index from the grid position, then corrected for rounding
+        # so that references[j] <= u < references[j + 1]
+        j = (u * (last + 1)).astype(np.intp)
+        j = np.minimum(np.maximum(j, 0, out=j), last, out=j)
+        j -= references[j] > u
+        j += references[j + 1] <= u
+        j = np.minimum(np.maximum(j, 0, out=j), last, out=j)
+
+        x = self.slopes[j] * (u - references[j]) + quantiles[j]
+        x[u >= 1] = quantiles[-1]
+        x[u < 0] = quantiles[0]
+        return x
+
+
+def inverse_transform(transformer: QuantileTransformer) -> InverseQuantileTransform:
+    """Returns the compiled inverse transform of a fitted QuantileTransformer,
+    compiling it on first use. Like the other model caches this is keyed on
+    the transformer object, so it shouldn't be refitted after use.
+    """
+    with _inverse_cache_lock:
+        inverse = _inverse_cache.get(transformer)
+    if inverse is None:
+        inverse = InverseQuantileTransform.from_transformer(transformer)
+        with _inverse_cache_lock:
+            _inverse_cache[transformer] = inverse
+    return inverse
@@ -0,0 +1,369 @@
+"""
+Offline scoring of a cohort from a CSV or Parquet file, without the API.
+
+    python -m app.score cohort.csv results.parquet [--workers 4] [--draws]
+
+Input columns are matched to Prediction fields by name, either the API
+field (Age, Lactate, ...) or the study variable (S01AgeOnArrival,
+S03PreOpArterialBloodLactate, ...), and --map COLUMN=FIELD renames any
+others. Lactate and Albumin columns may be left out or empty, in which case
+they are imputed. Rows are read, pre-processed and scored in chunks through
+the vectorised batch pipeline, optionally spread over a process pool, and
+the results written a chunk at a time, so memory use doesn't grow with the
+size of the cohort.
+
+Each output row holds the input row number, the --id column if given, the
+median and 95% interval of predicted mortality risk (Error instead, for
+rows which fail validation) and, with --draws, every sampled risk as a list
+of float32. Output is Parquet, or CSV for a .csv path without --draws.
+Parquet needs pyarrow installed, without it only .csv files can be used.
+
+Progress and the overall rows per second are reported on stderr.
+"""
+
+import argparse
+import itertools
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.models import Prediction
+from app.prediction.executor import warm_up
+from app.prediction.preprocess import (
+    MISSING_INDICATORS,
+    boolean_errors,
+    category_errors,
+    feature_matrix,
+    missing_errors,
+)
+from app.prediction.summary import SUMMARY_QUANTILES, summarise_ragged
+from app.Fixtures.constants import MORTALITY_INPUT_FIELDS, MORTALITY_INPUT_VARIABLES
+
+# rows scored together
+SCORE_CHUNK_SIZE = 256
+
+SUMMARY_COLUMNS = ("LowerPercentile", "Median", "UpperPercentile")
+
+# study variable names accepted for each Prediction field
+FIELD_ALIASES = dict(zip(MORTALITY_INPUT_VARIABLES, MORTALITY_INPUT_FIELDS))
+
+
+def match_columns(
+    columns: Sequence[str], overrides: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """
+    Matches input columns to Prediction fields
+
+    Args:
+        columns: Input column names
+        overrides: Column name to field name, for columns named otherwise
+
+    Returns:
+        Field name to column name
+
+    Raises:
+        ValueError: if a required field has no column
+    """
+    overrides = overrides or {}
+    matched = {}
+    for column in columns:
+        field = overrides.get(column, FIELD_ALIASES.get(column, column))
+        if field in Prediction.__fields__:
+            matched[field] = column
+
+    unmatched = [
+        field
+        for field in Prediction.__fields__
+        if field not in matched and field not in MISSING_INDICATORS
+    ]
+    if unmatched:
+        raise ValueError(f"No column for {', '.join(unmatched)}")
+    return matched
+
+
+def numeric_column(values: pd.Series) -> np.ndarray:
+    """Column as floats, with true / false as 1 / 0 and anything else which
+    isn't a number as NaN"""
+    if values.dtype == object:
+        text = values.astype(str).str.strip().str.lower()
+        values = values.mask(text == "true", 1).mask(text == "false", 0)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+
+
+def score_chunk(
+    frame: pd.DataFrame,
+    first_row: int,
+    fields: Dict[str, str],
+    id_column: Optional[str] = None,
+    draws: bool = False,
+) -> pd.DataFrame:
+    """
+    Validates, pre-processes and scores a chunk of input rows
+
+    Args:
+        frame: Input rows
+        first_row: Row number of the first input row
+        fields: Field name to column name, from match_columns()
+        id_column: Input column to copy to the output
+        draws: Whether to include every sampled risk
+
+    Returns:
+        One output row per input row
+    """
+    # imported here so that the pipeline loads in the workers which use it
+    from app.prediction.pipeline import predict_many
+
+    n_rows = len(frame)
+    columns = {
+        field: (
+            numeric_column(frame[fields[field]])
+            if field in fields
+            else np.full(n_rows, np.nan)
+        )
+        for field in Prediction.__fields__
+    }
+
+    errors: Dict[int, List[str]] = {}
+    checks = (
+        missing_errors(columns) + boolean_errors(columns) + category_errors(columns)
+    )
+    for row, message, _ in checks:
+        errors.setdefault(row, []).append(message)
+    valid = [row for row in range(n_rows) if row not in errors]
+
+    output = pd.DataFrame({"Row": np.arange(first_row, first_row + n_rows)})
+    if id_column is not None:
+        output[id_column] = frame[id_column].astype(str).to_numpy()
+    summaries = np.full((n_rows, len(SUMMARY_QUANTILES)), np.nan)
+    samples = [None] * n_rows
+
+    if valid:
+        results = predict_many(feature_matrix(columns)[valid])
+        summaries[valid] = summarise_ragged(results, SUMMARY_QUANTILES)
+        for row, result in zip(valid, results):
+            samples[row] = result.astype(np.float32)
+
+    for name, summary in zip(SUMMARY_COLUMNS, summaries.T):
+        output[name] = summary
+    if draws:
+        output["Draws"] = samples
+    output["Error"] = [
+        "; ".join(errors[row]) if row in errors else None for row in range(n_rows)
+    ]
+    return output
+
+
+def is_parquet(path: Path) -> bool:
+    return path.suffix.lower() in (".parquet", ".pq")
+
+
+def check_pyarrow():
+    """Raises ValueError, rather than ImportError midway through scoring, if
+    pyarrow isn't installed"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ValueError(
+            "Parquet files need pyarrow, install it or use .csv files instead"
+        )
+
+
+def read_chunks(path: Path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Reads a CSV or Parquet file a chunk of rows at a time"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class OutputWriter:
+    """Writes output chunks to Parquet, or to CSV for a .csv path"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.csv = path.suffix.lower() == ".csv"
+        self.parquet_writer = None
+        self.rows = 0
+
+    def write(self, output: pd.DataFrame):
+        if self.csv:
+            output.to_csv(
+                self.path,
+                mode="a" if self.rows else "w",
+                header=not self.rows,
+                index=False,
+            )
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, arrow_schema(output))
+            self.parquet_writer.write_table(
+                pa.Table.from_pandas(
+                    output, schema=self.parquet_writer.schema, preserve_index=False
+                )
+            )
+        self.rows += len(output)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def arrow_schema(output: pd.DataFrame):
+    """Parquet schema for the output, fixed from the first chunk"""
+    import pyarrow as pa
+
+    fields = []
+    for name in output.columns:
+        if name == "Draws":
+            arrow_type = pa.list_(pa.float32())
+        elif output[name].dtype == object:
+            arrow_type = pa.string()
+        else:
+            arrow_type = pa.from_numpy_dtype(output[name].dtype)
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def map_ahead(
+    pool: Optional[Executor], fn, args: Iterable[tuple], ahead: int
+) -> Iterator:
+    """fn(*a) for each a in args, in order, running up to ahead calls in the
+    pool at once (or serially, without a pool)"""
+    if pool is None:
+        for a in args:
+            yield fn(*a)
+        return
+
+    pending = []
+    for a in args:
+        pending.append(pool.submit(fn, *a))
+        if len(pending) >= ahead:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def score(
+    input_path: Path,
+    output_path: Path,
+    chunk_size: int = SCORE_CHUNK_SIZE,
+    workers: int = 1,
+    draws: bool = False,
+    id_column: Optional[str] = None,
+    overrides: Optional[Dict[str, str]] = None,
+    progress=None,
+) -> int:
+    """
+    Scores every row of a CSV or Parquet file
+
+    Args:
+        input_path: CSV or Parquet file of patients
+        output_path: Parquet (or .csv) file to write
+        chunk_size: Rows scored together
+        workers: Worker processes, or 1 to score in this process
+        draws: Whether to write every sampled risk
+        id_column: Input column to copy to the output
+        overrides: Input column name to field name, for columns named
+            otherwise
+        progress: Text stream to report progress on
+
+    Returns:
+        Number of rows scored
+    """
+    input_path, output_path = Path(input_path), Path(output_path)
+    if draws and output_path.suffix.lower() == ".csv":
+        raise ValueError("Draws can only be written to Parquet")
+    if is_parquet(input_path) or output_path.suffix.lower() != ".csv":
+        check_pyarrow()
+
+    chunks = read_chunks(input_path, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return 0
+    fields = match_columns(first.columns, overrides)
+
+    def jobs():
+        row = 0
+        for frame in itertools.chain([first], chunks):
+            yield frame, row, fields, id_column, draws
+            row += len(frame)
+
+    pool = (
+        ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+        if workers > 1
+        else None
+    )
+    writer = OutputWriter(output_path)
+    start = time.perf_counter()
+    n_rows = 0
+    try:
+        for output in map_ahead(pool, score_chunk, jobs(), 2 * workers):
+            writer.write(output)
+            n_rows += len(output)
+            if progress is not None:
+                rate = n_rows / (time.perf_counter() - start)
+                print(f"{n_rows} rows, {rate:.0f} rows/s", file=progress)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+
+    return n_rows
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Scores a CSV or Parquet cohort of patients"
+    )
+    parser.add_argument("input", type=Path, help="CSV or Parquet file")
+    parser.add_argument("output", type=Path, help="Parquet (or .csv) file")
+    parser.add_argument("--chunk-size", type=int, default=SCORE_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--draws", action="store_true", help="write sampled risks")
+    parser.add_argument("--id", dest="id_column", help="column to copy to output")
+    parser.add_argument(
+        "--map",
+        action="append",
+        default=[],
+        metavar="COLUMN=FIELD",
+        help="input column for a Prediction field",
+    )
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args(argv)
+
+    overrides = dict(mapping.split("=", 1) for mapping in args.map)
+    start = time.perf_counter()
+    try:
+        n_rows = score(
+            args.input,
+            args.output,
+            args.chunk_size,
+            args.workers,
+            args.draws,
+            args.id_column,
+            overrides,
+            progress=None if args.quiet else sys.stderr,
+        )
+    except ValueError as e:
+        parser.exit(1, f"error: {e}\n")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Scored {n_rows} rows in {elapsed:.1f}s ({n_rows / elapsed:.0f} rows/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Multi-process server sharing one copy of the models between its workers.
+
+    python -m app.serve --host 0.0.0.0 --port 80 --workers 4
+
+The parent process binds the socket, loads the model assets and (with
+RUNE_WARM_UP) fills the coefficient draw and model matrix caches, then forks
+the uvicorn workers. The workers inherit the loaded models copy-on-write, so
+the coefficient arrays, covariance factors and cached draws are held in
+memory once rather than once per worker. gc.freeze() keeps the garbage
+collector from writing to the inherited objects and un-sharing their pages.
+
+Each worker keeps its own result cache and metrics. Workers are numbered
+by slot, 0 to workers - 1, reused by the worker replacing one, and label
+their metrics with it (see app/metrics.py).
+
+The parent serves nothing itself. It restarts workers that die, and reloads
+the models when the asset file (or a compact asset directory's manifest)
+changes, or on SIGHUP: the new assets are loaded and warmed up in the
+parent, a new generation of workers is forked from it, and the old workers
+are sent SIGTERM, finishing the requests in flight before they exit. If the
+new assets fail to load the old workers keep serving.
+
+Configured with RUNE_SERVE_WORKERS, RUNE_RELOAD_INTERVAL and
+RUNE_GRACEFUL_TIMEOUT (see app/settings.py). Relies on os.fork(), so runs on
+Linux / macOS only.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app import metrics, settings
+from app.Fixtures import gams
+from app.Fixtures.assets import MANIFEST, resolve_asset_path
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks for dead workers and signals
+POLL_INTERVAL = 0.2
+
+
+def asset_signature(path: Optional[str] = None) -> Optional[Tuple[int, int, int]]:
+    """
+    Modification time, size and inode of the asset file, or of the manifest
+    of a compact asset directory, which changes when the assets are replaced
+
+    Args:
+        path: Asset file or directory, defaults to RUNE_ASSETS
+
+    Returns:
+        signature: None if the assets can't be found, e.g. mid-copy
+    """
+    path = resolve_asset_path(settings.ASSET_PATH if path is None else path)
+    if path.is_dir():
+        path = path / MANIFEST
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def prepare():
+    """Loads the models, and with RUNE_WARM_UP fills their caches, so that
+    forked workers inherit them"""
+    from app.prediction import pipeline
+
+    gams.load()
+    if settings.WARM_UP:
+        pipeline.warm_up()
+
+
+def bind(host: str, port: int) -> socket.socket:
+    """Listening socket shared by every worker"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, log_level: str):
+    """Serves the API on sock until SIGTERM, in a forked worker"""
+    import uvicorn
+
+    from app.main import api
+    from app.prediction import executor
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    # the workers are the parallelism; without RUNE_WORKERS each runs one
+    # inference thread rather than one per CPU
+    if "RUNE_WORKERS" not in os.environ:
+        executor.configure_pool(settings.WORKER_TYPE, 1, settings.MAX_PENDING)
+
+    config = uvicorn.Config(api, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks and supervises the workers serving on sock"""
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int = settings.SERVE_WORKERS,
+        reload_interval: float = settings.RELOAD_INTERVAL,
+        graceful_timeout: float = settings.GRACEFUL_TIMEOUT,
+        log_level: str = "info",
+    ):
+        self.sock = sock
+        self.workers = workers
+        self.reload_interval = reload_interval
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        # worker pid -> generation, bumped by each reload
+        self.children: Dict[int, int] = {}
+        # worker pid -> slot, from 0 to workers - 1, which labels its metrics
+        self.slots: Dict[int, int] = {}
+        self.generation = 0
+        # old workers sent SIGTERM, pid -> time after which they're killed
+        self.stopping: Dict[int, float] = {}
+        self.signature = asset_signature()
+        self.running = False
+        self.reload_requested = False
+
+    def spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                # each worker keeps its own metrics and result cache
+                metrics.set_worker(str(slot))
+                run_worker(self.sock, self.log_level)
+            except BaseException:
+                logger.exception("Worker failed")
+                status = 1
+            finally:
+                os._exit(status)
+        self.children[pid] = self.generation
+        self.slots[pid] = slot
+        return pid
+
+    def spawn_missing(self):
+        taken = {
+            self.slots[pid] for pid, g in self.children.items() if g == self.generation
+        }
+        for slot in range(self.workers):
+            if slot not in taken:
+                pid = self.spawn(slot)
+                logger.info(
+                    "Started worker %d (slot %d, generation %d)",
+                    pid,
+                    slot,
+                    self.generation,
+                )
+
+    def reap(self) -> List[int]:
+        """Collects exited workers, returning their pids"""
+        exited = []
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            exited.append(pid)
+            generation = self.children.pop(pid, None)
+            self.slots.pop(pid, None)
+            if self.stopping.pop(pid, None) is None and self.running:
+                logger.warning("Worker %d (generation %s) exited", pid, generation)
+        return exited
+
+    def retire(self, pids: List[int]):
+        """Sends SIGTERM to pids, to be killed if still running after the
+        graceful timeout"""
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.stopping[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if now > deadline:
+                logger.warning("Killing worker %d after graceful timeout", pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.stopping[pid] = float("inf")
+
+    def reload(self) -> bool:
+        """
+        Loads the models again and replaces the workers with ones forked
+        from the reloaded parent
+
+        Returns:
+            reloaded: False if the assets failed to load, in which case the
+                old workers are left serving
+        """
+        gc.unfreeze()
+        try:
+            gams.reload()
+            prepare()
+        except Exception:
+            logger.exception("Reloading the model assets failed")
+            return False
+        finally:
+            gc.collect()
+            gc.freeze()
+
+        old = [pid for pid, g in self.children.items() if g == self.generation]
+        self.generation += 1
+        self.spawn_missing()
+        self.retire(old)
+        logger.info("Reloaded model assets %s", gams.ASSET_INFO.get("sha256"))
+        return True
+
+    def assets_changed(self) -> bool:
+        signature = asset_signature()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def run(self):
+        """Runs the workers until SIGTERM / SIGINT, reloading on SIGHUP"""
+        self.running = True
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        gc.collect()
+        gc.freeze()
+        self.spawn_missing()
+        next_check = time.monotonic() + self.reload_interval
+        try:
+            while self.running:
+                time.sleep(POLL_INTERVAL)
+                self.reap()
+                self.kill_overdue()
+                if self.reload_interval and time.monotonic() >= next_check:
+                    next_check = time.monotonic() + self.reload_interval
+                    self.reload_requested |= self.assets_changed()
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.reload()
+                if self.running:
+                    self.spawn_missing()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stops every worker, waiting up to the graceful timeout"""
+        self.running = False
+        self.retire([pid for pid in self.children if pid not in self.stopping])
+        while self.children:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(POLL_INTERVAL / 4)
+
+    def handle_stop(self, signum, frame):
+        self.running = False
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Serve the API from several worker processes sharing the "
+        "loaded models"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s %(name)s %(message)s"
+    )
+    sock = bind(args.host, args.port)
+    prepare()
+    # imported before forking so the workers share the imported modules too
+    import app.main  # noqa: F401
+
+    logger.info("Serving on %s:%d with %d workers", args.host, args.port, args.workers)
+    Supervisor(sock, workers=args.workers, log_level=args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
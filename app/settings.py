@@ -0,0 +1,59 @@
+import os
+
+from app.Fixtures import constants
+
+# Server-wide settings, read from environment variables at import time
+
+# inference worker pool, see app/prediction/executor.py
+# "thread" or "process"
+WORKER_TYPE = os.environ.get("RUNE_WORKER_TYPE", "thread")
+WORKERS = int(os.environ.get("RUNE_WORKERS", os.cpu_count() or 1))
+# requests queued or running in the pool before new ones are turned away
+MAX_PENDING = int(os.environ.get("RUNE_MAX_PENDING", 4 * WORKERS))
+
+# inference result cache, see app/prediction/cache.py
+RESULT_CACHE_ENTRIES = int(os.environ.get("RUNE_RESULT_CACHE_ENTRIES", 1024))
+RESULT_CACHE_MB = int(os.environ.get("RUNE_RESULT_CACHE_MB", 128))
+# seconds before a cached result expires, 0 to keep until evicted
+RESULT_CACHE_TTL = float(os.environ.get("RUNE_RESULT_CACHE_TTL", 3600))
+
+# load the models and pre-compute their draws in the background when the
+# server starts; with 0 they're loaded on the first prediction instead
+WARM_UP = os.environ.get("RUNE_WARM_UP", "1") != "0"
+
+# model assets, a pickled study export or a directory exported from one with
+# python -m app.Fixtures.assets. Defaults to app/Fixtures/production_assets.pkl
+ASSET_PATH = os.environ.get("RUNE_ASSETS")
+
+# per-stage latency histograms and request counts, served at /metrics; 0 to
+# turn the timers off
+METRICS = os.environ.get("RUNE_METRICS", "1") != "0"
+
+# Monte Carlo draws per prediction, see app/prediction/budget.py. Requests
+# may override these with query parameters
+MORTALITY_DRAWS = int(os.environ.get("RUNE_MORTALITY_DRAWS", constants.MORTALITY_DRAWS))
+IMPUTATION_DRAWS = int(
+    os.environ.get("RUNE_IMPUTATION_DRAWS", constants.IMPUTATION_DRAWS)
+)
+IMPUTED_MORTALITY_DRAWS = int(
+    os.environ.get("RUNE_IMPUTED_MORTALITY_DRAWS", constants.IMPUTED_MORTALITY_DRAWS)
+)
+# stop sampling once the standard error of each summary quantile, estimated
+# from the spread of its value across blocks of draws, is below this; 0 to
+# always use every draw
+DRAW_TOLERANCE = float(os.environ.get("RUNE_DRAW_TOLERANCE", 0))
+# how the draws are generated: "random", or quasi-random "sobol" or "lhs"
+SAMPLER = os.environ.get("RUNE_SAMPLER", "random")
+# float precision the mortality risks are sampled in, "float64" or "float32"
+PRECISION = os.environ.get("RUNE_PRECISION", "float64")
+# estimated memory of the intermediates of predicting a batch of patients at
+# once, coefficient draws included; larger batches are split into chunks
+BATCH_MEMORY_MB = int(os.environ.get("RUNE_BATCH_MEMORY_MB", 256))
+
+# python -m app.serve, see app/serve.py. Worker processes forked from a
+# parent that has loaded the models
+SERVE_WORKERS = int(os.environ.get("RUNE_SERVE_WORKERS", os.cpu_count() or 1))
+# seconds between checks for changed model assets, 0 to reload on SIGHUP only
+RELOAD_INTERVAL = float(os.environ.get("RUNE_RELOAD_INTERVAL", 10))
+# seconds a replaced or stopping worker has to finish its requests
+GRACEFUL_TIMEOUT = float(os.environ.get("RUNE_GRACEFUL_TIMEOUT", 30))
@@ -0,0 +1,72 @@
+"""
+Startup stage timings and readiness, reported by /ready.
+
+Importing app.main doesn't load the model assets or the libraries they need
+(pygam, sklearn, pandas). They are loaded by the warm-up run in the
+background when the server starts, or with RUNE_WARM_UP=0 on first
+inference. Each stage records how long it took here, and a warm-up which
+fails records its error.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# time of the first import of this module, which app.main makes before any
+# other
+_started = time.perf_counter()
+_stages: Dict[str, float] = {}
+_lock = threading.Lock()
+_ready = threading.Event()
+_error: Optional[str] = None
+
+
+def elapsed() -> float:
+    """Seconds since app.startup was first imported"""
+    return time.perf_counter() - _started
+
+
+def record(name: str, seconds: float):
+    """Records the duration of a startup stage"""
+    with _lock:
+        _stages[name] = round(seconds, 4)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the body of the with statement as a startup stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def report() -> Dict[str, float]:
+    """Durations in seconds of the stages recorded so far, in order"""
+    with _lock:
+        return dict(_stages)
+
+
+def mark_ready():
+    """Marks the server as ready to serve, recording the time taken"""
+    record("ready", elapsed())
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def mark_failed(error: BaseException):
+    """Records that the warm-up failed, so the server will never be ready"""
+    global _error
+    with _lock:
+        _error = f"{type(error).__name__}: {error}"
+
+
+def failure() -> Optional[str]:
+    """The error the warm-up failed with, or None"""
+    with _lock:
+        return _error
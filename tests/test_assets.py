@@ -0,0 +1,64 @@
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+from app.Fixtures import assets
+from app.Fixtures.gams import (
+    ASSET_INFO,
+    MORTALTIY_GAM,
+    LACTATE_TRANSFORMER,
+)
+from app.prediction.design import model_matrix
+from app.prediction.predict import quick_sample
+
+
+@pytest.fixture(scope="module")
+def compact(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("compact")
+    assets.export_compact(assets.DEFAULT_ASSET_PATH, directory)
+    return directory
+
+
+def test_load_assets_independent_of_working_directory(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    study_export, info = assets.load_assets("app/Fixtures/production_assets.pkl")
+
+    assert info["format"] == "pickle"
+    assert info["sha256"] == ASSET_INFO["sha256"]
+    assert "mortality" in study_export
+
+
+def test_compact_assets_match_pickle(compact):
+    study_export, info = assets.load_assets(str(compact))
+    gam = study_export["mortality"]["model"]
+    transformer = study_export["lactate"]["transformer"]
+
+    assert info["format"] == "compact"
+    assert info["sha256"] == ASSET_INFO["sha256"]
+    assert isinstance(gam.coef_, np.memmap)
+    assert np.array_equal(gam.statistics_["cov"], MORTALTIY_GAM.statistics_["cov"])
+
+    X = np.array([[1, 0, 40, 60, 135, 7, 2, 13, 87, 120, 15, 2, 0, 1, 1, 1, 0]] * 2)
+    X = np.c_[X, [[30, 0, 1.5, 0], [40, 0, 6, 0]]]
+    assert np.array_equal(model_matrix(gam)(X), model_matrix(MORTALTIY_GAM)(X))
+    assert np.array_equal(
+        quick_sample(gam, X, "mu", 100, 1), quick_sample(MORTALTIY_GAM, X, "mu", 100, 1)
+    )
+
+    y = np.linspace(-3, 3, 50).reshape(-1, 1)
+    assert np.array_equal(
+        transformer.inverse_transform(y), LACTATE_TRANSFORMER.inverse_transform(y)
+    )
+
+
+def test_compact_assets_version_check(compact, tmp_path):
+    directory = shutil.copytree(compact, tmp_path / "compact")
+    manifest = json.loads((directory / assets.MANIFEST).read_text())
+    manifest["format_version"] += 1
+    (directory / assets.MANIFEST).write_text(json.dumps(manifest))
+
+    with pytest.raises(ValueError):
+        assets.load_compact(directory)
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+
+from app.benchmark import (
+    MISSING_PATTERNS,
+    compare,
+    convergence,
+    main,
+    synthetic_patients,
+)
+from app.Fixtures.constants import SAMPLERS
+from app.prediction.budget import sampler_available
+from app.prediction.preprocess import pre_process_batch
+
+
+def test_synthetic_patients():
+    for missing, (lactate_missing, albumin_missing) in MISSING_PATTERNS.items():
+        patients = synthetic_patients(50, missing, seed=1)
+
+        features = pre_process_batch(patients)
+
+        assert features.shape == (50, 21)
+        assert np.isnan(features[:, 19]).all() == lactate_missing
+        assert np.isnan(features[:, 17]).all() == albumin_missing
+    assert synthetic_patients(3, seed=2) == synthetic_patients(3, seed=2)
+
+
+def test_compare():
+    def results(p50, peak):
+        return {"results": [{"name": "a[]", "p50_ms": p50, "peak_memory_mb": peak}]}
+
+    assert compare(results(1.1, 2), results(1, 2)) == []
+    regressions = compare(results(1.5, 3), results(1, 2), tolerance=0.2)
+    assert [(r["metric"], r["change"]) for r in regressions] == [
+        ("p50_ms", 0.5),
+        ("peak_memory_mb", 0.5),
+    ]
+
+
+def test_convergence():
+    results = convergence((64,), ((2, 10),), n_patients=2, n_seeds=1)["convergence"]
+
+    samplers = [s for s in SAMPLERS if sampler_available(s)]
+    assert [result["sampler"] for result in results] == (
+        samplers * len(MISSING_PATTERNS)
+    )
+    for result in results:
+        assert result["samples"] == (
+            {"none": 64, "both": 40}.get(result["missing"], 20)
+        )
+        assert 0 <= result["error"] < 0.5
+
+
+def test_main_with_baseline(tmp_path):
+    output = tmp_path / "results.json"
+    args = ["--repeat", "2", "--warmup", "0", "--only", "predict_many[missing=both"]
+    args += ["--batch-sizes", "2", "--output", str(output)]
+
+    assert main(args) == 0
+    results = json.loads(output.read_text())
+    assert [r["name"] for r in results["results"]] == [
+        "predict_many[missing=both,batch=2]"
+    ]
+    assert results["results"][0]["throughput"] > 0
+
+    results["results"][0]["p50_ms"] = 1e-3
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(results))
+    assert main(args + ["--baseline", str(baseline)]) == 1
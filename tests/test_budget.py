@@ -0,0 +1,94 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from app.benchmark import synthetic_patients
+from app.Fixtures import gams
+from app.prediction.budget import (
+    DEFAULT_BUDGET,
+    memory_chunks,
+    request_memory,
+    samples_per_patient,
+)
+from app.prediction.pipeline import predict_many
+from app.prediction.sampling import clear_draw_cache, covariance_factor
+from app.prediction.preprocess import pre_process_batch
+
+
+def test_samples_per_patient():
+    budget = DEFAULT_BUDGET._replace(mortality=1000, imputation=4, imputed_mortality=10)
+
+    assert [samples_per_patient(budget, n) for n in range(3)] == [1000, 40, 160]
+
+
+def test_request_memory():
+    budget = DEFAULT_BUDGET._replace(mortality=1000, imputation=4, imputed_mortality=10)
+    rows = 8 * 100 * (1 + 16)
+    draws = 2 * 8 * 100 * (1000 + 10 + 2 * 4)
+
+    assert request_memory(budget, [0, 2], 100) == 4 * 8 * 1160 + rows + draws
+    float32 = budget._replace(precision="float32")
+    assert request_memory(float32, [0, 2], 100) == 4 * 4 * 1160 + rows + draws
+    assert request_memory(budget, [0, 0], 100) == (
+        4 * 8 * 2000 + 8 * 100 * 2 + 2 * 8 * 100 * 1000
+    )
+
+
+@pytest.mark.parametrize(
+    "missing, budget",
+    [
+        ("none", DEFAULT_BUDGET._replace(precision="float64")),
+        ("none", DEFAULT_BUDGET._replace(precision="float32")),
+        ("none", DEFAULT_BUDGET._replace(mortality=50000)),
+        ("both", DEFAULT_BUDGET._replace(precision="float64")),
+        ("both", DEFAULT_BUDGET._replace(precision="float32")),
+    ],
+)
+def test_request_memory_bounds_peak(missing, budget):
+    features = pre_process_batch(synthetic_patients(8, missing))
+    gams.load()
+    n_missing = [0 if missing == "none" else 2] * len(features)
+    estimate = request_memory(budget, n_missing, len(gams.MORTALTIY_GAM.coef_))
+
+    # the covariance factors are computed once per process, not per request
+    clear_draw_cache()
+    for gam in (gams.MORTALTIY_GAM, gams.LACTATE_GAM, gams.ALBUMIN_GAM):
+        covariance_factor(gam, legacy=True)
+    tracemalloc.start()
+    try:
+        predict_many(features, budget)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        clear_draw_cache()
+
+    assert peak <= estimate
+
+
+def test_memory_chunks():
+    budget = DEFAULT_BUDGET._replace(mortality=1000, imputation=4, imputed_mortality=10)
+    complete = 4 * 8 * 1000 + 8 * 100
+
+    chunks = memory_chunks(
+        budget, [0, 0, 0, 2], 100, limit=2 * complete + 2 * 8 * 100 * 1000
+    )
+    assert chunks == [slice(0, 2), slice(2, 3), slice(3, 4)]
+    assert memory_chunks(budget, [0, 0], 100, limit=1) == [slice(0, 1), slice(1, 2)]
+    assert memory_chunks(budget, [], 100) == []
+
+
+def test_predict_many_chunks(monkeypatch):
+    features = pre_process_batch(
+        synthetic_patients(3, "none") + synthetic_patients(3, "both")
+    )
+    whole = predict_many(features)
+
+    monkeypatch.setattr(
+        "app.prediction.pipeline.memory_chunks",
+        lambda *args: memory_chunks(*args, limit=1),
+    )
+    chunked = predict_many(features)
+
+    for result, expected in zip(chunked, whole):
+        np.testing.assert_allclose(result, expected, rtol=1e-12)
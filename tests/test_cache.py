@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+
+from app.models import Prediction
+from app.prediction.cache import ResultCache, result_key
+from app.prediction.preprocess import pre_process_input
+
+input = {
+    "Age": 40,
+    "ASA": 3,
+    "HR": 87,
+    "SBP": 120,
+    "WCC": 13,
+    "Na": 135,
+    "K": 8,
+    "Urea": 2,
+    "Creat": 4,
+    "GCS": 15,
+    "Resp": 2,
+    "Cardio": 1,
+    "Arrhythmia": True,
+    "CT_performed": True,
+    "Indication": 1,
+    "Malignancy": 2,
+    "Soiling": 2,
+    "Lactate": 1,
+}
+
+
+def test_result_key_uses_winsorized_inputs():
+    """inputs which winsorize to the same values share a key"""
+    key = result_key(pre_process_input(Prediction(**input)), 1, 10)
+
+    assert key == result_key(pre_process_input(Prediction(**dict(input, K=9))), 1, 10)
+    assert key != result_key(pre_process_input(Prediction(**input)), 2, 10)
+    assert key != result_key(pre_process_input(Prediction(**dict(input, K=5))), 1, 10)
+
+
+def test_result_cache_lru():
+    cache = ResultCache(max_entries=2, max_bytes=10**6)
+    for key in "abc":
+        cache.put(key, np.zeros(10))
+    cache.get("b")
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.stats()["Entries"] == 2
+    assert cache.stats()["Hits"] == 2
+    assert cache.stats()["Misses"] == 1
+
+
+def test_result_cache_max_bytes():
+    cache = ResultCache(max_entries=10, max_bytes=200)
+    cache.put("a", np.zeros(10))
+    cache.put("b", np.zeros(10))
+    cache.put("c", np.zeros(10))
+
+    assert cache.get("a") is None
+    assert cache.stats()["Bytes"] == 160
+
+
+def test_result_cache_ttl():
+    cache = ResultCache(max_entries=10, max_bytes=10**6, ttl=0.01)
+    result = np.zeros(10)
+    cache.put("a", result)
+
+    assert cache.get("a") is result
+    assert not result.flags.writeable
+    time.sleep(0.02)
+    assert cache.get("a") is None
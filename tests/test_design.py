@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from pygam import LinearGAM, f, l, s, te
+
+from app.Fixtures.gams import MORTALTIY_GAM, LACTATE_GAM, ALBUMIN_GAM
+from app.Fixtures.constants import ALBUMIN_COLUMN, LACTATE_COLUMN
+from app.prediction.design import SharedModelMatrix, model_matrix
+
+
+def random_rows(gam, n_rows: int, seed: int = 0) -> np.ndarray:
+    """Rows spanning each feature's knots, including the edge knots
+    themselves and continuous values outside them (to exercise extrapolation)
+    """
+    rnd = np.random.RandomState(seed)
+    X = np.zeros((n_rows, gam.statistics_["m_features"]))
+    for basis in model_matrix(gam).bases:
+        lower, upper = basis.offset, basis.offset + basis.scale
+        if basis.spline_order == 0:
+            X[:, basis.feature] = rnd.randint(
+                np.ceil(lower), np.floor(upper) + 1, n_rows
+            )
+            X[:5, basis.feature] = np.ceil(lower)
+            X[5:10, basis.feature] = np.floor(upper)
+        else:
+            margin = 0.2 * (upper - lower)
+            X[:, basis.feature] = rnd.uniform(lower - margin, upper + margin, n_rows)
+            X[:5, basis.feature] = lower
+            X[5:10, basis.feature] = upper
+    return X
+
+
+@pytest.mark.parametrize("gam", [MORTALTIY_GAM, LACTATE_GAM, ALBUMIN_GAM])
+def test_model_matrix_matches_pygam(gam):
+    X = random_rows(gam, 200)
+
+    expected = gam._modelmat(X).toarray()
+    actual = model_matrix(gam)(X)
+
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+def test_model_matrix_single_row():
+    X = random_rows(MORTALTIY_GAM, 20)[12]
+
+    expected = MORTALTIY_GAM._modelmat(X[np.newaxis, :]).toarray()
+    actual = model_matrix(MORTALTIY_GAM)(X.tolist())
+
+    assert np.allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+def test_model_matrix_other_terms():
+    """linear, dummy coded factor and cubic tensor terms"""
+    rnd = np.random.RandomState(1)
+    X = np.c_[rnd.uniform(0, 1, 100), rnd.randint(0, 3, 100), rnd.normal(size=100)]
+    y = X[:, 0] + X[:, 1] + X[:, 2] + rnd.normal(size=100)
+    gam = LinearGAM(
+        s(0, n_splines=8) + f(1, coding="dummy") + l(2) + te(0, 2, n_splines=5)
+    ).fit(X, y)
+
+    X_new = np.c_[
+        rnd.uniform(-0.5, 1.5, 30), rnd.randint(0, 3, 30), rnd.normal(size=30)
+    ]
+
+    expected = gam._modelmat(X_new).toarray()
+    actual = model_matrix(gam)(X_new)
+
+    assert np.allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+def test_shared_model_matrix():
+    rnd = np.random.RandomState(2)
+    patients = random_rows(MORTALTIY_GAM, 3)
+    groups = []
+    for n_rows in (6, 1, 4):
+        rows = np.repeat(patients[len(groups)][np.newaxis], n_rows, axis=0)
+        # imputed values repeat, as each is combined with several others
+        rows[:, LACTATE_COLUMN] = rnd.choice(rnd.uniform(0.5, 10, 3), n_rows)
+        rows[:, ALBUMIN_COLUMN] = rnd.choice(rnd.uniform(20, 45, 2), n_rows)
+        groups.append(rows)
+    coefs = rnd.normal(size=(len(MORTALTIY_GAM.coef_), 5))
+
+    shared = SharedModelMatrix(MORTALTIY_GAM, groups, (LACTATE_COLUMN, ALBUMIN_COLUMN))
+    full = model_matrix(MORTALTIY_GAM)(np.concatenate(groups))
+
+    assert shared.shared
+    assert np.allclose(shared.dot(coefs), full.dot(coefs), rtol=0, atol=1e-12)
+    assert np.allclose(
+        shared.dot(coefs, [0, 2]),
+        np.r_[full[:6], full[7:]].dot(coefs),
+        rtol=0,
+        atol=1e-12,
+    )
+
+
+def test_shared_model_matrix_different_patients():
+    """rows differing outside the varying features fall back to the full
+    model matrix"""
+    rnd = np.random.RandomState(4)
+    # past the rows fixed at the edge knots, so each row is different
+    rows = random_rows(MORTALTIY_GAM, 13)[10:]
+    groups = [rows[:2], rows[2:]]
+    coefs = rnd.normal(size=(len(MORTALTIY_GAM.coef_), 5))
+
+    shared = SharedModelMatrix(MORTALTIY_GAM, groups, (LACTATE_COLUMN, ALBUMIN_COLUMN))
+    full = model_matrix(MORTALTIY_GAM)(rows)
+
+    assert not shared.shared
+    assert np.allclose(shared.dot(coefs), full.dot(coefs), rtol=0, atol=1e-12)
+
+
+def test_shared_model_matrix_tensor_term():
+    """varying feature in a tensor term with a fixed feature"""
+    rnd = np.random.RandomState(3)
+    X = np.c_[rnd.uniform(0, 1, 100), rnd.normal(size=100)]
+    y = X[:, 0] * X[:, 1] + rnd.normal(size=100)
+    gam = LinearGAM(s(0, n_splines=8) + s(1) + te(0, 1, n_splines=5)).fit(X, y)
+
+    groups = [
+        np.c_[rnd.uniform(0, 1, n_rows), np.full(n_rows, i)]
+        for i, n_rows in ((1, 3), (2, 4))
+    ]
+    coefs = rnd.normal(size=(len(gam.coef_), 5))
+
+    shared = SharedModelMatrix(gam, groups, (0,))
+
+    expected = gam._modelmat(np.concatenate(groups)).toarray().dot(coefs)
+    assert np.allclose(shared.dot(coefs), expected, rtol=0, atol=1e-12)
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from app import settings
+from app.models import Prediction
+from app.prediction import executor
+from app.prediction.pipeline import predict_single
+from app.prediction.preprocess import pre_process_input
+
+input = {
+    "Age": 40,
+    "ASA": 3,
+    "HR": 87,
+    "SBP": 120,
+    "WCC": 13,
+    "Na": 135,
+    "K": 8,
+    "Urea": 2,
+    "Creat": 4,
+    "GCS": 15,
+    "Resp": 2,
+    "Cardio": 1,
+    "Arrhythmia": True,
+    "CT_performed": True,
+    "Indication": 1,
+    "Malignancy": 2,
+    "Soiling": 2,
+    "Lactate": 1,
+}
+
+
+@pytest.fixture
+def pool():
+    yield executor
+    executor.configure_pool(
+        settings.WORKER_TYPE, settings.WORKERS, settings.MAX_PENDING
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("worker_type", ["thread", "process"])
+async def test_run_in_pool(pool, worker_type):
+    pool.configure_pool(worker_type, workers=1, max_pending=2)
+    processed = pre_process_input(Prediction(**input))
+
+    result = await pool.run_in_pool(predict_single, processed)
+
+    assert result.shape[0] == 1000
+    assert (result == predict_single(processed)).all()
+
+
+@pytest.mark.asyncio
+async def test_run_in_pool_busy(pool):
+    pool.configure_pool("thread", workers=1, max_pending=1)
+    release = threading.Event()
+
+    task = asyncio.ensure_future(pool.run_in_pool(release.wait))
+    await asyncio.sleep(0)
+
+    with pytest.raises(executor.PoolBusyError):
+        await pool.run_in_pool(int)
+
+    release.set()
+    assert await task
+
+
+def test_configure_pool_invalid(pool):
+    with pytest.raises(ValueError):
+        pool.configure_pool("fibre", workers=1, max_pending=1)
@@ -1,7 +1,20 @@
+import numpy as np
 import pytest
 
 from typing import List
-from app.prediction.impute import impute_lactate
+from app.prediction.impute import (
+    impute_lactate,
+    expand_imputed,
+    LACTATE_COLUMN,
+    ALBUMIN_COLUMN,
+)
+from app.prediction.predict import impute, impute_joint
+from app.Fixtures.gams import (
+    LACTATE_GAM,
+    ALBUMIN_GAM,
+    LACTATE_TRANSFORMER,
+    ALBUMIN_TRANSFORMER,
+)
 from app.models import Prediction
 from app.prediction.preprocess import pre_process_input
 
@@ -36,3 +49,62 @@ async def test_lactate_impute():
     print(imputed)
 
     assert imputed.shape[0] == samples
+
+
+def test_joint_impute_matches_separate():
+    input = {
+        "Age": 63,
+        "ASA": 2,
+        "HR": 104,
+        "SBP": 100,
+        "WCC": 15,
+        "Na": 133,
+        "K": 4.4,
+        "Urea": 9,
+        "Creat": 110,
+        "GCS": 15,
+        "Resp": 1,
+        "Cardio": 1,
+        "Arrhythmia": False,
+        "CT_performed": True,
+        "Indication": 2,
+        "Malignancy": 0,
+        "Soiling": 1,
+    }
+
+    input_model = Prediction(**input)
+    processed = pre_process_input(input_model)
+    features = [processed.convert_to_list()[:17]]
+
+    lactates, albumins = impute_joint(
+        features,
+        10,
+        [LACTATE_GAM, ALBUMIN_GAM],
+        [LACTATE_TRANSFORMER, ALBUMIN_TRANSFORMER],
+        5,
+    )
+
+    assert np.allclose(
+        lactates[0], impute(features, 10, LACTATE_GAM, LACTATE_TRANSFORMER, 5)
+    )
+    assert np.allclose(
+        albumins[0], impute(features, 10, ALBUMIN_GAM, ALBUMIN_TRANSFORMER, 5)
+    )
+
+
+def test_expand_imputed_order():
+    """albumin varies slowest, as when lactate was filled in first"""
+    row = np.arange(21, dtype=float)[np.newaxis, :]
+    lactates = np.array([[1.0, 2.0, 3.0]])
+    albumins = np.array([[30.0, 40.0]])
+
+    expanded = expand_imputed(row, lactates, albumins)[0]
+
+    assert expanded.shape == (6, 21)
+    assert expanded[:, LACTATE_COLUMN].tolist() == [1, 2, 3, 1, 2, 3]
+    assert expanded[:, ALBUMIN_COLUMN].tolist() == [30, 30, 30, 40, 40, 40]
+    assert (expanded[:, :17] == row[:, :17]).all()
+
+    lactate_only = expand_imputed(row, lactates=lactates)[0]
+    assert lactate_only[:, LACTATE_COLUMN].tolist() == [1, 2, 3]
+    assert (lactate_only[:, ALBUMIN_COLUMN] == row[0, ALBUMIN_COLUMN]).all()
@@ -0,0 +1,113 @@
+from fastapi.testclient import TestClient
+
+from app import metrics, settings
+from app.main import api
+
+client = TestClient(api)
+
+patient = {
+    "Age": 62,
+    "ASA": 2,
+    "HR": 95,
+    "SBP": 110,
+    "WCC": 9,
+    "Na": 138,
+    "K": 4.1,
+    "Urea": 6,
+    "Creat": 80,
+    "GCS": 15,
+    "Resp": 1,
+    "Cardio": 1,
+    "Arrhythmia": False,
+    "CT_performed": True,
+    "Indication": 2,
+    "Malignancy": 0,
+    "Soiling": 1,
+}
+
+
+def sample_value(text: str, sample: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test", ("stage",), (0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a",le="0.1"} 1',
+        'test_seconds_bucket{stage="a",le="1.0"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 3',
+        'test_seconds_sum{stage="a"} 5.55',
+        'test_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_worker_label(monkeypatch):
+    monkeypatch.setattr(metrics, "_constant_labels", {})
+    counter = metrics.Counter("test_total", "Test", ("path",))
+    counter.inc(path="/predict")
+    callback = metrics.Callback("test_size", "Test", "gauge", lambda: 3)
+
+    metrics.set_worker("1")
+
+    assert metrics.worker() == "1"
+    assert counter.render()[-1] == 'test_total{worker="1",path="/predict"} 1'
+    assert callback.render()[-1] == 'test_size{worker="1"} 3'
+
+
+def test_run_recorded():
+    def work():
+        with metrics.timed("link", "mortality"):
+            return 42
+
+    before = dict(metrics.STAGE_SECONDS.values)
+    result, stages = metrics.run_recorded(work)
+
+    assert result == 42
+    assert [stage[:2] for stage in stages] == [("link", "mortality")]
+    assert metrics.STAGE_SECONDS.values == before
+
+
+def test_metrics_endpoint():
+    client.post("/predict", json=patient)
+    client.post("/predict", json=dict(patient, Lactate=1.2, Albumin=40))
+    text = client.get("/metrics").text
+
+    for stage, model in [
+        ("validation", ""),
+        ("imputation", "lactate+albumin"),
+        ("inverse_transform", "albumin"),
+        ("model_matrix", "mortality"),
+        ("coefficient_sampling", "mortality"),
+        ("link", "mortality"),
+        ("summary", ""),
+        ("serialization", ""),
+    ]:
+        sample = f'rune_stage_seconds_count{{stage="{stage}",model="{model}"}}'
+        assert sample_value(text, sample) > 0, sample
+
+    for missing in ("lactate+albumin", "none"):
+        sample = f'rune_patients_total{{path="/predict",missing="{missing}"}}'
+        assert sample_value(text, sample) > 0
+    assert (
+        sample_value(text, 'rune_request_seconds_count{path="/predict",status="200"}')
+        >= 2
+    )
+    assert "rune_result_cache_hit_ratio" in text
+
+
+def test_metrics_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS", False)
+
+    assert client.get("/metrics").status_code == 404
+    before = dict(metrics.STAGE_SECONDS.values)
+    assert client.post("/predict", json=patient).status_code == 200
+    assert metrics.STAGE_SECONDS.values == before
@@ -51,3 +51,24 @@ def test_quick_sample_logisticgam_mu():
 
     y_samples_mean = np.mean(y_samples, axis=0)
     assert all(np.abs(p_y - y_samples_mean) < 0.25)
+
+
+def test_quick_sample_generator_lineargam_y():
+    """quick_sample with the Generator based sampler should agree with
+    pygam's predictions in the same way as the legacy sampler"""
+    X, y = lineargam_data(n_rows=20)
+    gam = LinearGAM(s(0, spline_order=2, n_splines=5, lam=0.1), fit_intercept=False)
+    gam.fit(X, y)
+
+    y_pred = gam.predict(X)
+    y_samples = predict.quick_sample(
+        gam=gam,
+        sample_at_X=X,
+        quantity="y",
+        n_draws=200,
+        random_seed=0,
+        legacy_rng=False,
+    )
+
+    y_samples_mean = np.mean(y_samples, axis=0)
+    assert all(np.abs(y_pred - y_samples_mean) < 0.1)
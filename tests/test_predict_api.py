@@ -1,5 +1,13 @@
+import base64
+from importlib.util import find_spec
+
+import numpy as np
+import pytest
 from fastapi.testclient import TestClient
 from app.main import api
+from app.models import BatchPredictionResult, PredictionResult
+from app.prediction.budget import sampler_available
+from app.prediction.cache import RESULT_CACHE
 
 client = TestClient(api)
 
@@ -31,6 +39,20 @@ pred = {
 }
 
 
+def test_form():
+    assert client.get("/form").status_code == 200
+
+    form = {
+        name: value
+        for name, value in pred.items()
+        if name not in ("Arrhythmia", "CT_performed")
+    }
+    response = client.post("/form", data=dict(form, CT_performed="on", Albumin=""))
+
+    assert response.status_code == 200
+    assert "Median Risk:" in response.text
+
+
 def test_predict_api_both_impute():
     response = client.post(
         "/predict", headers={"Content-Type": "application/json"}, json=pred
@@ -86,3 +108,255 @@ def test_predict_api_invalid_type():
     )
 
     assert response.status_code == 422
+
+
+batch_pred = {
+    "Age": 70,
+    "ASA": 3,
+    "HR": 110,
+    "SBP": 95,
+    "WCC": 18,
+    "Na": 131,
+    "K": 4.1,
+    "Urea": 12,
+    "Creat": 140,
+    "GCS": 14,
+    "Resp": 2,
+    "Cardio": 2,
+    "Arrhythmia": True,
+    "CT_performed": True,
+    "Indication": 2,
+    "Malignancy": 1,
+    "Soiling": 3,
+}
+
+
+def test_predict_api_batch_matches_single():
+    batch = [
+        dict(batch_pred, Lactate=2.5, Albumin=30),
+        dict(batch_pred, Albumin=30),
+        dict(batch_pred, Lactate=2.5),
+        dict(batch_pred),
+        dict(batch_pred, Age=55, Lactate=1.2, Albumin=41),
+    ]
+
+    response = client.post("/predict/batch", json=batch)
+    assert response.status_code == 200
+
+    results = response.json()["Results"]
+    assert len(results) == len(batch)
+
+    for patient, result in zip(batch, results):
+        single = client.post("/predict", json=patient).json()
+        assert result["Summary"] == single["Summary"]
+        assert type(result["ID"]) == str
+
+
+def test_predict_api_batch_invalid_cat():
+    batch = [dict(batch_pred), dict(batch_pred, Resp=7)]
+
+    response = client.post("/predict/batch", json=batch)
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Patient 1")
+
+
+def test_predict_api_cached():
+    patient = dict(batch_pred, Lactate=3.1, Albumin=28)
+    first = client.post("/predict", json=patient).json()
+    hits = client.get("/predict/cache").json()["Hits"]
+
+    second = client.post("/predict", json=patient).json()
+
+    assert client.get("/predict/cache").json()["Hits"] == hits + 1
+    assert second["Result"] == first["Result"]
+    assert second["ID"] != first["ID"]
+
+
+def test_predict_api_compact_formats():
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+    full = client.post("/predict", json=patient).json()
+    result = np.array(full["Result"])
+
+    summary = client.post("/predict?format=summary", json=patient).json()
+    assert "Result" not in summary
+    assert summary["Summary"] == full["Summary"]
+
+    histogram = client.post("/predict?format=histogram&bins=20", json=patient).json()
+    assert sum(histogram["Histogram"]["Counts"]) == len(result)
+    assert len(histogram["Histogram"]["Edges"]) == 21
+
+    quantiles = client.post("/predict?format=quantiles", json=patient).json()
+    assert quantiles["Quantiles"]["Values"][50] == pytest.approx(np.median(result))
+
+    encoded = client.post("/predict?format=base64&dtype=float64", json=patient).json()
+    data = base64.b64decode(encoded["EncodedResult"]["Data"])
+    assert (np.frombuffer(data, dtype="<f8") == result).all()
+
+
+def test_predict_api_response_schema():
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+    schema = api.openapi()["components"]["schemas"]
+    assert "Result" not in schema["PredictionResult"]["required"]
+
+    for query, field in [
+        ("format=full", "Result"),
+        ("format=summary", None),
+        ("format=histogram", "Histogram"),
+        ("format=quantiles", "Quantiles"),
+        ("format=base64", "EncodedResult"),
+        ("exact=true", None),
+    ]:
+        body = client.post(f"/predict?{query}", json=patient).json()
+        parsed = PredictionResult(**body)
+        assert set(body) <= set(PredictionResult.__fields__)
+        for name in ("Result", "Histogram", "Quantiles", "EncodedResult"):
+            assert (getattr(parsed, name) is not None) == (name == field)
+
+    batch = client.post("/predict/batch?format=histogram", json=[patient]).json()
+    assert BatchPredictionResult(**batch).Results[0].Histogram is not None
+
+
+def test_predict_api_binary():
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+    full = client.post("/predict", json=patient).json()
+
+    response = client.post(
+        "/predict", json=patient, headers={"Accept": "application/octet-stream"}
+    )
+
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["X-Summary-Median"] == full["Summary"]["Median"]
+    samples = np.frombuffer(response.content, dtype="<f4")
+    assert np.allclose(samples, full["Result"], rtol=1e-6)
+
+
+def test_predict_api_draws():
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+
+    fewer = client.post("/predict?draws=2000&format=summary", json=patient).json()
+    adaptive = client.post("/predict?tolerance=1", json=patient).json()
+    full = client.post("/predict", json=patient).json()
+    batch = client.post("/predict/batch?draws=2000", json=[patient]).json()
+
+    assert fewer["Draws"] == batch["Results"][0]["Draws"] == 2000
+    assert fewer["Summary"] == batch["Results"][0]["Summary"]
+    assert full["Draws"] == 10000
+    assert adaptive["Draws"] == len(adaptive["Result"]) < 10000
+    np.testing.assert_allclose(
+        adaptive["Result"], full["Result"][: adaptive["Draws"]], rtol=1e-12
+    )
+
+    response = client.post("/predict?imputation_draws=1000", json=patient)
+    assert response.status_code == 400
+    for query in ("draws=100001", "imputation_draws=1&imputed_draws=100001"):
+        response = client.post(f"/predict?{query}", json=patient)
+        assert response.status_code == 400
+        assert "At most 100000 draws" in response.json()["detail"]
+
+
+@pytest.mark.parametrize(
+    "sampler",
+    [
+        pytest.param(
+            "sobol",
+            marks=pytest.mark.skipif(
+                not sampler_available("sobol"), reason="needs scipy.stats.qmc"
+            ),
+        ),
+        "lhs",
+    ],
+)
+def test_predict_api_sampler(sampler):
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+
+    random = client.post("/predict?format=summary", json=patient).json()
+    quasi = client.post(f"/predict?format=summary&sampler={sampler}", json=patient)
+    quasi = quasi.json()
+    imputed = client.post(f"/predict?sampler={sampler}", json=batch_pred).json()
+
+    assert quasi["Draws"] == random["Draws"]
+    assert quasi["Summary"] != random["Summary"]
+    for stat, value in quasi["Summary"].items():
+        assert abs(float(value) - float(random["Summary"][stat])) < 0.01
+    assert len(imputed["Result"]) == imputed["Draws"]
+
+
+def test_predict_api_sampler_unavailable(monkeypatch):
+    patient = dict(batch_pred, Lactate=2.2, Albumin=33)
+
+    response = client.post("/predict?sampler=halton", json=patient)
+    assert response.status_code == 400
+
+    monkeypatch.setattr(
+        "importlib.util.find_spec",
+        lambda name, *args: None if name == "scipy.stats.qmc" else find_spec(name),
+    )
+    response = client.post("/predict?sampler=sobol", json=patient)
+    assert response.status_code == 400
+    assert "scipy 1.7" in response.json()["detail"]
+
+
+def test_predict_api_exact():
+    complete = dict(batch_pred, Lactate=2.2, Albumin=33)
+    imputed = dict(batch_pred, Lactate=2.2)
+
+    exact = client.post("/predict?exact=true", json=complete).json()
+    sampled = client.post("/predict?format=summary", json=complete).json()
+    fallback = client.post("/predict?exact=true", json=imputed).json()
+    batch = client.post("/predict/batch?exact=true", json=[imputed, complete]).json()
+
+    assert (exact["Draws"], exact["Exact"]) == (0, True)
+    assert "Result" not in exact
+    for stat, value in exact["Summary"].items():
+        assert abs(float(value) - float(sampled["Summary"][stat])) < 0.01
+    assert (fallback["Draws"], fallback["Exact"]) == (1000, False)
+    assert [r["Exact"] for r in batch["Results"]] == [False, True]
+    assert batch["Results"][0]["Summary"] == fallback["Summary"]
+    assert batch["Results"][1]["Summary"] == exact["Summary"]
+
+    response = client.post("/predict?exact=true&format=full", json=complete)
+    assert response.status_code == 400
+    response = client.post("/predict/batch?exact=true&format=quantiles", json=[])
+    assert response.status_code == 400
+
+
+def test_predict_api_sweep():
+    with_albumin = dict(batch_pred, Albumin=35)
+    for patient, variable, sweep in [
+        (with_albumin, "Age", {"Values": [30, 45.5, 80]}),
+        (batch_pred, "Albumin", {"Values": [20, 40]}),
+        (with_albumin, "Lactate", {"Points": 3}),
+    ]:
+        RESULT_CACHE.clear()
+        response = client.post(
+            "/predict/sweep",
+            json={"Patient": patient, "Variable": variable, **sweep},
+        )
+        assert response.status_code == 200
+        points = response.json()["Points"]
+
+        RESULT_CACHE.clear()
+        for point in points:
+            single = client.post(
+                "/predict?format=summary",
+                json=dict(patient, **{variable: point["Value"]}),
+            ).json()
+            assert point["Summary"] == single["Summary"]
+            assert point["Draws"] == single["Draws"]
+
+    assert [point["Value"] for point in points] == [0.3, 9.65, 19.0]
+    assert [point["Draws"] for point in points] == [10000] * 3
+
+
+def test_predict_api_sweep_invalid():
+    def sweep(variable, **grid):
+        return client.post(
+            "/predict/sweep",
+            json={"Patient": batch_pred, "Variable": variable, **grid},
+        )
+
+    assert sweep("Lactate", Values=[1, 25]).status_code == 400
+    assert sweep("GCS", Values=[5]).status_code == 422
+    assert sweep("Age", Points=1000).status_code == 422
+    assert sweep("Age", Values=[]).status_code == 422
@@ -1,6 +1,14 @@
-from app.prediction.predict import predict_mortality
+import numpy as np
+
+from app.prediction.predict import (
+    mortality_quantiles,
+    predict_mortality,
+    predict_mortality_adaptive,
+    predict_mortality_batch,
+)
 from app.models import Prediction
 from app.prediction.preprocess import pre_process_input
+from app.prediction.summary import SUMMARY_QUANTILES, summarise_samples
 
 input = {
     "Age": 40,
@@ -33,3 +41,66 @@ def test_predict_mortality():
     prediction = predict_mortality([processed.convert_to_list()], samples, 1)
 
     assert prediction.shape[0] == samples
+
+
+def test_predict_mortality_adaptive():
+    processed = pre_process_input(Prediction(**input))
+    rows = [np.array([processed.convert_to_list()], dtype=float)] * 2
+    full = predict_mortality_batch(rows, 1000, 1)
+
+    converged = predict_mortality_adaptive(rows, 1000, 1, tolerance=1)
+    exhausted = predict_mortality_adaptive(rows, 1000, 1, tolerance=0)
+
+    for result, stopped, complete in zip(full, converged, exhausted):
+        # stopped after the first ADAPTIVE_MIN_BLOCKS blocks of 100 draws
+        assert len(stopped) == 400
+        np.testing.assert_allclose(stopped, result[:400])
+        np.testing.assert_allclose(complete, result)
+
+
+def test_mortality_quantiles():
+    processed = pre_process_input(Prediction(**input))
+    row = [processed.convert_to_list()]
+
+    exact = mortality_quantiles(np.array(row, dtype=float))
+    sampled = summarise_samples(predict_mortality(row, 100000, 1), SUMMARY_QUANTILES)
+
+    assert exact.shape == (len(SUMMARY_QUANTILES), 1)
+    np.testing.assert_allclose(exact[:, 0], sampled["Quantiles"], rtol=0.02)
+
+
+def test_predict_mortality_float32():
+    """float32 risks should give the same summary to well within the 4
+    decimal places reported"""
+    row = pre_process_input(Prediction(**input)).convert_to_list()
+    imputed = np.array([row] * 5)
+    imputed[:, 17] = np.linspace(20, 50, 5)
+    rows = [np.array([row]), imputed]
+
+    full = predict_mortality_batch(rows, 5000, 1)
+    single = predict_mortality_batch(rows, 5000, 1, precision="float32")
+    adaptive = predict_mortality_adaptive(rows, 5000, 1, 0, precision="float32")
+
+    for result, narrow, stopped in zip(full, single, adaptive):
+        assert narrow.dtype == np.float32
+        np.testing.assert_allclose(narrow, result, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(stopped, narrow, rtol=1e-6)
+        np.testing.assert_allclose(
+            summarise_samples(narrow, SUMMARY_QUANTILES)["Quantiles"],
+            summarise_samples(result, SUMMARY_QUANTILES)["Quantiles"],
+            rtol=0,
+            atol=1e-6,
+        )
+
+
+def test_predict_mortality_different_patients():
+    """rows differing outside lactate / albumin aren't treated as one patient"""
+    row = pre_process_input(Prediction(**input)).convert_to_list()
+    other = pre_process_input(Prediction(**{**input, "Age": 85, "ASA": 4}))
+    rows = np.array([row, other.convert_to_list()])
+
+    together = predict_mortality(rows, 100, 1).reshape(100, 2)
+
+    for i in range(2):
+        alone = predict_mortality(rows[i : i + 1], 100, 1)
+        np.testing.assert_allclose(together[:, i], alone, rtol=0, atol=1e-12)
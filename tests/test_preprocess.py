@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 import app.prediction.preprocess as preprocess
 from app.models import Prediction, ValidationError
 
@@ -81,3 +82,58 @@ def test_validate_cats():
     pred_model.ASA = 10
     with pytest.raises(ValidationError):
         preprocess.validate_categories(pred_model)
+
+
+def test_zero_is_not_missing():
+    processed = preprocess.pre_process_input(Prediction(**dict(pred, Lactate=0)))
+
+    assert processed.Lactate_missing == 0
+    assert processed.Lactate == 0.3
+
+
+def test_validate_cats_reports_all():
+    pred_model = Prediction(**dict(pred, Resp=7, Soiling=7))
+
+    with pytest.raises(ValidationError) as e:
+        preprocess.validate_categories(pred_model)
+
+    assert "Respiratory" in e.value.error_msg
+    assert "Soiling" in e.value.error_msg
+    assert e.value.status_code == 400
+
+
+def test_batch_matches_single():
+    batch = [
+        Prediction(**pred),
+        Prediction(**dict(pred, Lactate=None, Albumin=2, Creat=900)),
+        Prediction(**dict(pred, Lactate=0, Albumin=0, Age=17, HR=300)),
+        Prediction(**dict(pred, Lactate=25.0, Albumin=80, WCC=0.1)),
+    ]
+
+    features = preprocess.pre_process_batch(batch)
+    expected = np.array(
+        [preprocess.pre_process_input(p).convert_to_list() for p in batch],
+        dtype=float,
+    )
+
+    np.testing.assert_array_equal(features, expected)
+
+
+def test_batch_reports_all_errors():
+    batch = [
+        Prediction(**dict(pred, Soiling=7)),
+        Prediction(**pred),
+        Prediction(**dict(pred, ASA=10, GCS=2)),
+    ]
+
+    with pytest.raises(ValidationError) as e:
+        preprocess.pre_process_batch(batch)
+
+    errors = e.value.error_msg.split("; ")
+    assert [error.split(":")[0] for error in errors] == [
+        "Patient 0",
+        "Patient 2",
+        "Patient 2",
+    ]
+    assert "Invalid ASA : 10." in errors[1]
+    assert e.value.status_code == 422
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from numpy.random import RandomState
+from scipy.special import ndtr
+
+from app.Fixtures.gams import LACTATE_GAM
+from app.prediction.budget import sampler_available
+from app.prediction.sampling import (
+    LATIN_HYPERCUBE,
+    SOBOL,
+    coefficient_draws,
+    clear_draw_cache,
+    covariance_factor,
+    posterior_draws,
+    quasi_random_draws,
+    sample_coefficients,
+    standard_normal_points,
+)
+
+QUASI_RANDOM = [
+    pytest.param(
+        SOBOL,
+        marks=pytest.mark.skipif(
+            not sampler_available(SOBOL), reason="needs scipy.stats.qmc"
+        ),
+    ),
+    LATIN_HYPERCUBE,
+]
+
+
+def test_coefficient_draws_match_random_state():
+    clear_draw_cache()
+    expected = RandomState(3).multivariate_normal(
+        LACTATE_GAM.coef_, LACTATE_GAM.statistics_["cov"], size=20
+    )
+
+    draws, _ = coefficient_draws(LACTATE_GAM, 20, 3)
+    cached_draws, _ = coefficient_draws(LACTATE_GAM, 20, 3)
+
+    assert np.array_equal(draws, expected)
+    assert cached_draws is draws
+    assert not draws.flags.writeable
+
+
+def test_coefficient_draws_continue_stream():
+    """the returned RandomState should carry on where the draws left off"""
+    clear_draw_cache()
+    rnd = RandomState(3)
+    rnd.multivariate_normal(LACTATE_GAM.coef_, LACTATE_GAM.statistics_["cov"], 5)
+    expected = rnd.normal(size=4)
+
+    for _ in range(2):
+        _, cached_rnd = coefficient_draws(LACTATE_GAM, 5, 3)
+        assert np.array_equal(cached_rnd.normal(size=4), expected)
+
+
+def test_sample_coefficients_legacy_matches_random_state():
+    expected = RandomState(11).multivariate_normal(
+        LACTATE_GAM.coef_, LACTATE_GAM.statistics_["cov"], size=50
+    )
+    draws, _ = sample_coefficients(LACTATE_GAM, 50, 11, legacy=True)
+
+    assert np.array_equal(draws, expected)
+
+
+def test_covariance_factor_reconstructs_covariance():
+    cov = LACTATE_GAM.statistics_["cov"]
+    factor = covariance_factor(LACTATE_GAM)
+
+    assert np.allclose(factor.T @ factor, cov, rtol=0, atol=1e-10)
+
+
+def test_sample_coefficients_generator_moments():
+    draws, rng = sample_coefficients(LACTATE_GAM, 20000, 0)
+
+    assert isinstance(rng, np.random.Generator)
+    assert draws.shape == (20000, LACTATE_GAM.coef_.shape[0])
+    assert np.allclose(draws.mean(axis=0), LACTATE_GAM.coef_, atol=0.05)
+
+
+@pytest.mark.parametrize("sampler", QUASI_RANDOM)
+def test_standard_normal_points(sampler):
+    points = standard_normal_points(1000, 3, 5, sampler)
+
+    assert points.shape == (1000, 3)
+    assert np.isfinite(points).all()
+    assert np.allclose(points.mean(axis=0), 0, atol=0.01)
+    assert np.array_equal(points, standard_normal_points(1000, 3, 5, sampler))
+
+
+def test_latin_hypercube_points():
+    # one point in each of the 1000 slices of every dimension
+    points = standard_normal_points(1000, 3, 5, LATIN_HYPERCUBE)
+    slices = np.floor(ndtr(points) * 1000)
+    assert all(len(np.unique(column)) == 1000 for column in slices.T)
+
+
+@pytest.mark.parametrize("sampler", QUASI_RANDOM)
+def test_quasi_random_draws(sampler):
+    clear_draw_cache()
+    draws, noise = quasi_random_draws(LACTATE_GAM, 4096, 1, sampler)
+
+    assert draws.shape == (4096, LACTATE_GAM.coef_.shape[0])
+    assert noise.shape == (4096,)
+    assert not draws.flags.writeable
+    assert np.allclose(draws.mean(axis=0), LACTATE_GAM.coef_, atol=0.01)
+    cov = np.cov(draws, rowvar=False)
+    assert np.allclose(cov, LACTATE_GAM.statistics_["cov"], atol=0.01)
+    assert posterior_draws(LACTATE_GAM, 4096, 1, sampler, noise=True)[0] is draws
+
+
+def test_posterior_draws_random():
+    draws, noise = posterior_draws(LACTATE_GAM, 5, 3, noise=True)
+    expected, rnd = coefficient_draws(LACTATE_GAM, 5, 3)
+
+    assert draws is expected
+    assert np.array_equal(noise, rnd.standard_normal(5))
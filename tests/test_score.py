@@ -0,0 +1,146 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models import Prediction
+from app.prediction.pipeline import predict_single
+from app.prediction.preprocess import pre_process_input
+from app.score import main, match_columns, score
+
+patient = {
+    "Age": 71,
+    "ASA": 3,
+    "HR": 104,
+    "SBP": 95,
+    "WCC": 15.2,
+    "Na": 131,
+    "K": 5.3,
+    "Urea": 11.4,
+    "Creat": 140,
+    "GCS": 15,
+    "Resp": 1,
+    "Cardio": 2,
+    "Arrhythmia": True,
+    "CT_performed": True,
+    "Indication": 4,
+    "Malignancy": 1,
+    "Soiling": 2,
+}
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    rows = [
+        dict(patient, Lactate=3.2, Albumin=29),
+        dict(patient, Albumin=35),
+        dict(patient, ASA=10),
+        dict(patient, Age=None, Lactate=1.1),
+        dict(patient),
+    ]
+    frame = pd.DataFrame(rows).rename(columns={"Age": "S01AgeOnArrival", "K": "Pot"})
+    frame.insert(0, "PatientID", [f"P{i}" for i in range(len(rows))])
+    path = tmp_path / "cohort.csv"
+    frame.to_csv(path, index=False)
+    return path, rows
+
+
+def expected_summary(row):
+    processed = pre_process_input(Prediction(**row))
+    return np.quantile(predict_single(processed), [0.025, 0.5, 0.975])
+
+
+def test_match_columns():
+    columns = ["S01AgeOnArrival", "Pot", "Unused"] + list(patient)[1:]
+    columns.remove("K")
+
+    fields = match_columns(columns, {"Pot": "K"})
+
+    assert fields["Age"] == "S01AgeOnArrival"
+    assert fields["K"] == "Pot"
+    assert "Lactate" not in fields
+    with pytest.raises(ValueError, match="No column for K"):
+        match_columns(columns)
+
+
+def test_score_csv(cohort, tmp_path):
+    path, rows = cohort
+    output = tmp_path / "scores.csv"
+
+    n_rows = score(
+        path, output, chunk_size=2, id_column="PatientID", overrides={"Pot": "K"}
+    )
+
+    scores = pd.read_csv(output)
+    assert n_rows == len(scores) == 5
+    assert scores["Row"].tolist() == [0, 1, 2, 3, 4]
+    assert scores["PatientID"].tolist() == ["P0", "P1", "P2", "P3", "P4"]
+    assert "Invalid ASA" in scores["Error"][2]
+    assert scores["Error"][3] == "Missing Age"
+    assert scores["Median"][[2, 3]].isna().all()
+
+    for i in (0, 1, 4):
+        np.testing.assert_allclose(
+            scores.loc[i, ["LowerPercentile", "Median", "UpperPercentile"]].to_numpy(
+                dtype=float
+            ),
+            expected_summary(rows[i]),
+        )
+
+
+def test_score_invalid_booleans(tmp_path):
+    rows = [
+        dict(patient, Arrhythmia=2),
+        dict(patient, CT_performed=0.5),
+        dict(patient, Arrhythmia=-1, CT_performed="false"),
+        dict(patient, Arrhythmia=0, CT_performed="TRUE"),
+    ]
+    path = tmp_path / "cohort.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    output = tmp_path / "scores.csv"
+
+    score(path, output)
+
+    scores = pd.read_csv(output)
+    assert scores["Error"][0] == (
+        "Invalid Arrhythmia : 2. Must be true or false (1 or 0)"
+    )
+    assert scores["Error"][1].startswith("Invalid CT_performed : 0.5.")
+    assert scores["Error"][2].startswith("Invalid Arrhythmia : -1.")
+    assert scores["Median"][:3].isna().all()
+    assert pd.isna(scores["Error"][3])
+    np.testing.assert_allclose(
+        scores.loc[3, ["LowerPercentile", "Median", "UpperPercentile"]].to_numpy(
+            dtype=float
+        ),
+        expected_summary(dict(patient, Arrhythmia=False)),
+    )
+
+
+def test_score_parquet_without_pyarrow(cohort, tmp_path, monkeypatch, capsys):
+    path, _ = cohort
+    output = tmp_path / "scores.parquet"
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(path), str(output), "--map", "Pot=K"])
+
+    assert exit_info.value.code == 1
+    assert "Parquet files need pyarrow" in capsys.readouterr().err
+    assert not output.exists()
+
+
+def test_score_parquet_draws_with_workers(cohort, tmp_path):
+    pytest.importorskip("pyarrow")
+    path, rows = cohort
+    output = tmp_path / "scores.parquet"
+
+    score(path, output, chunk_size=2, workers=2, draws=True, overrides={"Pot": "K"})
+
+    scores = pd.read_parquet(output)
+    n_draws = [0 if draws is None else len(draws) for draws in scores["Draws"]]
+    assert n_draws == [10000, 1000, 0, 0, 10000]
+    np.testing.assert_allclose(
+        scores["Median"][0], np.median(scores["Draws"][0]), rtol=1e-6
+    )
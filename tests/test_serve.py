@@ -0,0 +1,82 @@
+import gc
+import os
+import signal
+import socket
+import time
+
+from app import metrics, serve
+from app.Fixtures import gams
+from app.Fixtures.assets import MANIFEST
+
+
+def test_asset_signature(tmp_path):
+    assets = tmp_path / "assets.pkl"
+    assert serve.asset_signature(str(assets)) is None
+
+    assets.write_bytes(b"a")
+    signature = serve.asset_signature(str(assets))
+    assets.write_bytes(b"ab")
+    assert serve.asset_signature(str(assets)) != signature
+
+    compact = tmp_path / "compact"
+    compact.mkdir()
+    (compact / MANIFEST).write_text("{}")
+    signature = serve.asset_signature(str(compact))
+    (compact / "mortality.npy").write_bytes(b"a")
+    assert serve.asset_signature(str(compact)) == signature
+    os.replace(assets, compact / MANIFEST)
+    assert serve.asset_signature(str(compact)) != signature
+
+
+def test_gams_reload():
+    gams.load()
+    model, info = gams.MORTALTIY_GAM, gams.ASSET_INFO
+
+    gams.reload()
+
+    assert gams.MORTALTIY_GAM is not model
+    assert gams.ASSET_INFO == info
+
+
+def idle_worker(sock, log_level):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    time.sleep(60)
+
+
+def test_supervisor_reload(monkeypatch, tmp_path):
+    def labelled_worker(sock, log_level):
+        (tmp_path / str(os.getpid())).write_text(metrics.worker())
+        idle_worker(sock, log_level)
+
+    monkeypatch.setattr(serve, "run_worker", labelled_worker)
+    sock = socket.socket()
+    supervisor = serve.Supervisor(sock, workers=2, graceful_timeout=5)
+    try:
+        supervisor.spawn_missing()
+        old = set(supervisor.children)
+        assert len(old) == 2
+
+        assert supervisor.reload()
+        assert set(supervisor.stopping) == old
+        assert list(supervisor.children.values()).count(1) == 2
+
+        # the new generation takes over the old one's worker labels
+        deadline = time.monotonic() + 5
+        while len(list(tmp_path.iterdir())) < 4 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        labels = {int(path.name): path.read_text() for path in tmp_path.iterdir()}
+        assert labels == {pid: str(slot) for pid, slot in supervisor.slots.items()}
+        assert sorted(labels[pid] for pid in old) == ["0", "1"]
+        new = set(supervisor.children) - old
+        assert sorted(labels[pid] for pid in new) == ["0", "1"]
+
+        deadline = time.monotonic() + 5
+        while old & set(supervisor.children) and time.monotonic() < deadline:
+            supervisor.reap()
+            time.sleep(0.05)
+        assert set(supervisor.children).isdisjoint(old)
+    finally:
+        supervisor.stop()
+        gc.unfreeze()
+        sock.close()
+    assert supervisor.children == {}
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from app import startup
+from app.Fixtures import gams
+from app.main import api
+
+
+def test_import_does_not_load_models():
+    code = (
+        "import sys\n"
+        "import app.main\n"
+        "from app.Fixtures import gams\n"
+        "heavy = [m for m in ('pygam', 'sklearn', 'pandas') if m in sys.modules]\n"
+        "assert not heavy, heavy\n"
+        "assert not gams.is_loaded()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_ready():
+    with TestClient(api) as client:
+        deadline = time.monotonic() + 60
+        response = client.get("/ready")
+        while response.status_code == 503 and time.monotonic() < deadline:
+            assert response.json()["Ready"] is False
+            time.sleep(0.1)
+            response = client.get("/ready")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["Ready"] and body["ModelsLoaded"]
+    assert len(body["Assets"]["sha256"]) == 64
+    assert {"load models", "start pool", "ready"} <= set(body["Startup"])
+    assert startup.is_ready()
+
+
+def test_ready_warm_up_failed(monkeypatch, caplog):
+    def load():
+        raise FileNotFoundError("no assets")
+
+    monkeypatch.setattr(startup, "_ready", threading.Event())
+    monkeypatch.setattr(startup, "_error", None)
+    monkeypatch.setattr(gams, "load", load)
+
+    with TestClient(api) as client:
+        deadline = time.monotonic() + 60
+        while startup.failure() is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+        response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json()["Error"] == "FileNotFoundError: no assets"
+    assert "Warm-up failed" in caplog.text
@@ -0,0 +1,139 @@
+import asyncio
+import io
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from app.main import api
+from app.Fixtures.constants import STREAM_CHUNK_SIZE
+from app.prediction.stream import chunk_stream, score_file
+
+client = TestClient(api)
+
+patient = {
+    "Age": 62,
+    "ASA": 2,
+    "HR": 95,
+    "SBP": 110,
+    "WCC": 9,
+    "Na": 138,
+    "K": 4.1,
+    "Urea": 6,
+    "Creat": 80,
+    "GCS": 15,
+    "Resp": 1,
+    "Cardio": 1,
+    "Arrhythmia": False,
+    "CT_performed": True,
+    "Indication": 2,
+    "Malignancy": 0,
+    "Soiling": 1,
+}
+
+cohort = [
+    json.dumps(dict(patient, Lactate=1.8, Albumin=38)),
+    "",
+    "not json",
+    json.dumps(dict(patient, ASA=10)),
+    json.dumps(dict(patient, Albumin=30)),
+]
+
+
+def test_predict_stream():
+    body = "\n".join(cohort) + "\n"
+    response = client.post(
+        "/predict/stream",
+        data=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["Line"] for r in results] == [1, 3, 4, 5]
+    assert results[1]["Status"] == 422
+    assert results[2]["Status"] == 400 and "ASA" in results[2]["Error"]
+
+    for result, record in zip([results[0], results[3]], [cohort[0], cohort[4]]):
+        single = client.post("/predict", json=json.loads(record)).json()
+        assert result["Summary"] == single["Summary"]
+
+
+@pytest.fixture(scope="module")
+def server():
+    """the API served by uvicorn, which unlike TestClient doesn't buffer the
+    whole request body before the response starts"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:api", "--port", str(port)],
+        cwd=Path(__file__).parents[1],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"{url}/ready").status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_predict_stream_server(server):
+    n_records = 2 * STREAM_CHUNK_SIZE + 88
+    lines = [
+        json.dumps(dict(patient, Lactate=1 + i / n_records, Albumin=38)) + "\n"
+        for i in range(n_records)
+    ]
+
+    # with a Content-Length, then a chunked upload
+    for body in ("".join(lines), (line.encode() for line in lines)):
+        response = requests.post(
+            f"{server}/predict/stream?draws=100", data=body, timeout=60
+        )
+
+        assert response.status_code == 200
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["Line"] for r in results] == list(range(1, n_records + 1))
+        assert all(r["Draws"] == 100 for r in results)
+
+
+def test_chunk_stream():
+    async def body():
+        data = b'{"a": 1}\n\n{"b"' + b": 2}\n" + b"x" * 100 + b"\n{}"
+        for i in range(0, len(data), 7):
+            yield data[i : i + 7]
+
+    async def collect():
+        return [chunk async for chunk in chunk_stream(body(), 2, max_record_bytes=50)]
+
+    chunks = asyncio.run(collect())
+
+    assert [[line for line, _ in chunk] for chunk in chunks] == [[1, 3], [4, 5]]
+    assert chunks[0][1][1] == '{"b": 2}'
+    assert chunks[1][0][1] == "x" * 50
+
+
+def test_score_file():
+    output = io.StringIO()
+    score_file(io.StringIO("\n".join(cohort)), output, chunk_size=2)
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [r["Line"] for r in lines] == [1, 3, 4, 5]
+    assert "Summary" in lines[0] and "Summary" in lines[3]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from app.prediction.summary import summarise_samples, summarise_ragged
+
+
+def test_summarise_samples_matches_numpy():
+    samples = np.random.RandomState(0).beta(2, 20, size=10000)
+
+    summary = summarise_samples(samples, thresholds=(0.05, 0.1))
+
+    lower, median, upper = summary["Quantiles"]
+    assert lower == np.percentile(samples, 2.5)
+    assert np.isclose(median, np.median(samples), rtol=0, atol=1e-15)
+    assert upper == np.percentile(samples, 97.5)
+    assert summary["Mean"] == np.mean(samples)
+    assert summary["Exceedance"][1] == np.mean(samples > 0.1)
+
+
+def test_summarise_samples_batch():
+    samples = np.random.RandomState(0).beta(2, 20, size=(5, 1000))
+
+    summary = summarise_samples(samples, quantiles=(0.1, 0.9))
+
+    assert summary["Quantiles"].shape == (2, 5)
+    for i, patient in enumerate(samples):
+        assert np.array_equal(
+            summary["Quantiles"][:, i], np.quantile(patient, (0.1, 0.9))
+        )
+
+
+def test_summarise_ragged():
+    rnd = np.random.RandomState(0)
+    results = [rnd.uniform(size=n) for n in (100, 1000, 100, 10)]
+
+    summaries = summarise_ragged(results)
+
+    for result, quantiles in zip(results, summaries):
+        assert np.array_equal(quantiles, np.quantile(result, (0.025, 0.5, 0.975)))
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import QuantileTransformer
+
+from app.Fixtures.gams import LACTATE_TRANSFORMER, ALBUMIN_TRANSFORMER
+from app.prediction.transform import InverseQuantileTransform, inverse_transform
+
+
+@pytest.mark.parametrize("transformer", [LACTATE_TRANSFORMER, ALBUMIN_TRANSFORMER])
+@pytest.mark.parametrize("shape", [(7,), (300, 10)])
+def test_matches_sklearn(transformer: QuantileTransformer, shape):
+    y = np.random.default_rng(1).normal(scale=2, size=shape)
+    y.flat[:3] = [-8.0, 8.0, 0.0]  # beyond the bounds, and the median
+    expected = transformer.inverse_transform(y.reshape(-1, 1)).reshape(shape)
+    np.testing.assert_array_equal(inverse_transform(transformer)(y), expected)
+
+
+def test_uniform_output_distribution():
+    x = np.random.default_rng(2).lognormal(size=(2000, 1))
+    transformer = QuantileTransformer(n_quantiles=500).fit(x)
+    u = np.r_[0.0, 1.0, -0.5, 1.5, np.linspace(0, 1, 997)]
+    np.testing.assert_array_equal(
+        inverse_transform(transformer)(u),
+        transformer.inverse_transform(u.reshape(-1, 1)).ravel(),
+    )
+
+
+def test_irregular_references():
+    references = np.sort(np.random.default_rng(3).uniform(size=100))
+    references[[0, -1]] = 0, 1
+    quantiles = np.cumsum(np.random.default_rng(4).uniform(size=100))
+    inverse = InverseQuantileTransform(quantiles, references, "uniform")
+    assert not inverse.uniform_grid
+
+    u = np.linspace(0.001, 0.999, 1000)
+    np.testing.assert_array_equal(inverse(u), np.interp(u, references, quantiles))